@@ -0,0 +1,76 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+LOCATION = {"country": "United Kingdom", "city": "London", "lat": 51.5072, "lng": -0.1276}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammers datastore lookups from a thread pool", allow_abbrev=False)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["KEYBOARD_FORECAST_DATA_DIR"] = data_dir
+        os.environ["DAYTIME_SOURCE"] = "solar"
+        os.environ["LOCATION_CACHE_TTL_SECONDS"] = "0"  # Every lookup revalidates the location file
+        with open(os.path.join(data_dir, "current_loc.json"), "w") as f:
+            json.dump(LOCATION, f)
+
+        import datastore
+        import forelogger as log
+
+        log.init(log.SinkType.STD_OUT)
+        datastore.init()
+        dates = [datetime.date(2024, 1, 1) + datetime.timedelta(days=i) for i in range(366)]
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            expected = {date: datastore.get_daytime(date) for date in dates}
+            stop_writer = threading.Event()
+            writer = threading.Thread(target=_rewrite_location, args=(Path(data_dir), stop_writer))
+            writer.start()
+            try:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                    mismatches = sum(pool.map(lambda _: _lookup(datastore, dates, expected), range(args.iterations)))
+                elapsed = time.perf_counter() - started
+            finally:
+                stop_writer.set()
+                writer.join()
+            log.flush()
+
+    print(f"{args.iterations} lookups on {args.threads} threads in {elapsed:.3f}s")
+    print(f"{elapsed / args.iterations * 1e6:.1f} us per get_location + get_daytime pair")
+    print(f"{mismatches} mismatched results")
+    sys.exit(1 if mismatches else 0)
+
+
+def _lookup(datastore, dates, expected) -> int:
+    date = random.choice(dates)
+    location_ok = datastore.get_location() == LOCATION
+    daytime_ok = datastore.get_daytime(date) == expected[date]
+    return int(not (location_ok and daytime_ok))
+
+
+def _rewrite_location(data_dir: Path, stop: threading.Event):
+    import storage
+
+    # Rewrites the same content, so readers must never observe anything but the full file
+    backend = storage.Storage(data_dir)
+    while not stop.is_set():
+        backend.write_json("current_loc.json", LOCATION)
+
+
+if __name__ == "__main__":
+    main()
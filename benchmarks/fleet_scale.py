@@ -0,0 +1,78 @@
+import argparse
+import collections
+import contextlib
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from startup import FakeResponse  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures fleet polling cost against the subscriber count", allow_abbrev=False
+    )
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--cities", type=int, default=50)
+    parser.add_argument("--spread-degrees", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Cities sit along the local noon meridian, so every cell polls the weather
+    now = datetime.datetime.now(datetime.timezone.utc)
+    noon_lng = ((12 - now.hour - now.minute / 60) * 15 + 180) % 360 - 180
+    random.seed(1)
+    cities = [(random.uniform(-40, 40), noon_lng + random.uniform(-5, 5)) for _ in range(args.cities)]
+    calls = collections.Counter()
+
+    def fake_get(url: str, **kwargs):
+        calls["weather"] += 1
+        return FakeResponse({"weather": [{"id": 800}], "clouds": {"all": 90}})
+
+    def fake_post(url: str, **kwargs):
+        calls["webhook"] += 1
+        return FakeResponse({})
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["KEYBOARD_FORECAST_DATA_DIR"] = data_dir
+        os.environ.setdefault("WEATHER_API_KEY", "benchmark")
+
+        import datastore
+        import fleet
+        import forelogger as log
+        import httpclient
+
+        httpclient.get = fake_get
+        httpclient.post = fake_post
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            log.init(log.SinkType.STD_OUT)
+            datastore.init()
+
+            subscribers = []
+            for i in range(args.subscribers):
+                lat, lng = random.choice(cities)
+                lat += random.uniform(-args.spread_degrees, args.spread_degrees)
+                lng += random.uniform(-args.spread_degrees, args.spread_degrees)
+                subscribers.append(fleet.Subscriber(f"sub{i}", lat, lng, fleet.WebhookSink("http://localhost/hook")))
+
+            started = time.perf_counter()
+            cells = fleet.group_by_cell(subscribers, datastore.get_fleet_grid_decimals())
+            grouped = time.perf_counter() - started
+            for cell in cells:
+                fleet.poll(cell)
+            fleet._EXECUTOR.shutdown(wait=True)
+            polled = time.perf_counter() - started - grouped
+            log.flush()
+
+    print(f"{args.subscribers} subscribers in {len(cells)} cells, grouped in {grouped * 1e3:.1f} ms")
+    print(f"one round: {calls['weather']} weather calls, {calls['webhook']} webhook calls in {polled * 1e3:.1f} ms")
+    print(f"without grouping it would take {args.subscribers} weather calls")
+
+
+if __name__ == "__main__":
+    main()
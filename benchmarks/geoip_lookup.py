@@ -0,0 +1,104 @@
+import argparse
+import bisect
+import contextlib
+import csv
+import ipaddress
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from startup import FakeResponse  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks and times lookups in a synthetic geolocation database", allow_abbrev=False
+    )
+    parser.add_argument("--ranges", type=int, default=200000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+
+    import geoip
+
+    random.seed(1)
+    bounds = sorted(random.sample(range(1, 2**32 - 1), 2 * args.ranges))
+    # Every other interval is a gap, so misses are checked as well
+    ranges = [(bounds[i], bounds[i + 1], f"City{i // 2 % 5000}") for i in range(0, len(bounds), 2)]
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        csv_path = Path(data_dir) / "ranges.csv"
+        with csv_path.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "ip_from",
+                    "ip_to",
+                    "country_code",
+                    "country_name",
+                    "region_name",
+                    "city_name",
+                    "latitude",
+                    "longitude",
+                ]
+            )
+            for start, end, city in ranges:
+                writer.writerow([start, end, "XX", "Testland", "Region", city, "12.5", "-45.25"])
+            writer.writerow(["0", str(2**128 - 1), "-", "-", "-", "-", "0", "0"])  # IPv6 ranges are skipped
+
+        database_path = Path(data_dir) / "geoip.bin"
+        started = time.perf_counter()
+        count = geoip.build(csv_path, database_path)
+        built = time.perf_counter() - started
+        database = geoip.GeoIpDatabase(database_path)
+
+        starts = [start for start, _, _ in ranges]
+        probes = [random.randrange(2**32) for _ in range(args.lookups)]
+        mismatches = 0
+        for value in probes[:10000]:
+            index = bisect.bisect_right(starts, value) - 1
+            expected = ranges[index][2] if index >= 0 and value <= ranges[index][1] else None
+            found = database.lookup(str(ipaddress.IPv4Address(value)))
+            mismatches += (found["city"] if found else None) != expected
+        addresses = [str(ipaddress.IPv4Address(value)) for value in probes]
+        started = time.perf_counter()
+        for address in addresses:
+            database.lookup(address)
+        elapsed = time.perf_counter() - started
+        database.close()
+
+        switched = _check_ip_change(data_dir, ranges, database_path)
+
+    print(f"{count} ranges built in {built:.2f}s")
+    print(f"{elapsed / args.lookups * 1e6:.2f} us per lookup, {mismatches} mismatches against a brute-force search")
+    print(f"location switched after a public IP change: {switched}")
+    sys.exit(1 if mismatches or not switched else 0)
+
+
+def _check_ip_change(data_dir: str, ranges: list[tuple[int, int, str]], database_path: Path) -> bool:
+    os.environ["KEYBOARD_FORECAST_DATA_DIR"] = data_dir
+    os.environ["GEOIP_DATABASE"] = str(database_path)
+    os.environ["LOCATION_CACHE_TTL_SECONDS"] = "0"
+    public_ip = [str(ipaddress.IPv4Address(ranges[0][0]))]
+
+    import datastore
+    import forelogger as log
+    import httpclient
+
+    httpclient.get = lambda url, **kwargs: FakeResponse(public_ip[0])
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        log.init(log.SinkType.STD_OUT)
+        datastore.init()
+        before = datastore.get_location()
+        public_ip[0] = str(ipaddress.IPv4Address(ranges[1][0]))
+        after = datastore.refresh_location()
+        log.flush()
+    return (before["city"], after["city"]) == (ranges[0][2], ranges[1][2])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures history appends and range queries", allow_abbrev=False)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--max-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    import history
+
+    random.seed(1)
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    step = datetime.timedelta(minutes=5)
+    backups = args.records * 33 // args.max_bytes + 1  # Enough to keep everything
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["KEYBOARD_FORECAST_DATA_DIR"] = data_dir
+        import forelogger as log
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            log.init(log.SinkType.STD_OUT)
+            store = history.HistoryStore(Path(data_dir) / "history.bin", args.max_bytes, backups)
+            records = [
+                history.HistoryRecord(
+                    start + i * step,
+                    random.choice(["openweathermap", "weatherapi"]),
+                    random.choice([500, 701, 800, 804, 1135]),
+                    random.randrange(101),
+                    random.random() < 0.4,
+                    random.uniform(80, 400),
+                    random.choice(list(history.Action)),
+                )
+                for i in range(args.records)
+            ]
+            started = time.perf_counter()
+            for record in records:
+                store.append(record)
+            appended = time.perf_counter() - started
+
+            mismatches = 0
+            started = time.perf_counter()
+            for _ in range(args.queries):
+                since = start + random.randrange(args.records) * step
+                until = since + datetime.timedelta(days=random.randint(0, 3))
+                found = store.query(since, until)
+                expected = [record for record in records if since <= record.timestamp <= until]
+                mismatches += [r.timestamp for r in found] != [r.timestamp for r in expected]
+            queried = time.perf_counter() - started
+
+            out = io.StringIO()
+            started = time.perf_counter()
+            store.export_csv(out)
+            exported = time.perf_counter() - started
+            files = len(list(Path(data_dir).glob("history.bin*")))
+            log.flush()
+
+    print(f"{args.records} records in {files} files, {appended / args.records * 1e6:.1f} us per append")
+    print(f"{queried / args.queries * 1e3:.2f} ms per range query (including the brute-force check)")
+    print(f"CSV export of {out.getvalue().count(chr(10)) - 1} rows in {exported * 1e3:.0f} ms, {mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import forelogger as log  # noqa: E402
+import keyboard  # noqa: E402
+
+
+class FakeTransport(keyboard.Transport):
+    def __init__(self, open_delay: float):
+        self.opens = 0
+        self.sent: list[bytes] = []
+        self.__open_delay = open_delay
+
+    def open(self):
+        # Stands in for device enumeration and report discovery
+        time.sleep(self.__open_delay)
+        self.opens += 1
+
+    def send(self, payload: bytes):
+        self.sent.append(bytes(payload))
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures keyboard.toggle_backlight send latency", allow_abbrev=False)
+    parser.add_argument("--iterations", type=int, default=10000)
+    parser.add_argument("--open-delay-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    log.init(log.SinkType.STD_OUT)
+    transport = FakeTransport(args.open_delay_ms / 1000)
+    keyboard.use_transport(transport)
+
+    latencies = []
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        for i in range(args.iterations):
+            if i % 1000 == 999:
+                keyboard.invalidate()  # What the service does on a disconnect
+            started = time.perf_counter()
+            keyboard.toggle_backlight(i % 2 == 0, force=True)
+            latencies.append(time.perf_counter() - started)
+        log.flush()
+
+    latencies.sort()
+    print(f"{args.iterations} sends, {transport.opens} device opens")
+    print(
+        f"p50 {latencies[len(latencies) // 2] * 1e6:.1f} us, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f} us"
+    )
+    print(f"mean {statistics.fmean(latencies) * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
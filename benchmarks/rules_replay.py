@@ -0,0 +1,75 @@
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+# Condition codes openweathermap actually reports
+_CODES = [200, 211, 300, 500, 501, 502, 511, 520, 600, 601, 701, 711, 741, 800, 801, 802, 803, 804]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays a synthetic observation series through the rules", allow_abbrev=False
+    )
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--samples-per-day", type=int, default=288)
+    args = parser.parse_args()
+
+    random.seed(1)
+    size = args.days * args.samples_per_day
+    codes = [random.choice(_CODES) for _ in range(size)]
+    clouds = [random.randrange(101) for _ in range(size)]
+    thresholds = list(range(50, 95, 5))
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["KEYBOARD_FORECAST_DATA_DIR"] = data_dir
+        import datastore
+        import forelogger as log
+        import rules
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            log.init(log.SinkType.STD_OUT)
+            datastore.init()
+            rule_set = rules.for_provider("openweathermap")
+            log.flush()
+
+    started = time.perf_counter()
+    per_call = {
+        threshold: [_branchy_is_dark(code, cloud, threshold) for code, cloud in zip(codes, clouds)]
+        for threshold in thresholds
+    }
+    branchy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    swept = rule_set.sweep(codes, clouds, thresholds)
+    batch = time.perf_counter() - started
+
+    mismatches = sum(per_call[threshold] != swept[threshold] for threshold in thresholds)
+    print(f"{size} observations x {len(thresholds)} cloud thresholds")
+    print(f"per-call helpers: {branchy * 1e3:.0f} ms, batch sweep: {batch * 1e3:.0f} ms ({branchy / batch:.1f}x)")
+    for threshold in thresholds:
+        print(f"  threshold {threshold}%: dark {sum(swept[threshold]) / size:.1%} of the time")
+    print(f"{mismatches} thresholds with mismatched verdicts")
+    sys.exit(1 if mismatches else 0)
+
+
+def _branchy_is_dark(condition_id: int, cloud_pct: int, threshold: int) -> bool:
+    # What weather.py used to do for every observation
+    if (
+        711 <= condition_id <= 781
+        or 600 <= condition_id <= 622
+        or 502 <= condition_id <= 531
+        or 200 <= condition_id <= 232
+    ):
+        return True
+    return cloud_pct >= threshold
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from keyboard_send import FakeTransport  # noqa: E402
+
+_IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {src!r})
+started = time.perf_counter()
+import forecaster
+elapsed = time.perf_counter() - started
+print(elapsed, "requests" in sys.modules)
+"""
+
+
+class FakeResponse:
+    def __init__(self, payload: dict | str):
+        self.status_code = 200
+        self.text = payload if isinstance(payload, str) else json.dumps(payload)
+        self.__payload = payload
+
+    def json(self) -> dict | str:
+        return self.__payload
+
+
+class StopListener:
+    # Stands in for the service queue: the first sleep ends the run
+    def __init__(self):
+        self.slept_at: float | None = None
+
+    def sleep_until(self, until: datetime.datetime):
+        return self.__stop()
+
+    def sleep_for(self, duration: datetime.timedelta):
+        return self.__stop()
+
+    def sleep_forever(self):
+        return self.__stop()
+
+    def __stop(self):
+        from events import Event, IncomingEvent
+
+        self.slept_at = time.perf_counter()
+        return Event(IncomingEvent.TERMINATION)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the forecaster startup time", allow_abbrev=False)
+    parser.add_argument("--import-runs", type=int, default=10)
+    args = parser.parse_args()
+
+    import_times = []
+    requests_imported = False
+    for _ in range(args.import_runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _IMPORT_SCRIPT.format(src=str(SRC_DIR))],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        import_times.append(float(output[0]))
+        requests_imported = requests_imported or output[1] == "True"
+
+    first_iteration, http_calls, sends = _measure_first_iteration()
+
+    print(f"import forecaster: median {statistics.median(import_times) * 1e3:.1f} ms over {args.import_runs} runs")
+    print(f"requests imported eagerly: {requests_imported}")
+    print(f"first control loop iteration: {first_iteration * 1e3:.1f} ms, {http_calls} HTTP calls, {sends} sends")
+
+
+def _measure_first_iteration() -> tuple[float, int, int]:
+    # Places the location at local noon, so the first iteration always reaches the weather check
+    now = datetime.datetime.now(datetime.timezone.utc)
+    lng = round(((12 - now.hour - now.minute / 60) * 15 + 180) % 360 - 180, 4)
+    calls = []
+
+    def fake_get(url: str, **kwargs):
+        calls.append(url)
+        if "ip2location" in url:
+            return FakeResponse({"country_name": "Nowhere", "city_name": "Noon", "latitude": 0.0, "longitude": lng})
+        return FakeResponse({"weather": [{"id": 800}], "clouds": {"all": 10}})
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["KEYBOARD_FORECAST_DATA_DIR"] = data_dir
+        os.environ["DAYTIME_SOURCE"] = "solar"
+        os.environ.setdefault("WEATHER_API_KEY", "benchmark")
+
+        started = time.perf_counter()
+        import forecaster
+        import forelogger as log
+        import httpclient
+        import keyboard
+
+        httpclient.get = fake_get
+        transport = FakeTransport(open_delay=0)
+        keyboard.use_transport(transport)
+        listener = StopListener()
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            log.init(log.SinkType.STD_OUT)
+            forecaster.init()
+            forecaster.validate()
+            try:
+                forecaster.run(listener)
+            except SystemExit:
+                pass
+            log.flush()
+
+    return listener.slept_at - started, len(calls), len(transport.sent)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import datetime
+import http.server
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import daytime  # noqa: E402
+import simulation  # noqa: E402
+
+HOSTS = (
+    "api.ip2location.io",
+    "api.ipify.org",
+    "api.sunrise-sunset.org",
+    "api.openweathermap.org",
+    "api.weatherapi.com",
+)
+
+
+class StubApiServer:
+    # Impersonates every API on one local port, the first path segment names the host being impersonated.
+    # The answers come from a simulation.StubSession, which can be swapped to follow a virtual clock
+
+    def __init__(self, session: simulation.StubSession):
+        self.session = session
+        self.__server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="stub-api", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def host_overrides(self) -> str:
+        # The value for HTTP_HOST_OVERRIDES
+        return ",".join(f"{host}={self.base_url}/{host}" for host in HOSTS)
+
+    def start(self) -> "StubApiServer":
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __handler(self) -> type:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+            # Headers and body go out in separate writes, Nagle and delayed ACKs would add 40 ms to every answer
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                host, _, rest = self.path.lstrip("/").partition("/")
+                resp = server.session.request("GET", f"https://{host}/{rest}")
+                body = resp.text.encode("utf-8")
+                self.send_response(resp.status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def noon_place() -> dict:
+    # Places the location at local noon, so every run reaches the weather check however late it is
+    now = datetime.datetime.now(datetime.timezone.utc)
+    lng = round(((12 - now.hour - now.minute / 60) * 15 + 180) % 360 - 180, 4)
+    return {"country": "Nowhere", "city": "Noon", "lat": 45.0, "lng": lng, "ip": "192.0.2.1"}
+
+
+def session_for(place: dict, clock: daytime.Clock | None = None, days: int = 7) -> simulation.StubSession:
+    clock = clock or daytime.Clock()
+    start = clock.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return simulation.StubSession(
+        clock,
+        simulation.WeatherTrace.synthetic(start, days, seed=0),
+        simulation.DaytimeTrace(place["lat"], place["lng"]),
+        place,
+    )
@@ -0,0 +1,233 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCHMARKS_DIR.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+import stub_api  # noqa: E402
+from keyboard_send import FakeTransport  # noqa: E402
+
+_COLD_START_SCRIPT = """
+import sys, time
+sys.path[:0] = [{src!r}, {benchmarks!r}]
+import contextlib, os
+import forecaster, forelogger as log, keyboard
+from keyboard_send import FakeTransport
+from startup import StopListener
+
+class FirstSend(FakeTransport):
+    def send(self, payload):
+        self.sent_at = time.time()
+        super().send(payload)
+
+class UntilFirstSend(StopListener):
+    # The weather is fetched in the background, so the loop may sleep a few times before the first decision
+    def sleep_for(self, duration):
+        if hasattr(transport, "sent_at"):
+            return super().sleep_for(duration)
+        time.sleep(min(duration.total_seconds(), 0.01))
+        return None
+
+transport = FirstSend(open_delay=0)
+keyboard.use_transport(transport)
+with contextlib.redirect_stdout(open(os.devnull, "w")):
+    log.init(log.SinkType.STD_OUT)
+    forecaster.init()
+    forecaster.validate()
+    try:
+        forecaster.run(UntilFirstSend())
+    except SystemExit:
+        pass
+    log.flush()
+open({marker!r}, "w").write(str(getattr(transport, "sent_at", "nan")))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the end-to-end benchmarks against local API stubs", allow_abbrev=False
+    )
+    parser.add_argument("--output", type=Path, help="where to write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="results JSON to compare against, regressions fail the run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before it counts, 0.25 is 25%%")
+    parser.add_argument("--cold-runs", type=int, default=5)
+    parser.add_argument("--simulated-days", type=int, default=3)
+    parser.add_argument("--dates", type=int, default=200)
+    parser.add_argument("--sends", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5, help="the in-process loops keep their fastest round")
+    args = parser.parse_args()
+
+    place = stub_api.noon_place()
+    server = stub_api.StubApiServer(stub_api.session_for(place)).start()
+    env = {
+        "HTTP_HOST_OVERRIDES": server.host_overrides(),
+        "DAYTIME_SOURCE": "api",
+        "WEATHER_API_KEY": "benchmark",
+        "WEATHER_POLLING": "fixed",
+    }
+    results = {}
+    try:
+        results |= _cold_start(env, args.cold_runs)
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.environ.update(env, KEYBOARD_FORECAST_DATA_DIR=data_dir)
+            import forecaster
+            import forelogger as log
+
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                log.init(log.SinkType.STD_OUT)
+                forecaster.init()
+                results |= _keyboard_send(args.sends, args.repeat)
+                results |= _datastore(args.dates, args.repeat)
+                results |= _steady_state(server, place, args.simulated_days)  # Last, it ends with a termination
+                log.flush()
+    finally:
+        server.stop()
+
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    for name, value in results.items():
+        print(f"{name:40} {value:12.3f}")
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Wrote the results to {args.output}")
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())["results"]
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    # Every metric is a duration, so only getting slower counts. Tails are shown but not gated, a few hundred
+    # samples leave the p99 at the mercy of the scheduler
+    regressions = []
+    print(f"\n{"metric":40} {"baseline":>12} {"current":>12} {"change":>8}")
+    for name, value in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:40} {"":>12} {value:12.3f} {"new":>8}")
+            continue
+        change = value / previous - 1 if previous else 0.0
+        flag = ""
+        if change > tolerance:
+            gated = name.split(".")[-1].startswith(("p50_", "mean_"))
+            flag = "  REGRESSION" if gated else "  slower tail"
+            if gated:
+                regressions.append(name)
+        print(f"{name:40} {previous:12.3f} {value:12.3f} {change:+8.1%}{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {tolerance:.0%}: {", ".join(regressions)}")
+    else:
+        print(f"\nNo regressions beyond {tolerance:.0%}")
+    return regressions
+
+
+def _cold_start(env: dict[str, str], runs: int) -> dict[str, float]:
+    # A fresh interpreter and an empty data folder each time: location lookup, daytime, weather and the first send
+    times = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as data_dir:
+            # Background threads may still be logging to stdout, so the result goes to a file of its own
+            marker = Path(data_dir) / "sent_at"
+            script = _COLD_START_SCRIPT.format(src=str(SRC_DIR), benchmarks=str(BENCHMARKS_DIR), marker=str(marker))
+            launched = time.time()
+            subprocess.run(
+                [sys.executable, "-c", script],
+                env=os.environ | env | {"KEYBOARD_FORECAST_DATA_DIR": data_dir},
+                capture_output=True,
+                check=True,
+            )
+            times.append(float(marker.read_text()) - launched)
+    return _summary("cold_start_to_first_decision", times, "ms", (50, 90))
+
+
+def _keyboard_send(sends: int, repeat: int) -> dict[str, float]:
+    import keyboard
+
+    keyboard.use_transport(FakeTransport(open_delay=0))
+    latencies = _fastest(
+        repeat, lambda: _timed(lambda i: keyboard.toggle_backlight(i % 2 == 0, force=True), range(sends))
+    )
+    return _summary("keyboard_send", latencies, "us")
+
+
+def _datastore(dates: int, repeat: int) -> dict[str, float]:
+    import datastore
+
+    datastore.get_location()
+    days = [datetime.date(2030, 1, 1) + datetime.timedelta(days=i) for i in range(dates)]
+    misses = _timed(datastore.get_daytime, days)  # Each one is a sunrise-sunset request to the stub
+    hits = _fastest(repeat, lambda: _timed(datastore.get_daytime, days))
+    locations = _fastest(repeat, lambda: _timed(lambda _: datastore.get_location(), days))
+    return (
+        _summary("datastore_daytime_miss", misses, "ms")
+        | _summary("datastore_daytime_hit", hits, "us")
+        | _summary("datastore_location_hit", locations, "us")
+    )
+
+
+def _steady_state(server: stub_api.StubApiServer, place: dict, days: int) -> dict[str, float]:
+    # Runs the forecaster for whole days on a virtual clock against the stub server, every wakeup is one cycle
+    import daytime
+    import forecaster
+    import keyboard
+    import simulation
+    from events import EventListener, IncomingEvent
+
+    start = datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    clock = simulation.VirtualClock(start)
+    server.session = stub_api.session_for(place, clock, days)
+    daytime.use_clock(clock)
+    keyboard.use_transport(FakeTransport(open_delay=0))
+    pipeline = forecaster.create_event_pipeline()
+    clock.call_at(start + datetime.timedelta(days=days), lambda: pipeline.put(IncomingEvent.TERMINATION))
+    try:
+        forecaster.run(EventListener(pipeline))
+    except SystemExit:
+        pass
+    return _summary("steady_state_cycle", clock.busy[1:], "ms")  # The first one is the startup
+
+
+def _fastest(rounds: int, measure) -> list[float]:
+    # The round with the lowest median, the slower ones measured whatever else the machine was doing
+    return min((measure() for _ in range(rounds)), key=statistics.median)
+
+
+def _timed(call, args: Iterable) -> list[float]:
+    latencies = []
+    for arg in args:
+        started = time.perf_counter()
+        call(arg)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def _summary(
+    name: str, samples: list[float], unit: str, percentiles: tuple[int, ...] = (50, 90, 99)
+) -> dict[str, float]:
+    scale = {"ms": 1e3, "us": 1e6}[unit]
+    samples = sorted(samples)
+    summary = {}
+    for pct in percentiles:
+        summary[f"{name}.p{pct}_{unit}"] = samples[min(len(samples) - 1, int(len(samples) * pct / 100))] * scale
+    summary[f"{name}.mean_{unit}"] = statistics.fmean(samples) * scale
+    return summary
+
+
+if __name__ == "__main__":
+    main()
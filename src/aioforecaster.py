@@ -0,0 +1,197 @@
+import asyncio
+import datetime
+import threading
+from concurrent import futures
+from datetime import timedelta
+from typing import Callable
+
+import breaker
+import datastore
+import daytime
+import forecaster
+import forelogger as log
+import keyboard
+import location
+import metrics
+import polling
+import prefetch
+import weather
+from events import Event, EventListener, IncomingEvent
+from forelogger import format_month_day
+
+_LOCATION_REFRESH_INTERVAL = timedelta(hours=1)
+_WEATHER_PREWARM_LEAD = timedelta(minutes=2)
+
+
+def run(event_listener: EventListener):
+    asyncio.run(_run(event_listener))
+
+
+async def _run(event_listener: EventListener):
+    events: asyncio.Queue[Event] = asyncio.Queue()
+    threading.Thread(
+        target=_bridge, args=(event_listener, asyncio.get_running_loop(), events), name="events", daemon=True
+    ).start()
+
+    while True:
+        day = asyncio.create_task(_run_day())
+        event = await _first_event(day, events)
+        if event is None:
+            try:
+                day.result()
+                continue  # Midnight or a new location, either way the day is planned anew
+            except keyboard.DisconnectedException:
+                log.warn("Sleeping until the keyboard is reconnected")
+                event = await events.get()
+            except Exception as e:
+                log.error(f"Unhandled exception: {str(e)}")
+                delay = timedelta(seconds=round(_FAULT_BACKOFF.next_delay()))
+                log.info(f"Sleeping for {delay} and restarting the main loop")
+                event = await _next_event(events, delay)
+        if event is None:
+            continue
+        if event.type == IncomingEvent.TERMINATION:
+            _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+            forecaster.shutdown()
+        # The event loop clock may have stood still during a suspend, so a resume replans like a reconnect does
+        log.info(f"Woke up prematurely at {daytime.now()} because of {event.type} event, restarting the main loop")
+
+
+def _bridge(event_listener: EventListener, loop: asyncio.AbstractEventLoop, events: asyncio.Queue):
+    # The service thread feeds the blocking event pipeline, this hands every event over to the loop
+    while True:
+        event = event_listener.sleep_forever()
+        loop.call_soon_threadsafe(events.put_nowait, event)
+        if event.type == IncomingEvent.TERMINATION:
+            return
+
+
+async def _first_event(task: asyncio.Task, events: asyncio.Queue) -> Event | None:
+    # Returns the event that interrupted the task, or None once the task is done by itself
+    getter = asyncio.create_task(events.get())
+    done, _ = await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+    if getter in done:
+        await _cancel(task)
+        return getter.result()
+    getter.cancel()
+    return None
+
+
+async def _next_event(events: asyncio.Queue, timeout: timedelta) -> Event | None:
+    try:
+        return await asyncio.wait_for(events.get(), timeout.total_seconds())
+    except TimeoutError:
+        return None
+
+
+async def _cancel(task: asyncio.Task):
+    task.cancel()
+    # Blocking calls already running on the executor finish in the background, nothing waits for them
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def _run_day():
+    current_location, daytime_info = await _locate()
+    sun = asyncio.create_task(_follow_sun(current_location, daytime_info))
+    moved = asyncio.create_task(_watch_location(current_location))
+    try:
+        await asyncio.wait({sun, moved}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        await _cancel(sun)
+        await _cancel(moved)
+    for task in (sun, moved):
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+
+
+async def _locate() -> tuple[location.Location, daytime.Daytime]:
+    # The daytime and the weather both need the location, but not each other. With cold caches that makes the first
+    # cycle two round trips instead of three: the weather is fetched while the daytime is, as long as the estimate
+    # says the sun is up, and the first check then finds it in the weather cache
+    current_location = await _call(location.get)
+    estimate = daytime.get_today_cached()
+    now = daytime.now()
+    fetches = [_call(daytime.get_today)]
+    if estimate.sunrise <= now < estimate.sunset:
+        fetches.append(_call(weather.observe, current_location))
+    results = await asyncio.gather(*fetches, return_exceptions=True)
+    prefetch.daytime(now.date(), datastore.get_prefetch_days())
+
+    daytime_info = results[0]
+    if isinstance(daytime_info, Exception):
+        log.warn(f"Failed to get today's daytime data, going by the solar position: {daytime_info}")
+        daytime_info = estimate
+    log.info(f"We are in {current_location}")
+    log.info(f"Today is {format_month_day(now)}: sunrise at {daytime_info.sunrise}, sunset at {daytime_info.sunset}")
+    return current_location, daytime_info
+
+
+async def _follow_sun(current_location: location.Location, daytime_info: daytime.Daytime):
+    sunrise = daytime_info.sunrise
+    sunset = daytime_info.sunset
+    now = daytime.now()
+    schedule = polling.for_day(current_location, now.date())
+
+    if now < sunset:
+        if now < sunrise:
+            log.info(f"{now} is too early - entering sleep state")
+            await _sleep_until(sunrise - _WEATHER_PREWARM_LEAD)
+            prefetch.warm_weather(current_location)
+            await _sleep_until(sunrise)
+        while True:
+            try:
+                is_dark = await _check_weather(current_location)
+            except keyboard.DisconnectedException:
+                raise
+            except Exception as e:
+                retry_at = forecaster.weather_retry_at(e)
+                if retry_at >= sunset:
+                    break
+                await _sleep_until(retry_at)
+                continue
+            next_run = schedule.next_check(daytime.now(), is_dark)
+            if next_run >= sunset:
+                break
+            await _sleep_until(next_run)
+
+    await _sleep_until(sunset)
+    schedule.report(sunset)
+    log.info(f"The sun is down - turning on the backlight and entering sleep state")
+    await _call(keyboard.toggle_backlight, True, True)
+    log.info(f"Keyboard send latency: {keyboard.latency_report()}")
+    log.info(f"Circuit breakers: {breaker.report()}")
+    await _sleep_until(now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1))
+
+
+async def _watch_location(planned_location: location.Location):
+    while True:
+        await asyncio.sleep(_LOCATION_REFRESH_INTERVAL.total_seconds())
+        current_location = await _call(location.refresh)
+        if (current_location.lat, current_location.lng) != (planned_location.lat, planned_location.lng):
+            log.info(f"The location has changed to {current_location}, planning the day anew")
+            return
+
+
+async def _check_weather(cur_loc: location.Location) -> bool:
+    with metrics.timer("forecaster_check_seconds"):
+        observation = await _call(weather.observe, cur_loc)
+        sent = await _call(keyboard.toggle_backlight, observation.is_dark)
+    forecaster.record_check(observation, sent)
+    _FAULT_BACKOFF.reset()
+    return observation.is_dark
+
+
+async def _sleep_until(until: datetime.datetime):
+    delay = (until - daytime.now()).total_seconds()
+    if delay > 0:
+        log.info(f"Sleeping until {until}")
+        await asyncio.sleep(delay)
+
+
+async def _call(function: Callable, *args):
+    # Network and HID calls block, so they run on the engine's own threads while the loop keeps listening for events
+    return await asyncio.get_running_loop().run_in_executor(_EXECUTOR, function, *args)
+
+
+_FAULT_BACKOFF = breaker.Backoff()  # A successful check resets it
+_EXECUTOR = futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="engine")
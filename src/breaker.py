@@ -0,0 +1,148 @@
+import enum
+import random
+import threading
+from typing import Callable
+
+import daytime
+import forelogger as log
+import metrics
+
+
+class State(enum.Enum):
+    CLOSED = 0  # Calls go through
+    HALF_OPEN = 1  # One probe call is on its way, everyone else is turned away until it's back
+    OPEN = 2  # Calls are turned away until the backoff runs out
+
+
+class CircuitOpenException(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable, next attempt in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class Backoff:
+    # Exponential with equal jitter: half of every delay is random, so restarted services don't retry in lockstep
+
+    def __init__(self):
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        delay = min(_MAX_DELAY_SECONDS, _BASE_DELAY_SECONDS * 2**self.attempts)
+        self.attempts += 1
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, ignored: tuple[type[Exception], ...] = ()):
+        self.name = name
+        self.failures = 0  # In a row
+        self.__state = State.CLOSED
+        self.__retry_at = 0.0
+        self.__backoff = Backoff()
+        self.__ignored = ignored  # Outcomes that say nothing about the dependency's health
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> State:
+        return self.__state
+
+    def allows_calls(self) -> bool:
+        return self.__state == State.CLOSED or (self.__state == State.OPEN and daytime.monotonic() >= self.__retry_at)
+
+    def retry_in(self) -> float:
+        return max(0.0, self.__retry_at - daytime.monotonic()) if self.__state != State.CLOSED else 0.0
+
+    def call(self, function: Callable, *args):
+        self.__before_call()
+        try:
+            result = function(*args)
+        except self.__ignored:
+            self.__after_ignored()
+            raise
+        except Exception:
+            self.__after_failure()
+            raise
+        self.__after_success()
+        return result
+
+    def reset(self):
+        with self.__lock:
+            self.failures = 0
+            self.__backoff.reset()
+            self.__transition(State.CLOSED)
+
+    def __before_call(self):
+        with self.__lock:
+            if self.__state == State.CLOSED:
+                return
+            now = daytime.monotonic()
+            if self.__state == State.HALF_OPEN or now < self.__retry_at:
+                raise CircuitOpenException(self.name, max(0.0, self.__retry_at - now))
+            log.info(f"Probing {self.name}")
+            self.__transition(State.HALF_OPEN)
+
+    def __after_failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.__state == State.HALF_OPEN or self.failures >= _FAILURE_THRESHOLD:
+                delay = self.__backoff.next_delay()
+                self.__retry_at = daytime.monotonic() + delay
+                log.warn(f"{self.name} failed {self.failures} times in a row, leaving it alone for {delay:.0f}s")
+                metrics.inc("circuit_breaker_opened_total", dependency=self.name)
+                self.__transition(State.OPEN)
+
+    def __after_success(self):
+        with self.__lock:
+            if self.__state != State.CLOSED:
+                log.info(f"{self.name} is back after {self.failures} failures")
+            self.failures = 0
+            self.__backoff.reset()
+            self.__transition(State.CLOSED)
+
+    def __after_ignored(self):
+        with self.__lock:
+            if self.__state == State.HALF_OPEN:
+                self.__transition(State.OPEN)  # The probe told nothing, the next call probes again
+
+    def __transition(self, state: State):
+        self.__state = state
+        metrics.gauge("circuit_breaker_state", state.value, dependency=self.name)
+
+    def __str__(self):
+        if self.__state == State.CLOSED:
+            return f"{self.name}: closed"
+        return f"{self.name}: {self.__state.name.lower()} after {self.failures} failures, next attempt in {self.retry_in():.0f}s"
+
+
+def get(name: str, ignored: tuple[type[Exception], ...] = ()) -> CircuitBreaker:
+    circuit_breaker = _BREAKERS.get(name)
+    if circuit_breaker is None:
+        with _BREAKERS_LOCK:
+            circuit_breaker = _BREAKERS.setdefault(name, CircuitBreaker(name, ignored))
+    return circuit_breaker
+
+
+def configure(failure_threshold: int, base_delay_seconds: float, max_delay_seconds: float):
+    global _FAILURE_THRESHOLD, _BASE_DELAY_SECONDS, _MAX_DELAY_SECONDS
+    _FAILURE_THRESHOLD = failure_threshold
+    _BASE_DELAY_SECONDS = base_delay_seconds
+    _MAX_DELAY_SECONDS = max_delay_seconds
+
+
+def states() -> dict[str, State]:
+    return {name: circuit_breaker.state for name, circuit_breaker in _BREAKERS.items()}
+
+
+def report() -> str:
+    return "; ".join(str(circuit_breaker) for circuit_breaker in _BREAKERS.values()) or "no dependencies called"
+
+
+_FAILURE_THRESHOLD = 3
+_BASE_DELAY_SECONDS = 30.0
+_MAX_DELAY_SECONDS = 1800.0
+_BREAKERS: dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
@@ -0,0 +1,104 @@
+import threading
+from concurrent import futures
+from typing import Callable, Hashable
+
+import daytime
+import forelogger as log
+import metrics
+
+
+class _Entry:
+    def __init__(self, value, stored_at: float):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class ResultCache:
+    def __init__(self, name: str, executor: futures.Executor):
+        self.name = name
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.__executor = executor
+        self.__entries: dict[Hashable, _Entry] = {}
+        self.__in_flight: dict[Hashable, futures.Future] = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable, ttl: float, stale_ttl: float, fetch: Callable[[], object], wait: bool = True):
+        # Fresh entries are returned as is, stale ones are returned while a refresh runs in the background,
+        # anything older waits for a fetch shared by all concurrent callers. Callers that can't wait get None and
+        # the fetch runs in the background
+        leader = False
+        stale = False
+        with self.__lock:
+            entry = self.__entries.get(key)
+            age = daytime.monotonic() - entry.stored_at if entry is not None else None
+            if age is not None and age < ttl:
+                self.hits += 1
+                metrics.inc("cache_requests_total", cache=self.name, result="hit")
+                return entry.value
+            if age is not None and age < stale_ttl:
+                self.stale_hits += 1
+                metrics.inc("cache_requests_total", cache=self.name, result="stale")
+                stale = True
+                if key not in self.__in_flight:
+                    log.info(f"Serving stale {self.name} data for {key} while refreshing it")
+                    future = self.__start_fetch(key)
+                    leader = True
+            else:
+                future = self.__in_flight.get(key)
+                if future is not None:
+                    self.coalesced += 1
+                    metrics.inc("cache_requests_total", cache=self.name, result="coalesced")
+                else:
+                    self.misses += 1
+                    metrics.inc("cache_requests_total", cache=self.name, result="miss")
+                    future = self.__start_fetch(key)
+                    leader = True
+        if stale or not wait:
+            # Submitted outside the lock, an executor that runs the refresh right away takes the lock as well
+            if leader:
+                self.__executor.submit(self.__refresh, key, fetch, future)
+            return entry.value if stale else None
+        if leader:
+            self.__fetch(key, fetch, future)
+        return future.result()
+
+    def peek(self, key: Hashable):
+        entry = self.__entries.get(key)
+        return entry.value if entry is not None else None
+
+    def invalidate(self, key: Hashable):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def __start_fetch(self, key: Hashable) -> futures.Future:
+        future = futures.Future()
+        self.__in_flight[key] = future
+        return future
+
+    def __refresh(self, key: Hashable, fetch: Callable[[], object], future: futures.Future):
+        self.__fetch(key, fetch, future)
+        if future.exception() is not None:
+            log.warn(f"Background refresh of {self.name} data for {key} failed: {future.exception()}")
+
+    def __fetch(self, key: Hashable, fetch: Callable[[], object], future: futures.Future):
+        started_at = daytime.monotonic()  # The data is as old as the request, however long the answer takes
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.__lock:
+                self.__in_flight.pop(key, None)
+            future.set_exception(e)
+            return
+        with self.__lock:
+            self.__entries[key] = _Entry(value, started_at)
+            self.__in_flight.pop(key, None)
+        future.set_result(value)
+
+    def __str__(self):
+        return (
+            f"{self.name} cache: {self.hits} hits, {self.stale_hits} stale hits, "
+            f"{self.misses} misses, {self.coalesced} coalesced"
+        )
@@ -0,0 +1,45 @@
+import argparse
+import os
+import signal
+import threading
+from pathlib import Path
+
+import fleet
+import forecaster
+import forelogger as log
+from events import EventListener, IncomingEvent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the forecaster in the foreground", allow_abbrev=False)
+    parser.add_argument("--fleet", action="store_true", help="serve the subscribers from fleet.json")
+    args = parser.parse_args()
+
+    if "LOG_FILE" in os.environ:
+        log.init(log.SinkType.FILE, file_path=Path(os.environ["LOG_FILE"]))
+    else:
+        log.init(log.SinkType.STD_OUT)
+    forecaster.init()
+    forecaster.validate()
+
+    events = forecaster.create_event_pipeline()
+
+    def terminate(signum, frame):
+        log.info(f"Received {signal.Signals(signum).name}, stopping forecaster")
+        events.put(IncomingEvent.TERMINATION)
+
+    signal.signal(signal.SIGINT, terminate)
+    signal.signal(signal.SIGTERM, terminate)
+
+    log.info("Starting " + ("fleet" if args.fleet else "forecaster"))
+    target = fleet.run if args.fleet else forecaster.run
+    forecaster_thread = threading.Thread(target=target, args=(EventListener(events),))
+    forecaster_thread.start()
+    while forecaster_thread.is_alive():
+        forecaster_thread.join(timeout=1)  # Keeps the main thread responsive to signals
+    log.info(str(events))
+    log.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,333 @@
-import contextlib
 import datetime
+import enum
 import json
 import os
+import re
+import threading
+import time
 from pathlib import Path, PosixPath, WindowsPath
+from typing import TYPE_CHECKING, Iterator
 
-import requests
-
+import breaker
+import daytable
 import forelogger as log
+import httpclient
+import metrics
+import solar
+import storage
 from forelogger import format_month_day
 
+if TYPE_CHECKING:
+    import geoip
+
+
+class DaytimeSource(enum.Enum):
+    API = "api"  # sunrise-sunset.org only
+    SOLAR = "solar"  # Local solar calculator only, no network
+    SOLAR_CHECKED = "solar_checked"  # Local solar calculator, cross-checked against sunrise-sunset.org
+
+
+class PollingMode(enum.Enum):
+    FIXED = "fixed"  # Check the weather every WEATHER_CHECK_INTERVAL_MINUTES
+    ADAPTIVE = "adaptive"  # Check it densely only around the transitions predicted by the forecast
+
+
+class Engine(enum.Enum):
+    THREADED = "threaded"  # One blocking loop on the forecaster thread
+    ASYNCIO = "asyncio"  # An event loop on the forecaster thread, the network and HID calls overlap
 
-@contextlib.contextmanager
-def _config_cwd(path_inside_data_dir: Path | None = None):
-    oldpwd = os.getcwd()
-    if path_inside_data_dir is None:
-        os.chdir(_data_dir())
-    else:
-        os.chdir(os.path.join(_data_dir(), path_inside_data_dir))
-    try:
-        yield
-    finally:
-        os.chdir(oldpwd)
+
+class _LocationCache:
+    def __init__(self):
+        self.__location = None
+        self.__file_signature = None
+        self.__expires_at = 0.0
+        self.__lock = threading.Lock()
+
+    def get(self) -> dict[str, str]:
+        location = self.__location
+        if location is not None and time.monotonic() < self.__expires_at:
+            return location
+
+        with self.__lock:
+            location_path = _STORAGE.path(_LOCATION_FILE_NAME)
+            signature = _file_signature(location_path)
+            if self.__location is None or signature is None or signature != self.__file_signature:
+                self.__location = _load_location()
+                signature = _file_signature(location_path)
+            self.__file_signature = signature
+            self.__expires_at = time.monotonic() + _LOCATION_CACHE_TTL_SECONDS
+            return self.__location
+
+    def invalidate(self):
+        with self.__lock:
+            self.__location = None
+            self.__file_signature = None
 
 
-@_config_cwd()
 def get_location() -> dict[str, str]:
-    loc_file = Path("current_loc.json")
-    try:
-        with loc_file.open() as f:
-            cur_loc_json = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        if isinstance(e, json.JSONDecodeError):
-            log.warn("Current location file is not a valid JSON!")
-        log.info("Downloading the current location data")
-        cur_loc_json = _download_location()
-        with loc_file.open("w") as f:
-            json.dump(cur_loc_json, f, indent=4)
-        log.info("Downloaded and saved current location to file")
+    return _LOCATION_CACHE.get()
 
-    return cur_loc_json
+
+def refresh_location() -> dict[str, str]:
+    _LOCATION_CACHE.invalidate()
+    location = _LOCATION_CACHE.get()
+    if _geoip() is None:
+        return location  # A new address would only be sent to ip2location.io, the stored location is good enough
+    ip = _public_ip()
+    if ip is not None and ip != location.get("ip"):
+        # Travelling laptops keep the file from the first run forever otherwise
+        log.info(f"The public IP address has changed to {ip}, looking the location up again")
+        _STORAGE.write_json(_LOCATION_FILE_NAME, _locate(ip))
+        _LOCATION_CACHE.invalidate()
+        location = _LOCATION_CACHE.get()
+    return location
 
 
 def get_daytime(date: datetime.date) -> dict[str, str]:
-    daytime_file = Path(f"{date.month}_{date.day}.json")
-    with _config_cwd(_location_dir()):
-        try:
-            with daytime_file.open() as f:
-                daytime_json = json.load(f)
-            log.info(f"Loaded daytime data for {format_month_day(date)} from file")
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            if isinstance(e, json.JSONDecodeError):
-                log.warn(f"Daytime file for {format_month_day(date)} is not a valid JSON!")
-            log.info(f"Downloading daytime data for {format_month_day(date)}")
-            daytime_json = _download_daytime(date, get_location())
-            with daytime_file.open("w") as f:
-                json.dump(daytime_json, f, indent=4)
-            log.info(f"Downloaded and saved daytime data for {format_month_day(date)} to file")
+    location = get_location()
+    table = _daytime_table(location)
+    events = table.get(date)
+    if events is not None:
+        log.info(f"Loaded daytime data for {format_month_day(date)} from the daytime table")
+        return daytable.to_dict(events)
 
+    try:
+        with metrics.timer("daytime_fetch_seconds", source=_DAYTIME_SOURCE.value):
+            daytime_json = _fetch_daytime(table, date, location)
+    except breaker.CircuitOpenException as e:
+        # Close enough for now, and not stored, so the day is downloaded once the provider is back
+        log.warn(f"{e}, estimating daytime data for {format_month_day(date)} from the solar position")
+        return solar.daytime(date, float(location["lat"]), float(location["lng"]))
+    log.info(f"Saved daytime data for {format_month_day(date)} to the daytime table")
     return daytime_json
 
 
+def get_cached_daytime(date: datetime.date) -> dict[str, str]:
+    # Never waits on the network: a day that isn't in the table yet is estimated from the solar position
+    location = get_location()
+    events = _daytime_table(location).get(date)
+    if events is not None:
+        return daytable.to_dict(events)
+    log.info(f"No daytime data for {format_month_day(date)} yet, estimating it from the solar position")
+    return solar.daytime(date, float(location["lat"]), float(location["lng"]))
+
+
+def compact():
+    current_dir = _STORAGE.path(_location_dir(get_location()))
+    retention = datetime.timedelta(days=_LOCATION_RETENTION_DAYS)
+    for location_dir in _STORAGE.subdirs():
+        if location_dir == current_dir or not _is_location_dir(location_dir):
+            continue
+        last_update = datetime.datetime.fromtimestamp(_last_modified(location_dir))
+        if datetime.datetime.now() - last_update > retention:
+            log.info(f"Evicting daytime data for {location_dir.name}, last updated at {last_update}")
+            with _DAYTIME_TABLES_LOCK:
+                _close_daytime_table(location_dir)
+                _STORAGE.remove_dir(location_dir)
+        elif any(_daytime_json_files(location_dir)):
+            with _DAYTIME_TABLES_LOCK:
+                _migrate_daytime_json(_daytime_table_at(location_dir))
+                _close_daytime_table(location_dir)
+
+
+def get_device_configs() -> list[dict]:
+    try:
+        return _STORAGE.read_json(_DEVICES_FILE_NAME)
+    except FileNotFoundError:
+        return []
+
+
+def get_fleet_subscribers() -> list[dict]:
+    try:
+        return _STORAGE.read_json(_FLEET_FILE_NAME)
+    except FileNotFoundError:
+        return []
+
+
+def get_fleet_grid_decimals() -> int:
+    return _FLEET_GRID_DECIMALS
+
+
+def get_rules_config() -> dict:
+    try:
+        return _STORAGE.read_json(_RULES_FILE_NAME)
+    except FileNotFoundError:
+        return {}
+
+
+def get_history_path() -> Path:
+    return _STORAGE.path(_HISTORY_FILE_NAME)
+
+
+def get_history_max_bytes() -> int:
+    return _HISTORY_MAX_BYTES
+
+
+def get_history_backups() -> int:
+    return _HISTORY_BACKUPS
+
+
+def is_metrics_enabled() -> bool:
+    return _METRICS_ENABLED
+
+
+def get_metrics_port() -> int:
+    return _METRICS_PORT
+
+
+def get_metrics_snapshot_path() -> Path:
+    return _STORAGE.path(_METRICS_FILE_NAME)
+
+
+def get_metrics_snapshot_seconds() -> float:
+    return _METRICS_SNAPSHOT_SECONDS
+
+
 def get_weather_api_key() -> str:
     return _WEATHER_API_KEY
 
 
+def get_weatherapi_api_key() -> str:
+    return _WEATHERAPI_API_KEY
+
+
+def get_weather_providers() -> list[str]:
+    return _WEATHER_PROVIDERS
+
+
+def is_weather_hedging_enabled() -> bool:
+    return _WEATHER_HEDGING
+
+
+def get_weather_hedge_budget_seconds() -> float:
+    return _WEATHER_HEDGE_BUDGET
+
+
+def get_weather_stale_seconds() -> float:
+    return _WEATHER_STALE_SECONDS
+
+
 def get_weather_check_interval_minutes() -> int:
     return _WEATHER_CHECK_INTERVAL
 
 
+def get_weather_polling_mode() -> PollingMode:
+    return _WEATHER_POLLING_MODE
+
+
+def get_weather_max_check_interval_minutes() -> int:
+    return _WEATHER_MAX_CHECK_INTERVAL
+
+
+def get_weather_transition_window_minutes() -> int:
+    return _WEATHER_TRANSITION_WINDOW
+
+
+def get_event_debounce_seconds() -> float:
+    return _EVENT_DEBOUNCE_SECONDS
+
+
+def get_prefetch_days() -> int:
+    return _PREFETCH_DAYS
+
+
+def get_forecaster_engine() -> Engine:
+    return _FORECASTER_ENGINE
+
+
+def get_keyboard_send_timeout_seconds() -> float:
+    return _KEYBOARD_SEND_TIMEOUT_SECONDS
+
+
+def get_daytime_source() -> DaytimeSource:
+    return _DAYTIME_SOURCE
+
+
+def get_breaker_failure_threshold() -> int:
+    return _BREAKER_FAILURE_THRESHOLD
+
+
+def get_breaker_base_delay_seconds() -> float:
+    return _BREAKER_BASE_DELAY_SECONDS
+
+
+def get_breaker_max_delay_seconds() -> float:
+    return _BREAKER_MAX_DELAY_SECONDS
+
+
 def validate_config():
-    if os.getenv("WEATHER_API_KEY") is None:
-        raise Exception("Missing API key for weather checking (WEATHER_API_KEY)")
+    if os.getenv("WEATHER_API_KEY") is None and os.getenv("WEATHERAPI_API_KEY") is None:
+        raise Exception("Missing API key for weather checking (WEATHER_API_KEY or WEATHERAPI_API_KEY)")
+
+
+def _load_location() -> dict[str, str]:
+    try:
+        cur_loc_json = _STORAGE.read_json(_LOCATION_FILE_NAME)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        if isinstance(e, json.JSONDecodeError):
+            log.warn("Current location file is not a valid JSON!")
+        cur_loc_json = _locate(_public_ip() if _geoip() is not None else None)
+        _STORAGE.write_json(_LOCATION_FILE_NAME, cur_loc_json)
+        log.info("Saved current location to file")
+
+    return cur_loc_json
+
+
+def _file_signature(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _locate(ip: str | None) -> dict:
+    database = _geoip()
+    if ip is not None and database is not None:
+        location = database.lookup(ip)
+        if location is not None:
+            log.info(f"Found {ip} in the local geolocation database")
+            return location
+        log.warn(f"{ip} is not in the local geolocation database")
+    log.info("Downloading the current location data")
+    return _download_location()
+
+
+def _public_ip() -> str | None:
+    # Without an answer the stored location stays, an open circuit just means not asking for a while
+    try:
+        return breaker.get("public_ip").call(_download_public_ip)
+    except Exception as e:
+        log.warn(f"Failed to check the public IP address: {e}")
+        return None
+
+
+def _download_public_ip() -> str:
+    resp = httpclient.get(_PUBLIC_IP_URL)
+    if resp.status_code != 200:
+        raise Exception(f"Error is {resp.status_code} - '{resp.text}'")
+    return resp.text.strip()
+
+
+def _geoip() -> "geoip.GeoIpDatabase | None":
+    global _GEOIP
+    if _GEOIP is None and _GEOIP_PATH.is_file():
+        with _GEOIP_LOCK:
+            if _GEOIP is None:
+                import geoip
+
+                _GEOIP = geoip.GeoIpDatabase(_GEOIP_PATH)
+                log.info(f"Using the geolocation database at {_GEOIP_PATH} with {len(_GEOIP)} ranges")
+    return _GEOIP
 
 
 def _download_location() -> dict:
-    resp = requests.get("https://api.ip2location.io/")
+    return breaker.get("location").call(_request_location)
+
+
+def _request_location() -> dict:
+    resp = httpclient.get("https://api.ip2location.io/")
     if resp.status_code != 200:
         raise Exception(
             f"Failed to get current location by the IP address. Error is {resp.status_code} - '{resp.text}'"
@@ -85,16 +338,57 @@ def _download_location() -> dict:
         "city": loc_json["city_name"],
         "lat": loc_json["latitude"],
         "lng": loc_json["longitude"],
+        "ip": loc_json.get("ip"),
     }
 
 
+def _fetch_daytime(table: daytable.DaytimeTable, date: datetime.date, location: dict[str, str]) -> dict[str, str]:
+    if _DAYTIME_SOURCE == DaytimeSource.API:
+        log.info(f"Downloading daytime data for {format_month_day(date)}")
+        daytime_json = _download_daytime(date, location)
+        table.put(date, daytable.from_dict(daytime_json))
+        return daytime_json
+
+    log.info(f"Calculating daytime data for the whole {date.year}")
+    dates = solar.year_dates(date.year)
+    table.put_many(zip(dates, solar.SolarEvents(float(location["lat"]), float(location["lng"])).epochs(dates)))
+    daytime_json = daytable.to_dict(table.get(date))
+    if _DAYTIME_SOURCE == DaytimeSource.SOLAR_CHECKED:
+        _cross_check_daytime(date, location, daytime_json)
+    return daytime_json
+
+
+def _cross_check_daytime(date: datetime.date, location: dict[str, str], calculated: dict[str, str]):
+    try:
+        downloaded = _download_daytime(date, location)
+    except Exception as e:
+        log.warn(f"Couldn't cross-check daytime data for {format_month_day(date)}: {e}")
+        return
+
+    for key, value in calculated.items():
+        deviation = abs(_parse_timestamp(value) - _parse_timestamp(downloaded[key]))
+        if deviation > _DAYTIME_CROSS_CHECK_TOLERANCE:
+            log.warn(
+                f"Calculated {key} for {format_month_day(date)} is off by {deviation}: "
+                f"{value} calculated, {downloaded[key]} downloaded"
+            )
+
+
+def _parse_timestamp(s: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(s)
+
+
 def _download_daytime(date: datetime.date, location: dict[str, str]) -> dict[str, str]:
+    return breaker.get("daytime").call(_request_daytime, date, location)
+
+
+def _request_daytime(date: datetime.date, location: dict[str, str]) -> dict[str, str]:
     download_url = (
         "https://api.sunrise-sunset.org/json"
         f"?lat={location["lat"]}&lng={location["lng"]}"
         f"&date={date.year}-{date.month}-{date.day}&formatted=0"
     )
-    resp = requests.get(download_url)
+    resp = httpclient.get(download_url)
     if resp.status_code != 200:
         raise Exception(
             f"Failed to get daytime data for {format_month_day(date)}. Error is {resp.status_code} - '{resp.text}'"
@@ -109,12 +403,78 @@ def _download_daytime(date: datetime.date, location: dict[str, str]) -> dict[str
     }
 
 
-def _location_dir() -> Path:
-    location = get_location()
+def _location_dir(location: dict[str, str]) -> Path:
     return Path(f"{location["country"]}_{location["city"]}")
 
 
+def _daytime_table(location: dict[str, str]) -> daytable.DaytimeTable:
+    location_dir = _STORAGE.path(_location_dir(location))
+    table = _DAYTIME_TABLES.get(location_dir)
+    if table is not None:
+        return table
+
+    global _COMPACTED
+    with _DAYTIME_TABLES_LOCK:
+        if not _COMPACTED:
+            _COMPACTED = True
+            compact()
+        if location_dir not in _DAYTIME_TABLES:
+            os.makedirs(location_dir, exist_ok=True)
+            table = _daytime_table_at(location_dir)
+            if any(_daytime_json_files(location_dir)):
+                _migrate_daytime_json(table)
+        return _DAYTIME_TABLES[location_dir]
+
+
+def _is_location_dir(path: Path) -> bool:
+    # The data folder may hold other folders too, only the ones holding daytime data are ours to evict
+    if not _LOCATION_DIR_NAME.fullmatch(path.name):
+        return False
+    return (path / daytable.FILE_NAME).is_file() or any(_daytime_json_files(path))
+
+
+def _daytime_table_at(location_dir: Path) -> daytable.DaytimeTable:
+    if location_dir not in _DAYTIME_TABLES:
+        _DAYTIME_TABLES[location_dir] = daytable.DaytimeTable(location_dir / daytable.FILE_NAME)
+    return _DAYTIME_TABLES[location_dir]
+
+
+def _close_daytime_table(location_dir: Path):
+    table = _DAYTIME_TABLES.pop(location_dir, None)
+    if table is not None:
+        table.close()
+
+
+def _migrate_daytime_json(table: daytable.DaytimeTable):
+    json_files = list(_daytime_json_files(table.path.parent))
+    log.info(f"Migrating {len(json_files)} daytime files in {table.path.parent.name} to the daytime table")
+    rows = []
+    for json_file in json_files:
+        month, day = (int(part) for part in json_file.stem.split("_"))
+        try:
+            with json_file.open() as f:
+                events = daytable.from_dict(json.load(f))
+            # Files don't record the year they were downloaded for, the sunset is the closest hint
+            year = datetime.datetime.fromtimestamp(events[1], datetime.timezone.utc).year
+            rows.append((datetime.date(year, month, day), events))
+        except (json.JSONDecodeError, KeyError, ValueError) as e:
+            log.warn(f"Skipping daytime file {json_file.name} during migration: {e}")
+    table.put_many(rows)
+    for json_file in json_files:
+        json_file.unlink()
+
+
+def _daytime_json_files(location_dir: Path) -> Iterator[Path]:
+    return (path for path in location_dir.glob("*_*.json") if _DAYTIME_FILE_NAME.fullmatch(path.name))
+
+
+def _last_modified(location_dir: Path) -> float:
+    return max((path.stat().st_mtime for path in location_dir.iterdir()), default=location_dir.stat().st_mtime)
+
+
 def _data_dir() -> Path:
+    if "KEYBOARD_FORECAST_DATA_DIR" in os.environ:
+        return Path(os.environ["KEYBOARD_FORECAST_DATA_DIR"])
     if os.name == "nt":
         return WindowsPath(os.path.expandvars("%APPDATA%\\keyboard-forecast"))
     else:
@@ -122,16 +482,93 @@ def _data_dir() -> Path:
 
 
 _WEATHER_API_KEY = ""
+_WEATHERAPI_API_KEY = ""
+_WEATHER_PROVIDERS = ["openweathermap"]
+_WEATHER_HEDGING = False
+_WEATHER_HEDGE_BUDGET = 2.0
+_WEATHER_STALE_SECONDS = 600.0
 _WEATHER_CHECK_INTERVAL = 5
-
-
-def _init():
+_WEATHER_POLLING_MODE = PollingMode.FIXED
+_WEATHER_MAX_CHECK_INTERVAL = 60
+_WEATHER_TRANSITION_WINDOW = 90
+_DAYTIME_SOURCE = DaytimeSource.API
+_DAYTIME_CROSS_CHECK_TOLERANCE = datetime.timedelta(minutes=2)
+_LOCATION_RETENTION_DAYS = 30
+_LOCATION_CACHE_TTL_SECONDS = 60.0
+_EVENT_DEBOUNCE_SECONDS = 5.0
+_PREFETCH_DAYS = 3
+_FORECASTER_ENGINE = Engine.THREADED
+_KEYBOARD_SEND_TIMEOUT_SECONDS = 2.0
+_BREAKER_FAILURE_THRESHOLD = 3
+_BREAKER_BASE_DELAY_SECONDS = 30.0
+_BREAKER_MAX_DELAY_SECONDS = 1800.0
+_FLEET_GRID_DECIMALS = 1
+_HISTORY_MAX_BYTES = 1024 * 1024
+_HISTORY_BACKUPS = 3
+_METRICS_ENABLED = False
+_METRICS_PORT = 9464
+_METRICS_SNAPSHOT_SECONDS = 60.0
+
+_LOCATION_FILE_NAME = "current_loc.json"
+_DEVICES_FILE_NAME = "devices.json"
+_FLEET_FILE_NAME = "fleet.json"
+_GEOIP_FILE_NAME = "geoip.bin"
+_RULES_FILE_NAME = "rules.json"
+_HISTORY_FILE_NAME = "history.bin"
+_METRICS_FILE_NAME = "metrics.prom"
+_PUBLIC_IP_URL = "https://api.ipify.org"
+_GEOIP_PATH = Path(_GEOIP_FILE_NAME)
+_GEOIP: "geoip.GeoIpDatabase | None" = None
+_GEOIP_LOCK = threading.Lock()
+_LOCATION_CACHE = _LocationCache()
+
+_DAYTIME_FILE_NAME = re.compile(r"\d{1,2}_\d{1,2}\.json")
+_LOCATION_DIR_NAME = re.compile(r"[^_]+_.+")  # Country and city, see _location_dir
+_STORAGE = storage.Storage(Path())
+_DAYTIME_TABLES: dict[Path, daytable.DaytimeTable] = {}
+_DAYTIME_TABLES_LOCK = threading.RLock()
+_COMPACTED = False
+
+
+def init():
     path = _data_dir()
     os.makedirs(path, exist_ok=True)
 
-    global _WEATHER_API_KEY, _WEATHER_CHECK_INTERVAL
-    _WEATHER_API_KEY = str(os.getenv("WEATHER_API_KEY"))
+    global _STORAGE, _WEATHER_API_KEY, _WEATHER_CHECK_INTERVAL, _DAYTIME_SOURCE
+    global _WEATHERAPI_API_KEY, _WEATHER_PROVIDERS, _WEATHER_HEDGING, _WEATHER_HEDGE_BUDGET, _WEATHER_STALE_SECONDS
+    global _WEATHER_POLLING_MODE, _WEATHER_MAX_CHECK_INTERVAL, _WEATHER_TRANSITION_WINDOW
+    global _LOCATION_RETENTION_DAYS, _LOCATION_CACHE_TTL_SECONDS, _EVENT_DEBOUNCE_SECONDS, _PREFETCH_DAYS
+    global _FORECASTER_ENGINE, _BREAKER_FAILURE_THRESHOLD, _BREAKER_BASE_DELAY_SECONDS, _BREAKER_MAX_DELAY_SECONDS
+    global _KEYBOARD_SEND_TIMEOUT_SECONDS, _FLEET_GRID_DECIMALS, _GEOIP_PATH, _HISTORY_MAX_BYTES, _HISTORY_BACKUPS
+    global _METRICS_ENABLED, _METRICS_PORT, _METRICS_SNAPSHOT_SECONDS, _GEOIP
+    _STORAGE = storage.Storage(path.resolve())
+    _WEATHER_API_KEY = os.getenv("WEATHER_API_KEY", "")
+    _WEATHERAPI_API_KEY = os.getenv("WEATHERAPI_API_KEY", "")
+    _WEATHER_PROVIDERS = [name.strip() for name in os.getenv("WEATHER_PROVIDERS", "openweathermap").split(",")]
+    _WEATHER_HEDGING = os.getenv("WEATHER_HEDGING", "false").lower() == "true"
+    _WEATHER_HEDGE_BUDGET = float(os.getenv("WEATHER_HEDGE_BUDGET_SECONDS", "2"))
+    _WEATHER_STALE_SECONDS = float(os.getenv("WEATHER_STALE_WHILE_REVALIDATE_SECONDS", "600"))
     _WEATHER_CHECK_INTERVAL = int(os.getenv("WEATHER_CHECK_INTERVAL_MINUTES", "5"))
-
-
-_init()
+    _WEATHER_POLLING_MODE = PollingMode(os.getenv("WEATHER_POLLING", PollingMode.FIXED.value))
+    _WEATHER_MAX_CHECK_INTERVAL = int(os.getenv("WEATHER_MAX_CHECK_INTERVAL_MINUTES", "60"))
+    _WEATHER_TRANSITION_WINDOW = int(os.getenv("WEATHER_TRANSITION_WINDOW_MINUTES", "90"))
+    _DAYTIME_SOURCE = DaytimeSource(os.getenv("DAYTIME_SOURCE", DaytimeSource.API.value))
+    _LOCATION_RETENTION_DAYS = int(os.getenv("LOCATION_RETENTION_DAYS", "30"))
+    _LOCATION_CACHE_TTL_SECONDS = float(os.getenv("LOCATION_CACHE_TTL_SECONDS", "60"))
+    _EVENT_DEBOUNCE_SECONDS = float(os.getenv("EVENT_DEBOUNCE_SECONDS", "5"))
+    _PREFETCH_DAYS = int(os.getenv("PREFETCH_DAYS", "3"))
+    _FORECASTER_ENGINE = Engine(os.getenv("FORECASTER_ENGINE", Engine.THREADED.value))
+    _KEYBOARD_SEND_TIMEOUT_SECONDS = float(os.getenv("KEYBOARD_SEND_TIMEOUT_SECONDS", "2"))
+    _BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+    _BREAKER_BASE_DELAY_SECONDS = float(os.getenv("BREAKER_BASE_DELAY_SECONDS", "30"))
+    _BREAKER_MAX_DELAY_SECONDS = float(os.getenv("BREAKER_MAX_DELAY_SECONDS", "1800"))
+    _FLEET_GRID_DECIMALS = int(os.getenv("FLEET_GRID_DECIMALS", "1"))
+    _GEOIP_PATH = Path(os.getenv("GEOIP_DATABASE", str(_STORAGE.path(_GEOIP_FILE_NAME))))
+    if _GEOIP is not None and _GEOIP.path != _GEOIP_PATH:
+        _GEOIP.close()
+        _GEOIP = None
+    _HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(1024 * 1024)))
+    _HISTORY_BACKUPS = int(os.getenv("HISTORY_BACKUPS", "3"))
+    _METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+    _METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+    _METRICS_SNAPSHOT_SECONDS = float(os.getenv("METRICS_SNAPSHOT_SECONDS", "60"))
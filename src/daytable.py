@@ -0,0 +1,109 @@
+import calendar
+import datetime
+import mmap
+import struct
+import threading
+from pathlib import Path
+from typing import Iterable
+
+import forelogger as log
+import storage
+
+FILE_NAME = "daytime.bin"
+
+ROW_COUNT = 366
+
+_MAGIC = b"KFDT"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHH")  # Magic, format version, row count
+_ROW = struct.Struct("<i4q")  # Year (0 for an empty row), sunrise, sunset, civil twilight begin and end
+_FILE_SIZE = _HEADER.size + ROW_COUNT * _ROW.size
+
+_KEYS = ("sunrise", "sunset", "civil_twilight_morning_begin", "civil_twilight_evening_end")
+
+DaytimeEpochs = tuple[int, int, int, int]
+
+
+class DaytimeTable:
+    def __init__(self, path: Path):
+        self.__path = path
+        self.__file = None
+        self.__map = None
+        self.__lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return self.__path
+
+    def get(self, date: datetime.date) -> DaytimeEpochs | None:
+        with self.__lock:
+            year, *events = _ROW.unpack_from(self.__mapped(), _row_offset(date))
+        if year != date.year:
+            return None
+        return tuple(events)
+
+    def put(self, date: datetime.date, events: DaytimeEpochs):
+        self.put_many([(date, events)])
+
+    def put_many(self, rows: Iterable[tuple[datetime.date, DaytimeEpochs]]):
+        with self.__lock:
+            mapped = self.__mapped()
+            for date, events in rows:
+                _ROW.pack_into(mapped, _row_offset(date), date.year, *events)
+            mapped.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__close()
+
+    def __close(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__file.close()
+            self.__map = None
+            self.__file = None
+
+    def __mapped(self) -> mmap.mmap:
+        if self.__map is None:
+            self.__open()
+        return self.__map
+
+    def __open(self):
+        if not self.__path.exists() or self.__path.stat().st_size != _FILE_SIZE:
+            self.__create()
+        self.__file = self.__path.open("r+b")
+        self.__map = mmap.mmap(self.__file.fileno(), _FILE_SIZE, access=mmap.ACCESS_WRITE)
+        magic, version, rows = _HEADER.unpack_from(self.__map)
+        if magic != _MAGIC or version != _VERSION or rows != ROW_COUNT:
+            log.warn(f"Daytime table {self.__path} has an unknown format, recreating it")
+            self.__close()
+            self.__create()
+            self.__open()
+
+    def __create(self):
+        storage.write_atomically(self.__path, _HEADER.pack(_MAGIC, _VERSION, ROW_COUNT) + bytes(ROW_COUNT * _ROW.size))
+
+
+def to_dict(events: DaytimeEpochs) -> dict[str, str]:
+    return {key: _format_epoch(epoch) for key, epoch in zip(_KEYS, events)}
+
+
+def from_dict(daytime_dict: dict[str, str]) -> DaytimeEpochs:
+    sunrise, sunset, dawn, dusk = (int(datetime.datetime.fromisoformat(daytime_dict[key]).timestamp()) for key in _KEYS)
+    return sunrise, sunset, dawn, dusk
+
+
+def _row_offset(date: datetime.date) -> int:
+    return _HEADER.size + _day_index(date) * _ROW.size
+
+
+def _day_index(date: datetime.date) -> int:
+    # Feb 29 always gets its own row, so every month and day maps to the same row in any year
+    index = date.timetuple().tm_yday - 1
+    if date.month > 2 and not calendar.isleap(date.year):
+        index += 1
+    return index
+
+
+def _format_epoch(epoch: int) -> str:
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat(timespec="seconds")
@@ -1,8 +1,23 @@
+import queue
+import time
 from datetime import datetime, timedelta, timezone
 
 import datastore
 
 
+class Clock:
+    # Everything that reads the time or waits goes through the clock, so a simulation can swap in a virtual one
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def wait(self, source: queue.Queue, timeout: float | None):
+        return source.get(timeout=timeout)
+
+
 class Daytime:
 
     def __init__(self, daytime_dict: dict):
@@ -26,6 +41,11 @@ def get_today() -> Daytime:
     return Daytime(daytime_dict)
 
 
+def get_today_cached() -> Daytime:
+    daytime_dict = datastore.get_cached_daytime(now().date())
+    return Daytime(daytime_dict)
+
+
 def get_tomorrow() -> Daytime:
     tomorrow = now() + timedelta(days=1)
     daytime_dict = datastore.get_daytime(tomorrow)
@@ -33,4 +53,20 @@ def get_tomorrow() -> Daytime:
 
 
 def now() -> datetime:
-    return datetime.now(timezone.utc)
+    return _CLOCK.now()
+
+
+def monotonic() -> float:
+    return _CLOCK.monotonic()
+
+
+def wait(source: queue.Queue, timeout: float | None = None):
+    return _CLOCK.wait(source, timeout)
+
+
+def use_clock(clock: Clock):
+    global _CLOCK
+    _CLOCK = clock
+
+
+_CLOCK = Clock()
@@ -1,8 +1,12 @@
+import dataclasses
 import datetime
 import enum
+import itertools
 import queue
+import threading
 
 import daytime
+import forelogger as log
 
 
 class IncomingEvent(enum.Enum):
@@ -11,30 +15,83 @@ class IncomingEvent(enum.Enum):
     KEYBOARD_CONNECTED = 2
 
 
+@dataclasses.dataclass(order=True, frozen=True)
+class EventRecord:
+    priority: int
+    timestamp: float
+    sequence: int
+    type: IncomingEvent = dataclasses.field(compare=False)
+
+
 class Event:
     def __init__(self, type: IncomingEvent, restart: bool = True):
         self.type = type
         self.restart = restart
 
 
+class EventPipeline:
+    # A keyboard arrives as several USB interfaces and a resume often comes with a reconnect, so duplicates
+    # of a pending event are merged into it and repeats within the debounce window are dropped
+
+    def __init__(self, debounce: datetime.timedelta):
+        self.dropped = 0
+        self.merged = 0
+        self.__debounce_seconds = debounce.total_seconds()
+        self.__queue: queue.PriorityQueue[EventRecord] = queue.PriorityQueue()
+        self.__pending: set[IncomingEvent] = set()
+        self.__last_accepted: dict[IncomingEvent, float] = {}
+        self.__sequence = itertools.count()
+        self.__lock = threading.Lock()
+
+    def put(self, event_type: IncomingEvent) -> bool:
+        with self.__lock:
+            now = daytime.monotonic()
+            if event_type in self.__pending:
+                self.merged += 1
+                log.info(f"Merged {event_type} into the pending one")
+                return False
+            last_accepted = self.__last_accepted.get(event_type)
+            if (
+                event_type != IncomingEvent.TERMINATION
+                and last_accepted is not None
+                and now - last_accepted < self.__debounce_seconds
+            ):
+                self.dropped += 1
+                log.info(f"Dropped {event_type}, it repeats within the debounce window")
+                return False
+            self.__pending.add(event_type)
+            self.__last_accepted[event_type] = now
+            self.__queue.put(EventRecord(event_type.value, now, next(self.__sequence), event_type))
+            return True
+
+    def get(self, timeout: float | None = None) -> EventRecord:
+        record = daytime.wait(self.__queue, timeout)
+        with self.__lock:
+            self.__pending.discard(record.type)
+        return record
+
+    def __str__(self):
+        return f"Event pipeline: {self.merged} merged, {self.dropped} dropped"
+
+
 class EventListener:
-    def __init__(self, queue: queue.PriorityQueue):
-        self.__queue = queue
+    def __init__(self, pipeline: EventPipeline):
+        self.__pipeline = pipeline
 
     def sleep_until(self, until: datetime.datetime) -> Event | None:
         sleep_timeout = until - daytime.now()
         try:
-            incoming_event = self.__queue.get(timeout=sleep_timeout.total_seconds())
-            return Event(incoming_event)
+            record = self.__pipeline.get(timeout=max(0.0, sleep_timeout.total_seconds()))
+            return Event(record.type)
         except queue.Empty:
             pass
 
     def sleep_for(self, duration: datetime.timedelta) -> Event | None:
         try:
-            incoming_event = self.__queue.get(timeout=duration.total_seconds())
-            return Event(incoming_event)
+            record = self.__pipeline.get(timeout=duration.total_seconds())
+            return Event(record.type)
         except queue.Empty:
             pass
 
     def sleep_forever(self) -> Event:
-        return Event(self.__queue.get())
+        return Event(self.__pipeline.get().type)
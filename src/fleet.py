@@ -0,0 +1,199 @@
+import datetime
+import threading
+from concurrent import futures
+from datetime import timedelta
+
+import datastore
+import daytime
+import forelogger as log
+import httpclient
+import keyboard
+import location
+import metrics
+import solar
+import weather
+from events import EventListener, IncomingEvent
+from scheduler import Scheduler
+
+_REPORT_INTERVAL = timedelta(hours=1)
+
+
+class WebhookSink:
+    def __init__(self, url: str):
+        self.url = url
+
+    def notify(self, subscriber: "Subscriber", is_dark: bool):
+        resp = httpclient.post(self.url, json={"subscriber": subscriber.name, "is_dark": is_dark})
+        if resp.status_code >= 400:
+            raise Exception(f"Webhook answered {resp.status_code} - '{resp.text}'")
+
+
+class DeviceSink:
+    def __init__(self, device_name: str):
+        self.device_name = device_name
+
+    def notify(self, subscriber: "Subscriber", is_dark: bool):
+        keyboard.toggle_device(self.device_name, is_dark)
+
+
+class Subscriber:
+    def __init__(self, name: str, lat: float, lng: float, sink: WebhookSink | DeviceSink):
+        self.name = name
+        self.lat = lat
+        self.lng = lng
+        self.sink = sink
+        self.is_dark: bool | None = None
+
+    @staticmethod
+    def from_dict(config: dict) -> "Subscriber":
+        sink_config = config["sink"]
+        match sink_config["type"]:
+            case "webhook":
+                sink = WebhookSink(sink_config["url"])
+            case "device":
+                sink = DeviceSink(sink_config["device"])
+            case unknown:
+                raise Exception(f"Unknown sink type {unknown} for {config["name"]}")
+        return Subscriber(config["name"], float(config["lat"]), float(config["lng"]), sink)
+
+
+class Cell:
+    def __init__(self, lat: float, lng: float, subscribers: list[Subscriber]):
+        self.name = f"cell {lat},{lng}"
+        self.location = location.Location({"country": "", "city": self.name, "lat": lat, "lng": lng})
+        self.subscribers = subscribers
+        self.slot = timedelta()
+        self.__solar = solar.SolarEvents(lat, lng)
+        self.__daytimes: dict[datetime.date, tuple[datetime.datetime, datetime.datetime]] = {}
+
+    def daytime(self, date: datetime.date) -> tuple[datetime.datetime, datetime.datetime]:
+        # Calculated rather than downloaded, thousands of cells would hammer sunrise-sunset.org otherwise
+        if date not in self.__daytimes:
+            if len(self.__daytimes) > 2:
+                self.__daytimes.clear()
+            sunrise, sunset, _, _ = self.__solar.epochs([date])[0]
+            self.__daytimes[date] = (
+                datetime.datetime.fromtimestamp(sunrise, datetime.timezone.utc),
+                datetime.datetime.fromtimestamp(sunset, datetime.timezone.utc),
+            )
+        return self.__daytimes[date]
+
+
+class FleetStats:
+    def __init__(self):
+        self.polls = 0
+        self.weather_checks = 0
+        self.notifications = 0
+        self.failures = 0
+        self.__lock = threading.Lock()
+
+    def count(self, **increments: int):
+        with self.__lock:
+            for name, increment in increments.items():
+                setattr(self, name, getattr(self, name) + increment)
+
+    def __str__(self):
+        return (
+            f"{self.polls} cell polls, {self.weather_checks} weather checks, "
+            f"{self.notifications} notifications, {self.failures} failed notifications"
+        )
+
+
+def group_by_cell(subscribers: list[Subscriber], decimals: int) -> list[Cell]:
+    grid: dict[tuple[float, float], list[Subscriber]] = {}
+    for subscriber in subscribers:
+        grid.setdefault((round(subscriber.lat, decimals), round(subscriber.lng, decimals)), []).append(subscriber)
+    return [Cell(lat, lng, members) for (lat, lng), members in sorted(grid.items())]
+
+
+def run(event_listener: EventListener):
+    subscribers = [Subscriber.from_dict(config) for config in datastore.get_fleet_subscribers()]
+    cells = group_by_cell(subscribers, datastore.get_fleet_grid_decimals())
+    log.info(f"Serving {len(subscribers)} subscribers from {len(cells)} grid cells")
+
+    interval = timedelta(minutes=datastore.get_weather_check_interval_minutes())
+    timers = Scheduler(event_listener)
+    now = daytime.now()
+    for index, cell in enumerate(cells):
+        # Every cell keeps its own slot in the interval, so the polls never come in bursts
+        cell.slot = interval * index / len(cells)
+        timers.at(cell.name, now + cell.slot, _poll_job(timers, cell, interval))
+    timers.after("fleet report", _REPORT_INTERVAL, lambda: _report(timers, cells))
+
+    while True:
+        wake_event = timers.run()
+        if wake_event is None or wake_event.type == IncomingEvent.TERMINATION:
+            log.info("Stopping the fleet")
+            _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+            _report(timers, cells)
+            metrics.stop()
+            return
+        if wake_event.type == IncomingEvent.SYSTEM_RESUME:
+            timers.reanchor()
+
+
+def next_poll(cell: Cell, now: datetime.datetime, interval: timedelta) -> datetime.datetime:
+    sunrise, sunset = cell.daytime(now.date())
+    if now < sunrise:
+        return sunrise + cell.slot
+    if now + interval < sunset:
+        return now + interval
+    if now < sunset:
+        return sunset  # The last poll of the day turns the backlight on
+    tomorrow_sunrise, _ = cell.daytime(now.date() + timedelta(days=1))
+    return max(tomorrow_sunrise, now + interval) + cell.slot
+
+
+def poll(cell: Cell):
+    now = daytime.now()
+    sunrise, sunset = cell.daytime(now.date())
+    if sunrise <= now < sunset:
+        is_dark = weather.observe(cell.location).is_dark
+        _STATS.count(polls=1, weather_checks=1)
+    else:
+        is_dark = True
+        _STATS.count(polls=1)
+
+    for subscriber in cell.subscribers:
+        if subscriber.is_dark != is_dark:
+            _EXECUTOR.submit(_notify, subscriber, is_dark)
+
+
+def stats() -> FleetStats:
+    return _STATS
+
+
+def _poll_job(timers: Scheduler, cell: Cell, interval: timedelta):
+    def job():
+        # The next deadline doesn't depend on the result, so it's set here and the scheduler stays single-threaded
+        timers.at(cell.name, next_poll(cell, daytime.now(), interval), job)
+        _EXECUTOR.submit(_poll_logged, cell)
+
+    return job
+
+
+def _poll_logged(cell: Cell):
+    try:
+        poll(cell)
+    except Exception as e:
+        log.warn(f"Failed to poll {cell.name}: {e}")
+
+
+def _notify(subscriber: Subscriber, is_dark: bool):
+    try:
+        subscriber.sink.notify(subscriber, is_dark)
+    except Exception as e:
+        _STATS.count(failures=1)
+        log.warn(f"Failed to notify {subscriber.name}: {e}")
+        return
+    subscriber.is_dark = is_dark
+    _STATS.count(notifications=1)
+
+
+def _report(timers: Scheduler, cells: list[Cell]):
+    log.info(f"Fleet of {sum(len(cell.subscribers) for cell in cells)} subscribers in {len(cells)} cells: {_STATS}")
+    timers.after("fleet report", _REPORT_INTERVAL, lambda: _report(timers, cells))
+
+
+_EXECUTOR = futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="fleet")
+_STATS = FleetStats()
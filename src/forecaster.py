@@ -1,96 +1,216 @@
-import datetime
-import os
 import sys
-from datetime import timedelta
-
-import requests
+from datetime import datetime, timedelta
 
+import breaker
 import datastore
 import daytime
 import forelogger as log
+import history
 import keyboard
 import location
+import metrics
+import polling
+import prefetch
+import rules
 import weather
-from events import Event, EventListener, IncomingEvent
+from events import Event, EventListener, EventPipeline, IncomingEvent
 from forelogger import format_month_day
+from scheduler import Scheduler
+
+_LOCATION_REFRESH_INTERVAL = timedelta(hours=1)
+_WEATHER_PREWARM_LEAD = timedelta(minutes=2)
+_MIN_CHECK_RETRY = timedelta(minutes=1)
+_FETCH_POLL_INTERVAL = timedelta(milliseconds=50)  # The first look for a background fetch's answer, then doubling
+
+
+def init():
+    datastore.init()
+    breaker.configure(
+        datastore.get_breaker_failure_threshold(),
+        datastore.get_breaker_base_delay_seconds(),
+        datastore.get_breaker_max_delay_seconds(),
+    )
+    if datastore.is_metrics_enabled():
+        metrics.start(
+            datastore.get_metrics_port(),
+            datastore.get_metrics_snapshot_path(),
+            datastore.get_metrics_snapshot_seconds(),
+        )
 
 
 def validate():
     datastore.validate_config()
+    rules.validate()
+
+
+def create_event_pipeline() -> EventPipeline:
+    return EventPipeline(timedelta(seconds=datastore.get_event_debounce_seconds()))
 
 
 def run(event_listener: EventListener):
+    if datastore.get_forecaster_engine() == datastore.Engine.ASYNCIO:
+        import aioforecaster  # asyncio is only loaded for the engine that uses it
+
+        aioforecaster.run(event_listener)
+        return
+
+    timers = Scheduler(event_listener)
     while True:
         try:
-            _do_run(event_listener)
+            _do_run(timers)
         except keyboard.DisconnectedException:
             log.warn("Sleeping until the keyboard is reconnected")
-            event_listener.sleep_forever()
+            timers.clear()
+            _process_termination(event_listener.sleep_forever())
         except Exception as e:
             log.error(f"Unhandled exception: {str(e)}")
-            _retry_fault(event_listener)
+            _retry_fault(timers)
 
 
-def _do_run(event_listener: EventListener):
+def _do_run(timers: Scheduler):
+    timers.clear()
+    _plan_day(timers)
     while True:
-        current_location = location.get()
-        daytime_info = daytime.get_today()
-        now = daytime.now()
-
-        log.info(f"We are in {current_location}")
-        log.info(
-            f"Today is {format_month_day(now)}: sunrise at {daytime_info.sunrise}, sunset at {daytime_info.sunset}"
-        )
-
-        sunrise = daytime_info.sunrise
-        sunset = daytime_info.sunset
-        if now < sunrise:
-            log.info(f"{now} is too early - entering sleep state")
-            if _sleep_until(event_listener, sunrise):
-                continue
-
-        next_run = daytime.now()
-        while next_run < sunset:
-            _check_weather(current_location)
-            next_run = next_run + timedelta(minutes=datastore.get_weather_check_interval_minutes())
-            if _sleep_until(event_listener, next_run):
-                break
-        else:
-            log.info(f"The sun is down - turning on the backlight and entering sleep state")
-            keyboard.toggle_backlight(True, force=True)
-            daytime.get_tomorrow()  # So we won't waste time tomorrow morning
-            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-            _sleep_until(event_listener, midnight)
-
-
-def _check_weather(cur_loc: location.Location):
-    check_result = weather.is_dark(cur_loc)
-    if check_result:
-        keyboard.toggle_backlight(True)
-    else:
-        keyboard.toggle_backlight(False)
-
-
-def _sleep_until(event_listener: EventListener, until: datetime.datetime) -> bool:
-    log.info(f"Sleeping until {until}")
-    wake_event = event_listener.sleep_until(until)
-    _process_termination(wake_event)
-    if wake_event is not None:
-        log.info(
-            f"Woke up prematurely at {daytime.now()} because of {wake_event.type} event."
-            f"{'Restarting the main loop' if wake_event.restart else 'Continuing execution'}"
-        )
-        return wake_event.restart
-    else:
-        log.info(f"Woke up at {daytime.now()}. Continuing execution")
-    return False
-
-
-def _retry_fault(event_listener: EventListener):
-    minutes_to_sleep = 5  # TODO exponentially increase the timeout
-    sleep_duration = timedelta(minutes=minutes_to_sleep)
-    log.info(f"Sleeping for {minutes_to_sleep} minutes and restarting the main loop")
-    wake_event = event_listener.sleep_for(sleep_duration)
+        wake_event = timers.run()
+        if wake_event is None:
+            log.warn("No jobs are left, planning the day anew")
+            return
+        _process_termination(wake_event)
+        log.info(f"Woke up prematurely at {daytime.now()} because of {wake_event.type} event")
+        if wake_event.type == IncomingEvent.SYSTEM_RESUME:
+            log.info("Re-anchoring the timers after the resume")
+            timers.reanchor()
+            timers.reschedule("location refresh", daytime.now())  # We may have been carried somewhere else
+        elif wake_event.restart:
+            log.info("Restarting the main loop")
+            return
+
+
+def _plan_day(timers: Scheduler):
+    current_location = location.get()
+    daytime_info = daytime.get_today_cached()
+    now = daytime.now()
+    prefetch.daytime(now.date(), datastore.get_prefetch_days())
+
+    log.info(f"We are in {current_location}")
+    log.info(f"Today is {format_month_day(now)}: sunrise at {daytime_info.sunrise}, sunset at {daytime_info.sunset}")
+
+    sunrise = daytime_info.sunrise
+    sunset = daytime_info.sunset
+    schedule = polling.for_day(current_location, now.date())
+
+    fetch_wait = _FETCH_POLL_INTERVAL
+
+    def check_weather():
+        nonlocal fetch_wait
+        try:
+            is_dark = _check_weather(current_location)
+        except keyboard.DisconnectedException:
+            raise
+        except Exception as e:
+            retry_at = weather_retry_at(e)
+            if retry_at < sunset:
+                timers.at("weather check", retry_at, check_weather)
+            return
+        if is_dark is None:
+            # Looking for the answer costs nothing, but a slow provider shouldn't keep the loop spinning either
+            retry_at = daytime.now() + fetch_wait
+            fetch_wait = min(2 * fetch_wait, _MIN_CHECK_RETRY)
+            log.debug("The weather is still being fetched, checking it again at %s", retry_at)
+            if retry_at < sunset:
+                timers.at("weather check", retry_at, check_weather)
+            return
+        fetch_wait = _FETCH_POLL_INTERVAL
+        next_run = schedule.next_check(daytime.now(), is_dark)
+        if next_run < sunset:
+            timers.at("weather check", next_run, check_weather)
+            # So the check finds the weather cache warm instead of leaving the fetch to it
+            timers.at(
+                "weather prewarm", next_run - _WEATHER_PREWARM_LEAD, lambda: prefetch.warm_weather(current_location)
+            )
+
+    def on_sunset():
+        timers.cancel("weather check")
+        timers.cancel("weather prewarm")
+        schedule.report(sunset)
+        log.info(f"The sun is down - turning on the backlight and entering sleep state")
+        keyboard.toggle_backlight(True, force=True)
+        log.info(f"Keyboard send latency: {keyboard.latency_report()}")
+        log.info(f"Circuit breakers: {breaker.report()}")
+
+    def on_midnight():
+        timers.clear()
+        _plan_day(timers)
+
+    if now < sunrise:
+        log.info(f"{now} is too early - entering sleep state")
+        # So the first check after sunrise finds the weather cache warm
+        timers.at("weather prewarm", sunrise - _WEATHER_PREWARM_LEAD, lambda: prefetch.warm_weather(current_location))
+    if now < sunset:
+        timers.at("weather check", sunrise, check_weather)
+    timers.at("sunset", sunset, on_sunset)
+    timers.at("midnight", now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1), on_midnight)
+    timers.after("location refresh", _LOCATION_REFRESH_INTERVAL, lambda: _check_location(timers, current_location))
+
+
+def _check_location(timers: Scheduler, planned_location: location.Location):
+    # Only compares against what the prefetch worker has loaded so far, the refresh itself runs in the background
+    current_location = location.get()
+    if (current_location.lat, current_location.lng) != (planned_location.lat, planned_location.lng):
+        log.info(f"The location has changed to {current_location}, planning the day anew")
+        timers.clear()
+        _plan_day(timers)
+        return
+    prefetch.refresh_location()
+    timers.after("location refresh", _LOCATION_REFRESH_INTERVAL, lambda: _check_location(timers, planned_location))
+
+
+def record_check(observation: weather.Observation, sent: bool):
+    history.record(
+        observation.provider,
+        observation.condition_code,
+        observation.cloud_pct,
+        observation.is_dark,
+        observation.latency,
+        history.Action(observation.is_dark) if sent else history.Action.NONE,
+        observation.cached,
+    )
+
+
+def shutdown():
+    log.info("Received termination event. Exiting...")
+    prefetch.cancel()
+    metrics.stop()
+    log.flush()
+    sys.exit(0)
+
+
+def weather_retry_at(error: Exception) -> datetime:
+    # A failed provider only delays the next check, replanning the whole day wouldn't bring it back any sooner
+    retry_in = timedelta(seconds=error.retry_in) if isinstance(error, breaker.CircuitOpenException) else timedelta()
+    retry_at = daytime.now() + max(retry_in, _MIN_CHECK_RETRY)
+    log.warn(f"Weather check failed: {error}. Checking again at {retry_at}")
+    return retry_at
+
+
+def _check_weather(cur_loc: location.Location) -> bool | None:
+    # None when there's no recent observation yet, the loop doesn't wait for the fetch
+    with metrics.timer("forecaster_check_seconds"):
+        observation = weather.observe(cur_loc, wait=False)
+        if observation is None:
+            return None
+        sent = keyboard.toggle_backlight(observation.is_dark)
+    record_check(observation, sent)
+    _FAULT_BACKOFF.reset()
+    return observation.is_dark
+
+
+def _retry_fault(timers: Scheduler):
+    delay = timedelta(seconds=round(_FAULT_BACKOFF.next_delay()))
+    log.info(f"Sleeping for {delay} and restarting the main loop")
+    timers.clear()
+    timers.after("fault retry", delay, lambda: None)
+    wake_event = timers.run()
     _process_termination(wake_event)
     if wake_event is not None:
         log.info(f"Fault timer ended prematurely at {daytime.now()} because of {wake_event.type} event")
@@ -98,5 +218,7 @@ def _retry_fault(event_listener: EventListener):
 
 def _process_termination(event: Event | None):
     if event is not None and event.type == IncomingEvent.TERMINATION:
-        log.info("Received termination event. Exiting...")
-        sys.exit(0)
+        shutdown()
+
+
+_FAULT_BACKOFF = breaker.Backoff()  # A successful check resets it
@@ -1,68 +1,240 @@
+import atexit
 import datetime
 import enum
-
-import servicemanager
+import os
+import queue
+import sys
+import threading
+from pathlib import Path
 
 
 class SinkType(enum.Enum):
     STD_OUT = enum.auto()
     EVENT_LOG = enum.auto()
+    FILE = enum.auto()
 
 
 _SINK_TYPE = SinkType.EVENT_LOG
 
 _EVENT_LOG_GENERIC_MESSAGE_TYPE = 0xF000
 
+_BATCH_SIZE = 64
+_FLUSH_TIMEOUT_SECONDS = 5
+
 
-class _LogLevel(enum.Enum):
-    INFO = enum.auto()
-    WARN = enum.auto()
-    ERROR = enum.auto()
+class _LogLevel(enum.IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARN = 30
+    ERROR = 40
 
 
 _LOG_LEVEL_DATA = {
+    _LogLevel.DEBUG: {
+        SinkType.STD_OUT: "DEBUG",
+        SinkType.EVENT_LOG: "EVENTLOG_INFORMATION_TYPE",
+        SinkType.FILE: "DEBUG",
+    },
     _LogLevel.INFO: {
         SinkType.STD_OUT: "INFO",
-        SinkType.EVENT_LOG: servicemanager.EVENTLOG_INFORMATION_TYPE,
+        SinkType.EVENT_LOG: "EVENTLOG_INFORMATION_TYPE",
+        SinkType.FILE: "INFO",
     },
     _LogLevel.WARN: {
         SinkType.STD_OUT: "WARN",
-        SinkType.EVENT_LOG: servicemanager.EVENTLOG_WARNING_TYPE,
+        SinkType.EVENT_LOG: "EVENTLOG_WARNING_TYPE",
+        SinkType.FILE: "WARN",
     },
     _LogLevel.ERROR: {
         SinkType.STD_OUT: "ERROR",
-        SinkType.EVENT_LOG: servicemanager.EVENTLOG_ERROR_TYPE,
+        SinkType.EVENT_LOG: "EVENTLOG_ERROR_TYPE",
+        SinkType.FILE: "ERROR",
     },
 }
 
 
-def init(sink_type: SinkType = SinkType.EVENT_LOG):
-    global _SINK_TYPE
+class _Record:
+    def __init__(self, level: _LogLevel, msg: str, args: tuple):
+        self.level = level
+        self.created_at = datetime.datetime.now()
+        self.__msg = msg
+        self.__args = args
+
+    @property
+    def message(self) -> str:
+        if not self.__args:
+            return self.__msg
+        try:
+            return self.__msg % self.__args
+        except (TypeError, ValueError) as e:
+            return f"{self.__msg} {self.__args} (formatting failed: {e})"
+
+
+class _RotatingFile:
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.__path = path
+        self.__max_bytes = max_bytes
+        self.__backups = backups
+        os.makedirs(path.parent, exist_ok=True)
+        self.__file = path.open("a", encoding="utf-8")
+
+    def write(self, text: str):
+        if 0 < self.__file.tell() and self.__file.tell() + len(text) > self.__max_bytes:
+            self.__rotate()
+        self.__file.write(text)
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+    def __rotate(self):
+        self.__file.close()
+        for i in range(self.__backups - 1, 0, -1):
+            older = self.__path.with_name(f"{self.__path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.__path.with_name(f"{self.__path.name}.{i + 1}"))
+        if self.__backups > 0:
+            os.replace(self.__path, self.__path.with_name(f"{self.__path.name}.1"))
+        self.__file = self.__path.open("w", encoding="utf-8")
+
+
+class _Writer:
+    # Drains the queue on its own thread, so callers never wait on a sink
+
+    def __init__(self):
+        self.__queue: queue.SimpleQueue[_Record | threading.Event | None] = queue.SimpleQueue()
+        self.__thread = threading.Thread(target=self.__run, name="forelogger", daemon=True)
+        self.__thread.start()
+
+    def put(self, record: _Record):
+        self.__queue.put(record)
+
+    def flush(self):
+        flushed = threading.Event()
+        self.__queue.put(flushed)
+        flushed.wait(_FLUSH_TIMEOUT_SECONDS)
+
+    def stop(self):
+        self.__queue.put(None)
+        self.__thread.join(_FLUSH_TIMEOUT_SECONDS)
+
+    def __run(self):
+        while True:
+            batch = [self.__queue.get()]
+            while len(batch) < _BATCH_SIZE:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [item for item in batch if isinstance(item, _Record)]
+            if records:
+                try:
+                    _write(records)
+                except Exception as e:
+                    print(f"[ERROR] Failed to write {len(records)} log records: {e}", file=sys.stderr)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                return
+
+
+def init(sink_type: SinkType = SinkType.EVENT_LOG, level: str | None = None, file_path: Path | None = None):
+    global _SINK_TYPE, _MIN_LEVEL, _FILE
     _SINK_TYPE = sink_type
-    info(f"Logging initialized with type {sink_type}")
+    _MIN_LEVEL = _LogLevel[(level or os.getenv("LOG_LEVEL", "INFO")).upper()]
+    if sink_type == SinkType.FILE:
+        if file_path is None:
+            raise Exception("File logging requires a file path")
+        _FILE = _RotatingFile(
+            file_path,
+            max_bytes=int(os.getenv("LOG_FILE_MAX_BYTES", str(1024 * 1024))),
+            backups=int(os.getenv("LOG_FILE_BACKUPS", "3")),
+        )
+    info(f"Logging initialized with type {sink_type} and level {_MIN_LEVEL.name}")
+
+
+def debug(msg: str, *args):
+    _do_log(_LogLevel.DEBUG, msg, args)
+
+
+def info(msg: str, *args):
+    _do_log(_LogLevel.INFO, msg, args)
+
+
+def warn(msg: str, *args):
+    _do_log(_LogLevel.WARN, msg, args)
+
 
+def error(msg: str, *args):
+    _do_log(_LogLevel.ERROR, msg, args)
 
-def info(msg: str):
-    _do_log(_LogLevel.INFO, msg)
 
+def is_debug_enabled() -> bool:
+    return _MIN_LEVEL <= _LogLevel.DEBUG
 
-def warn(msg: str):
-    _do_log(_LogLevel.WARN, msg)
 
+def flush():
+    if _WRITER is not None:
+        _WRITER.flush()
 
-def error(msg: str):
-    _do_log(_LogLevel.ERROR, msg)
+
+def shutdown():
+    global _WRITER
+    with _WRITER_LOCK:
+        writer, _WRITER = _WRITER, None
+    if writer is not None:
+        writer.stop()
+    if _FILE is not None:
+        _FILE.close()
 
 
 def format_month_day(date: datetime.date) -> str:
     return date.strftime("%b, %d")
 
 
-def _do_log(level: _LogLevel, msg: str):
-    global _SINK_TYPE
-    level_concrete = _LOG_LEVEL_DATA[level][_SINK_TYPE]
+def _do_log(level: _LogLevel, msg: str, args: tuple):
+    # Filtered out records are dropped before their arguments are ever formatted
+    if level < _MIN_LEVEL:
+        return
+    _writer().put(_Record(level, msg, args))
+
+
+def _writer() -> _Writer:
+    global _WRITER
+    if _WRITER is None:
+        with _WRITER_LOCK:
+            if _WRITER is None:
+                _WRITER = _Writer()
+    return _WRITER
+
+
+def _write(records: list[_Record]):
     match _SINK_TYPE:
         case SinkType.STD_OUT:
-            print(f"[{level_concrete}] {msg}")
+            lines = (f"[{_LOG_LEVEL_DATA[record.level][_SINK_TYPE]}] {record.message}\n" for record in records)
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+        case SinkType.FILE:
+            lines = (
+                f"{record.created_at.isoformat(sep=' ', timespec='milliseconds')} "
+                f"[{_LOG_LEVEL_DATA[record.level][_SINK_TYPE]}] {record.message}\n"
+                for record in records
+            )
+            _FILE.write("".join(lines))
         case SinkType.EVENT_LOG:
-            servicemanager.LogMsg(level_concrete, _EVENT_LOG_GENERIC_MESSAGE_TYPE, (msg, ""))
+            # Only available on Windows, so it's not imported until the event log is actually used
+            import servicemanager
+
+            for record in records:
+                event_type = getattr(servicemanager, _LOG_LEVEL_DATA[record.level][_SINK_TYPE])
+                servicemanager.LogMsg(event_type, _EVENT_LOG_GENERIC_MESSAGE_TYPE, (record.message, ""))
+
+
+_MIN_LEVEL = _LogLevel.INFO
+_FILE: _RotatingFile | None = None
+_WRITER: _Writer | None = None
+_WRITER_LOCK = threading.Lock()
+
+atexit.register(shutdown)
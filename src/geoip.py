@@ -0,0 +1,130 @@
+import bisect
+import csv
+import ipaddress
+import mmap
+import socket
+import struct
+import sys
+from pathlib import Path
+
+import storage
+
+# Layout: header, range starts, range records, place offsets, place names. The starts are a contiguous array of
+# little-endian uint32, so the binary search runs over a memoryview without unpacking anything
+_MAGIC = b"KFGI"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHII")  # magic, version, range count, place count
+_RECORD = struct.Struct("<IffI")  # range end, latitude, longitude, place index
+_OFFSET = struct.Struct("<I")
+_PLACE_SEPARATOR = "\x1f"
+
+_IPV4_MAX = 2**32 - 1
+
+
+class GeoIpDatabase:
+    def __init__(self, path: Path):
+        self.path = path
+        with path.open("rb") as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.__ranges, self.__places = _HEADER.unpack_from(self.__mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self.__mmap.close()
+            raise Exception(f"{path} is not a geolocation database")
+
+        self.__starts_offset = _HEADER.size
+        self.__records_offset = self.__starts_offset + 4 * self.__ranges
+        self.__place_offsets_offset = self.__records_offset + _RECORD.size * self.__ranges
+        self.__names_offset = self.__place_offsets_offset + _OFFSET.size * (self.__places + 1)
+        self.__starts = None
+        if sys.byteorder == "little":
+            self.__starts = memoryview(self.__mmap)[self.__starts_offset : self.__records_offset].cast("I")
+
+    def lookup(self, ip: str) -> dict | None:
+        try:
+            value = int.from_bytes(socket.inet_aton(ip), "big")
+        except OSError:
+            return None  # Only IPv4 ranges are kept
+        index = self.__bisect(value) - 1
+        if index < 0:
+            return None
+        end, lat, lng, place = _RECORD.unpack_from(self.__mmap, self.__records_offset + index * _RECORD.size)
+        if value > end:
+            return None
+        country, city = self.__place(place).split(_PLACE_SEPARATOR)
+        return {"country": country, "city": city, "lat": round(lat, 4), "lng": round(lng, 4), "ip": ip}
+
+    def close(self):
+        if self.__starts is not None:
+            self.__starts.release()
+        self.__mmap.close()
+
+    def __len__(self):
+        return self.__ranges
+
+    def __bisect(self, value: int) -> int:
+        if self.__starts is not None:
+            return bisect.bisect_right(self.__starts, value)
+        # Big-endian hosts can't use the native view, so they unpack every probe
+        low, high = 0, self.__ranges
+        while low < high:
+            middle = (low + high) // 2
+            (start,) = _OFFSET.unpack_from(self.__mmap, self.__starts_offset + 4 * middle)
+            if value < start:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def __place(self, index: int) -> str:
+        offset = self.__place_offsets_offset + _OFFSET.size * index
+        start, end = struct.unpack_from("<II", self.__mmap, offset)
+        return bytes(self.__mmap[self.__names_offset + start : self.__names_offset + end]).decode("utf-8")
+
+
+def build(csv_path: Path, database_path: Path) -> int:
+    # Takes IP2Location-style range dumps: ip_from, ip_to, country code, country, region, city, latitude, longitude.
+    # Addresses can be integers or dotted quads, IPv6 ranges are skipped
+    ranges: list[tuple[int, int, float, float, int]] = []
+    places: dict[str, int] = {}
+    with csv_path.open(newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) < 8 or not row[0] or row[0].lower() in ("ip_from", "start"):
+                continue
+            start, end = _parse_address(row[0]), _parse_address(row[1])
+            if start is None or end is None or end > _IPV4_MAX:
+                continue
+            place = places.setdefault(f"{row[3]}{_PLACE_SEPARATOR}{row[5]}", len(places))
+            ranges.append((start, end, float(row[6]), float(row[7]), place))
+    ranges.sort()
+
+    names = [name.encode("utf-8") for name in places]
+    content = bytearray(_HEADER.pack(_MAGIC, _VERSION, len(ranges), len(names)))
+    content += struct.pack(f"<{len(ranges)}I", *(start for start, *_ in ranges))
+    for _, end, lat, lng, place in ranges:
+        content += _RECORD.pack(end, lat, lng, place)
+    offset = 0
+    for name in names:
+        content += _OFFSET.pack(offset)
+        offset += len(name)
+    content += _OFFSET.pack(offset)
+    content += b"".join(names)
+    storage.write_atomically(database_path, bytes(content))
+    return len(ranges)
+
+
+def _parse_address(value: str) -> int | None:
+    value = value.strip()
+    try:
+        return int(value) if value.isdigit() else int(ipaddress.IPv4Address(value))
+    except ValueError:
+        return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Converts a CSV IP range dump into a geolocation database")
+    parser.add_argument("csv", type=Path)
+    parser.add_argument("database", type=Path)
+    args = parser.parse_args()
+    print(f"Wrote {build(args.csv, args.database)} ranges to {args.database}")
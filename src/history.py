@@ -0,0 +1,223 @@
+import csv
+import datetime
+import enum
+import mmap
+import os
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import TextIO
+
+import datastore
+import daytime
+import forelogger as log
+
+_MAGIC = b"KFHS"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHH")  # magic, version, record size
+# Epoch milliseconds, provider, condition code, cloud %, verdict, fetch latency in ms, backlight action, cache hit
+_RECORD = struct.Struct("<q16sHBBfb?")
+
+_CSV_COLUMNS = ["timestamp", "provider", "condition_code", "cloud_pct", "is_dark", "latency_ms", "action", "cached"]
+
+
+class Action(enum.IntEnum):
+    NONE = -1
+    OFF = 0
+    ON = 1
+
+
+class HistoryRecord:
+    def __init__(
+        self,
+        timestamp: datetime.datetime,
+        provider: str,
+        condition_code: int,
+        cloud_pct: int,
+        is_dark: bool,
+        latency_ms: float,
+        action: Action,
+        cached: bool = False,
+    ):
+        self.timestamp = timestamp
+        self.provider = provider
+        self.condition_code = condition_code
+        self.cloud_pct = cloud_pct
+        self.is_dark = is_dark
+        self.latency_ms = latency_ms
+        self.action = action
+        self.cached = cached  # Answered by the weather cache, so no fetch happened and the latency is 0
+
+    def pack(self) -> bytes:
+        return _RECORD.pack(
+            round(self.timestamp.timestamp() * 1000),
+            self.provider.encode("ascii", "replace")[:16],
+            self.condition_code,
+            self.cloud_pct,
+            self.is_dark,
+            self.latency_ms,
+            self.action,
+            self.cached,
+        )
+
+    @staticmethod
+    def unpack_from(buffer, offset: int) -> "HistoryRecord":
+        epoch_ms, provider, condition_code, cloud_pct, is_dark, latency_ms, action, cached = _RECORD.unpack_from(
+            buffer, offset
+        )
+        return HistoryRecord(
+            datetime.datetime.fromtimestamp(epoch_ms / 1000, datetime.timezone.utc),
+            provider.rstrip(b"\0").decode("ascii"),
+            condition_code,
+            cloud_pct,
+            bool(is_dark),
+            latency_ms,
+            Action(action),
+            bool(cached),
+        )
+
+    def to_row(self) -> list:
+        return [
+            self.timestamp.isoformat(timespec="milliseconds"),
+            self.provider,
+            self.condition_code,
+            self.cloud_pct,
+            int(self.is_dark),
+            f"{self.latency_ms:.1f}",
+            self.action.name,
+            int(self.cached),
+        ]
+
+
+class HistoryStore:
+    # Fixed-width records appended in time order, so a time range is two binary searches away
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.path = path
+        self.__max_bytes = max_bytes
+        self.__backups = backups
+        self.__lock = threading.Lock()
+
+    def append(self, record: HistoryRecord):
+        with self.__lock:
+            size = self.path.stat().st_size if self.path.exists() else 0
+            if size > _HEADER.size and size + _RECORD.size > self.__max_bytes:
+                self.__rotate()
+                size = 0
+            with self.path.open("ab") as f:
+                if size == 0:
+                    f.write(_HEADER.pack(_MAGIC, _VERSION, _RECORD.size))
+                f.write(record.pack())
+
+    def query(
+        self, since: datetime.datetime | None = None, until: datetime.datetime | None = None
+    ) -> list[HistoryRecord]:
+        since_ms = round(since.timestamp() * 1000) if since is not None else -(2**63)
+        until_ms = round(until.timestamp() * 1000) if until is not None else 2**63 - 1
+        records = []
+        with self.__lock:
+            for path in self.__files_oldest_first():
+                records.extend(_read_range(path, since_ms, until_ms))
+        return records
+
+    def export_csv(self, out: TextIO, since: datetime.datetime | None = None, until: datetime.datetime | None = None):
+        writer = csv.writer(out)
+        writer.writerow(_CSV_COLUMNS)
+        writer.writerows(record.to_row() for record in self.query(since, until))
+
+    def __files_oldest_first(self) -> list[Path]:
+        rotated = [self.path.with_name(f"{self.path.name}.{i}") for i in range(self.__backups, 0, -1)]
+        return [path for path in rotated + [self.path] if path.exists()]
+
+    def __rotate(self):
+        for i in range(self.__backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.__backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+
+def record(
+    provider: str,
+    condition_code: int,
+    cloud_pct: int,
+    is_dark: bool,
+    latency_seconds: float,
+    action: Action,
+    cached: bool = False,
+):
+    try:
+        _store().append(
+            HistoryRecord(
+                daytime.now(),
+                provider,
+                condition_code,
+                cloud_pct,
+                is_dark,
+                0.0 if cached else latency_seconds * 1000,
+                action,
+                cached,
+            )
+        )
+    except Exception as e:
+        log.warn(f"Failed to write the weather history: {e}")
+
+
+def query(since: datetime.datetime | None = None, until: datetime.datetime | None = None) -> list[HistoryRecord]:
+    return _store().query(since, until)
+
+
+def _read_range(path: Path, since_ms: int, until_ms: int) -> list[HistoryRecord]:
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size <= _HEADER.size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            magic, version, record_size = _HEADER.unpack_from(buffer, 0)
+            if magic != _MAGIC or version != _VERSION or record_size != _RECORD.size:
+                log.warn(f"{path} is not a weather history file, skipping it")
+                return []
+            count = (len(buffer) - _HEADER.size) // _RECORD.size
+            first = _first_at_or_after(buffer, count, since_ms)
+            last = _first_at_or_after(buffer, count, until_ms + 1)
+            return [HistoryRecord.unpack_from(buffer, _HEADER.size + i * _RECORD.size) for i in range(first, last)]
+
+
+def _first_at_or_after(buffer: mmap.mmap, count: int, epoch_ms: int) -> int:
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        (timestamp,) = struct.unpack_from("<q", buffer, _HEADER.size + middle * _RECORD.size)
+        if timestamp < epoch_ms:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _store() -> HistoryStore:
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = HistoryStore(
+                    datastore.get_history_path(), datastore.get_history_max_bytes(), datastore.get_history_backups()
+                )
+    return _STORE
+
+
+_STORE: HistoryStore | None = None
+_STORE_LOCK = threading.Lock()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exports the weather and backlight history as CSV")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat)
+    args = parser.parse_args()
+    datastore.init()
+    _store().export_csv(sys.stdout, args.since, args.until)
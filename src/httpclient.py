@@ -0,0 +1,169 @@
+import collections
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import forelogger as log
+import metrics
+
+if TYPE_CHECKING:
+    import requests
+
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class LatencyStats:
+    def __init__(self, window: int = 100):
+        self.__samples: collections.deque[tuple[float, bool]] = collections.deque(maxlen=window)
+        self.__requests = 0
+        self.__errors = 0
+        self.__lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool = True):
+        with self.__lock:
+            self.__samples.append((seconds, ok))
+            self.__requests += 1
+            if not ok:
+                self.__errors += 1
+
+    @property
+    def requests(self) -> int:
+        return self.__requests
+
+    @property
+    def errors(self) -> int:
+        return self.__errors
+
+    @property
+    def samples(self) -> int:
+        return len(self.__samples)
+
+    @property
+    def error_rate(self) -> float:
+        # Over the recent window only, so a provider recovers from an old outage
+        with self.__lock:
+            outcomes = [ok for _, ok in self.__samples]
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def percentile(self, pct: float) -> float | None:
+        with self.__lock:
+            samples = sorted(seconds for seconds, _ in self.__samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def __str__(self):
+        p50, p90 = self.percentile(50), self.percentile(90)
+        if p50 is None:
+            return "no requests"
+        return f"{self.__requests} requests, {self.__errors} errors, p50 {p50 * 1000:.0f} ms, p90 {p90 * 1000:.0f} ms"
+
+
+def get(url: str, **kwargs) -> "requests.Response":
+    return _request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> "requests.Response":
+    # Not retried, the default retry policy only covers idempotent methods
+    return _request("POST", url, **kwargs)
+
+
+def latency_stats(host: str) -> LatencyStats:
+    stats = _LATENCY.get(host)
+    if stats is None:
+        with _LOCK:
+            stats = _LATENCY.setdefault(host, LatencyStats())
+    return stats
+
+
+def use_session(session: "requests.Session"):
+    # Anything with a compatible request() works, the simulation answers every API in-process this way
+    global _SESSION
+    with _LOCK:
+        _SESSION = session
+
+
+def close():
+    global _SESSION
+    with _LOCK:
+        if _SESSION is not None:
+            _SESSION.close()
+            _SESSION = None
+
+
+def _request(method: str, url: str, **kwargs) -> "requests.Response":
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    started = time.perf_counter()
+    ok = False
+    try:
+        session = _session()
+        override = _HOST_OVERRIDES.get(host)
+        if override is not None:
+            url = override + parts.path + (f"?{parts.query}" if parts.query else "")
+        resp = session.request(method, url, timeout=_TIMEOUT, **kwargs)
+        ok = resp.status_code < 400
+        return resp
+    finally:
+        elapsed = time.perf_counter() - started
+        latency_stats(host).record(elapsed, ok)
+        metrics.observe("http_request_seconds", elapsed, host=host, ok=str(ok).lower())
+
+
+def _session() -> "requests.Session":
+    global _SESSION
+    if _SESSION is None:
+        with _LOCK:
+            if _SESSION is None:
+                _SESSION = _create_session()
+    return _SESSION
+
+
+def _create_session() -> "requests.Session":
+    # requests takes a noticeable part of the startup time, so it's only loaded for the first request
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    global _TIMEOUT, _HOST_OVERRIDES
+    _TIMEOUT = (
+        float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5")),
+        float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "15")),
+    )
+    _HOST_OVERRIDES = _parse_host_overrides(os.getenv("HTTP_HOST_OVERRIDES", ""))
+    retry = Retry(
+        total=int(os.getenv("HTTP_RETRIES", "3")),
+        backoff_factor=float(os.getenv("HTTP_RETRY_BACKOFF_SECONDS", "0.5")),
+        status_forcelist=_RETRY_STATUSES,
+        allowed_methods=("GET",),
+        respect_retry_after_header=False,  # Keeps the worst case bounded by our own backoff
+        raise_on_status=False,  # The last response is returned as is, callers report the failure
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=4, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    log.info(f"HTTP client initialized with {_TIMEOUT} timeouts and {retry.total} retries")
+    for host, base_url in _HOST_OVERRIDES.items():
+        log.warn(f"Requests to {host} go to {base_url}")
+    return session
+
+
+def _parse_host_overrides(value: str) -> dict[str, str]:
+    # "api.example.com=http://127.0.0.1:8080/example,...": the path and query of the request are appended to the base URL
+    overrides = {}
+    for pair in filter(None, (pair.strip() for pair in value.split(","))):
+        host, _, base_url = pair.partition("=")
+        if not base_url:
+            raise Exception(f"HTTP_HOST_OVERRIDES entry '{pair}' is not host=base_url")
+        overrides[host.strip()] = base_url.strip().rstrip("/")
+    return overrides
+
+
+_SESSION: "requests.Session | None" = None
+_TIMEOUT = (5.0, 15.0)
+_HOST_OVERRIDES: dict[str, str] = {}
+_LATENCY: dict[str, LatencyStats] = {}
+_LOCK = threading.Lock()
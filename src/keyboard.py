@@ -1,50 +1,368 @@
-from pywinusb import hid
+import abc
+import os
+import sys
+import threading
+import time
+from concurrent import futures
+from pathlib import Path
+from typing import Callable
 
+import breaker
+import datastore
 import forelogger as log
-
-VENDOR_ID = "1EA7"
-PRODUCT_ID = "6A62"
+import httpclient
+import metrics
 
 _VENDOR_ID = 0x1EA7
 _PRODUCT_ID = 0x6A62
+_USAGE_PAGE = 0xFF60
+_USAGE = 0x63
+_REPORT_LENGTH = 32
+
+_ON_PAYLOAD = bytes([0x31])
+_OFF_PAYLOAD = bytes([0x30])
 
 
 class DisconnectedException(Exception):
     pass
 
 
-_BACKLIGHT_IS_ON = None
+class Transport(abc.ABC):
+    @abc.abstractmethod
+    def open(self): ...
 
+    @abc.abstractmethod
+    def send(self, payload: bytes): ...
 
-def toggle_backlight(turn_on: bool, force=False):
-    global _BACKLIGHT_IS_ON
-    if not force and _BACKLIGHT_IS_ON == turn_on:
-        log.info("Backlight is already " + ("ON" if _BACKLIGHT_IS_ON else "OFF"))
-        return
+    @abc.abstractmethod
+    def close(self): ...
 
-    hid_devices = hid.HidDeviceFilter(vendor_id=_VENDOR_ID, product_id=_PRODUCT_ID).get_devices()
-    if not hid_devices:
-        raise DisconnectedException("The keyboard is not found. Can't toggle backlight")
 
-    target_usage = hid.get_full_usage_id(0xFF60, 0x63)
-    for device in hid_devices:
-        try:
-            device.open()
-            for report in device.find_output_reports():
-                if target_usage in report:
-                    log.info(f"Sending {'ON' if turn_on else 'OFF'} to the keyboard")
-                    data = [0x31 if turn_on else 0x30]
-                    report_length = 32
-                    request_data = [0x00] * (report_length)  # First byte is Report ID
-                    request_data[0 : len(data)] = data
-                    report[target_usage] = request_data
-                    report.send()
-
-                    _BACKLIGHT_IS_ON = turn_on
-                    return
-        except Exception as e:
-            log.error(f"Failed to send message to the keyboard, error is: {e}")
-        finally:
+class PywinusbTransport(Transport):
+    def __init__(self, vendor_id: int, product_id: int, usage_page: int, usage: int, report_length: int):
+        self.__vendor_id = vendor_id
+        self.__product_id = product_id
+        self.__usage_page = usage_page
+        self.__usage = usage
+        self.__device = None
+        self.__report = None
+        self.__target_usage = None
+        self.__buffer = [0x00] * report_length  # First byte is Report ID
+
+    def open(self):
+        from pywinusb import hid
+
+        hid_devices = hid.HidDeviceFilter(vendor_id=self.__vendor_id, product_id=self.__product_id).get_devices()
+        if not hid_devices:
+            raise DisconnectedException("The keyboard is not found. Can't toggle backlight")
+
+        self.__target_usage = hid.get_full_usage_id(self.__usage_page, self.__usage)
+        for device in hid_devices:
+            try:
+                device.open()
+                for report in device.find_output_reports():
+                    if self.__target_usage in report:
+                        self.__device = device
+                        self.__report = report
+                        return
+            except Exception as e:
+                log.error(f"Failed to open the keyboard, error is: {e}")
             device.close()
+        raise Exception("The keyboard can't receive HID messages")
+
+    def send(self, payload: bytes):
+        # Devices may have payloads of different lengths, so whatever the previous one left behind is cleared
+        self.__buffer[0 : len(payload)] = payload
+        self.__buffer[len(payload) :] = [0x00] * (len(self.__buffer) - len(payload))
+        self.__report[self.__target_usage] = self.__buffer
+        self.__report.send()
+
+    def close(self):
+        if self.__device is not None:
+            try:
+                self.__device.close()
+            finally:
+                self.__device = None
+                self.__report = None
+
+
+class HidrawTransport(Transport):
+    def __init__(
+        self,
+        vendor_id: int,
+        product_id: int,
+        usage_page: int,
+        usage: int,
+        report_length: int,
+        sysfs_root: Path = Path("/sys/class/hidraw"),
+        dev_root: Path = Path("/dev"),
+    ):
+        self.__hid_id = f"{vendor_id:08X}:{product_id:08X}"
+        self.__usage_items = (bytes([0x06, usage_page & 0xFF, usage_page >> 8]), bytes([0x09, usage]))
+        self.__sysfs_root = sysfs_root
+        self.__dev_root = dev_root
+        self.__fd = None
+        self.__buffer = bytearray(1 + report_length)  # Report number 0 goes first, the report follows
+
+    def open(self):
+        matching = [node for node in self.__hidraw_nodes() if self.__hid_id in _read_uevent(node).get("HID_ID", "")]
+        if not matching:
+            raise DisconnectedException("The keyboard is not found. Can't toggle backlight")
+
+        for node in matching:
+            # Keyboards expose several interfaces, only one of them declares the raw HID usage
+            try:
+                descriptor = (node / "device" / "report_descriptor").read_bytes()
+            except OSError as e:
+                log.warn(f"Failed to read the report descriptor of {node.name}, error is: {e}")
+                continue
+            if all(item in descriptor for item in self.__usage_items):
+                self.__fd = os.open(self.__dev_root / node.name, os.O_WRONLY)
+                return
+        raise Exception("The keyboard can't receive HID messages")
+
+    def send(self, payload: bytes):
+        self.__buffer[1 : 1 + len(payload)] = payload
+        self.__buffer[1 + len(payload) :] = bytes(len(self.__buffer) - 1 - len(payload))
+        written = os.write(self.__fd, self.__buffer)
+        if written != len(self.__buffer):
+            raise Exception(f"Only {written} of the {len(self.__buffer)} bytes of the report were written")
+
+    def close(self):
+        if self.__fd is not None:
+            try:
+                os.close(self.__fd)
+            finally:
+                self.__fd = None
+
+    def __hidraw_nodes(self) -> list[Path]:
+        if not self.__sysfs_root.is_dir():
+            return []
+        return sorted(self.__sysfs_root.iterdir())
+
+
+class DeviceSession:
+    def __init__(self, transport: Transport):
+        self.__transport = transport
+        self.__open = False
+        self.__lock = threading.Lock()
+
+    def send(self, payload: bytes):
+        with self.__lock:
+            if not self.__open:
+                self.__transport.open()
+                self.__open = True
+            try:
+                self.__transport.send(payload)
+            except Exception:
+                self.__close()
+                raise
+
+    def invalidate(self):
+        with self.__lock:
+            self.__close()
+
+    def __close(self):
+        if self.__open:
+            self.__open = False
+            try:
+                self.__transport.close()
+            except Exception as e:
+                log.warn(f"Failed to close the keyboard, error is: {e}")
+
+
+class DeviceConfig:
+    def __init__(
+        self,
+        name: str,
+        vendor_id: int,
+        product_id: int,
+        usage_page: int = _USAGE_PAGE,
+        usage: int = _USAGE,
+        report_length: int = _REPORT_LENGTH,
+        on_payload: bytes = _ON_PAYLOAD,
+        off_payload: bytes = _OFF_PAYLOAD,
+    ):
+        if max(len(on_payload), len(off_payload)) > report_length:
+            raise Exception(f"The payloads of {name} don't fit its {report_length} byte report")
+        self.name = name
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.usage_page = usage_page
+        self.usage = usage
+        self.report_length = report_length
+        self.on_payload = on_payload
+        self.off_payload = off_payload
+
+    def matches(self, device_id: str) -> bool:
+        device_id = device_id.upper()
+        return f"{self.vendor_id:04X}" in device_id and f"{self.product_id:04X}" in device_id
+
+    @staticmethod
+    def from_dict(config: dict) -> "DeviceConfig":
+        return DeviceConfig(
+            config.get("name", f"{config["vendor_id"]}:{config["product_id"]}"),
+            int(config["vendor_id"], 16),
+            int(config["product_id"], 16),
+            int(config.get("usage_page", f"{_USAGE_PAGE:X}"), 16),
+            int(config.get("usage", f"{_USAGE:X}"), 16),
+            int(config.get("report_length", _REPORT_LENGTH)),
+            bytes.fromhex(config.get("on_payload", _ON_PAYLOAD.hex())),
+            bytes.fromhex(config.get("off_payload", _OFF_PAYLOAD.hex())),
+        )
+
+
+class Device:
+    def __init__(self, config: DeviceConfig, transport: Transport):
+        self.config = config
+        self.session = DeviceSession(transport)
+        self.backlight_is_on: bool | None = None
+        self.latency = httpclient.LatencyStats()
+        # A missing keyboard is left to the reconnect event, only a present one failing says it's broken
+        self.breaker = breaker.get(f"keyboard:{config.name}", ignored=(DisconnectedException,))
+
+
+def toggle_backlight(turn_on: bool, force=False) -> bool:
+    devices = _devices()
+    targets = [device for device in devices if force or device.backlight_is_on != turn_on]
+    if not targets:
+        log.info("Backlight is already " + ("ON" if turn_on else "OFF"))
+        return False
+
+    log.info(f"Sending {'ON' if turn_on else 'OFF'} to {len(targets)} keyboard(s)")
+    if len(devices) == 1:
+        outcomes = {targets[0]: _outcome(lambda: _send(targets[0], turn_on))}
     else:
-        log.warn("The keyboard can't receive HID messages")
+        # Every board switches at the same moment instead of one after another
+        pending = {_executor().submit(_send, device, turn_on): device for device in targets}
+        done, not_done = futures.wait(pending, timeout=datastore.get_keyboard_send_timeout_seconds())
+        outcomes = {pending[future]: future.exception() for future in done}
+        for future in not_done:
+            device = pending[future]
+            device.backlight_is_on = None  # The send may still land, so the state is unknown until the next one
+            outcomes[device] = TimeoutError(f"No answer in {datastore.get_keyboard_send_timeout_seconds()} seconds")
+
+    disconnected = 0
+    for device, error in outcomes.items():
+        if isinstance(error, DisconnectedException):
+            disconnected += 1
+            log.warn(f"{device.config.name} is not connected")
+        elif isinstance(error, breaker.CircuitOpenException):
+            log.warn(f"Skipping {device.config.name}: {error}")
+        elif error is not None:
+            log.error(f"Failed to send message to {device.config.name}, error is: {error}")
+    if disconnected == len(devices):
+        raise DisconnectedException("No keyboard is found. Can't toggle backlight")
+    # Only a command that reached a keyboard counts as sent
+    return any(error is None for error in outcomes.values())
+
+
+def toggle_device(name: str, turn_on: bool):
+    device = next((device for device in _devices() if device.config.name == name), None)
+    if device is None:
+        raise Exception(f"No keyboard named {name} is registered")
+    if device.backlight_is_on != turn_on:
+        _send(device, turn_on)
+
+
+def is_registered(device_id: str) -> bool:
+    return any(device.config.matches(device_id) for device in _devices())
+
+
+def latency_report() -> str:
+    return "; ".join(f"{device.config.name}: {device.latency}" for device in _devices())
+
+
+def invalidate(device_id: str | None = None):
+    for device in _DEVICES or []:
+        if device_id is None or device.config.matches(device_id):
+            device.session.invalidate()
+            device.breaker.reset()  # A replugged keyboard gets a fresh start
+
+
+def use_transport(transport: Transport, config: DeviceConfig | None = None):
+    global _DEVICES
+    invalidate()
+    _DEVICES = [Device(config or _default_config(), transport)]
+
+
+def _send(device: Device, turn_on: bool):
+    device.breaker.call(_write, device, turn_on)
+
+
+def _write(device: Device, turn_on: bool):
+    payload = device.config.on_payload if turn_on else device.config.off_payload
+    started = time.perf_counter()
+    try:
+        device.session.send(payload)
+    except DisconnectedException:
+        raise
+    except Exception as e:
+        # The cached handle may belong to a device that was replugged since, so try once more with a fresh one
+        log.warn(f"Failed to send message to {device.config.name}, reopening it. Error is: {e}")
+        try:
+            device.session.send(payload)
+        except Exception:
+            device.backlight_is_on = None
+            device.latency.record(time.perf_counter() - started, ok=False)
+            raise
+    elapsed = time.perf_counter() - started
+    device.latency.record(elapsed)
+    metrics.observe("keyboard_send_seconds", elapsed, device=device.config.name)
+    device.backlight_is_on = turn_on
+    log.debug("Sent %s to %s in %.1f ms", "ON" if turn_on else "OFF", device.config.name, elapsed * 1000)
+
+
+def _outcome(send: Callable[[], None]) -> BaseException | None:
+    try:
+        send()
+    except Exception as e:
+        return e
+    return None
+
+
+def _devices() -> list[Device]:
+    global _DEVICES
+    if _DEVICES is None:
+        with _DEVICES_LOCK:
+            if _DEVICES is None:
+                configs = [DeviceConfig.from_dict(config) for config in datastore.get_device_configs()]
+                if not configs:
+                    configs = [_default_config()]
+                log.info(f"Controlling {", ".join(config.name for config in configs)}")
+                _DEVICES = [Device(config, _platform_transport(config)) for config in configs]
+    return _DEVICES
+
+
+def _default_config() -> DeviceConfig:
+    return DeviceConfig("keyboard", _VENDOR_ID, _PRODUCT_ID)
+
+
+def _executor() -> futures.ThreadPoolExecutor:
+    global _EXECUTOR
+    with _DEVICES_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = futures.ThreadPoolExecutor(max_workers=2 * len(_devices()), thread_name_prefix="keyboard")
+    return _EXECUTOR
+
+
+def _platform_transport(config: DeviceConfig) -> Transport:
+    args = (config.vendor_id, config.product_id, config.usage_page, config.usage, config.report_length)
+    if sys.platform == "win32":
+        return PywinusbTransport(*args)
+    elif sys.platform.startswith("linux"):
+        return HidrawTransport(*args)
+    raise Exception(f"Keyboard access is not supported on {sys.platform}")
+
+
+def _read_uevent(hidraw_node: Path) -> dict[str, str]:
+    try:
+        lines = (hidraw_node / "device" / "uevent").read_text().splitlines()
+    except OSError:
+        return {}
+    return dict(line.split("=", 1) for line in lines if "=" in line)
+
+
+_DEVICES: list[Device] | None = None
+_DEVICES_LOCK = threading.RLock()
+_EXECUTOR: futures.ThreadPoolExecutor | None = None
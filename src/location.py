@@ -27,3 +27,7 @@ class Location:
 
 def get():
     return Location(datastore.get_location())
+
+
+def refresh():
+    return Location(datastore.refresh_location())
@@ -0,0 +1,216 @@
+import contextlib
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+import forelogger as log
+import storage
+
+if TYPE_CHECKING:
+    import http.server
+
+_DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DESCRIPTIONS = {
+    "http_request_seconds": "HTTP request latency by host",
+    "weather_check_seconds": "Weather provider check latency",
+    "daytime_fetch_seconds": "Time to fetch or calculate missing daytime data",
+    "keyboard_send_seconds": "Backlight send latency by device",
+    "forecaster_check_seconds": "Full weather check cycle, from the cache lookup to the backlight",
+    "scheduler_wakeup_lateness_seconds": "How late the scheduler woke up after a job deadline",
+    "scheduler_wakeups_total": "Scheduler wakeups",
+    "cache_requests_total": "Result cache lookups by outcome",
+    "circuit_breaker_state": "Circuit breaker state by dependency: 0 closed, 1 half-open, 2 open",
+    "circuit_breaker_opened_total": "Times a dependency's circuit breaker opened",
+}
+
+
+class _Counter:
+    type = "counter"
+
+    def __init__(self):
+        self.value = 0.0
+
+    def update(self, amount: float):
+        self.value += amount
+
+    def render(self, name: str, labels: str) -> list[str]:
+        return [f"{name}{{{labels}}} {_format(self.value)}" if labels else f"{name} {_format(self.value)}"]
+
+
+class _Gauge(_Counter):
+    type = "gauge"
+
+    def update(self, value: float):
+        self.value = value
+
+
+class _Histogram:
+    type = "histogram"
+
+    def __init__(self, buckets: tuple[float, ...] = _DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def update(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name: str, labels: str) -> list[str]:
+        prefix = f"{labels}," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {_format(self.sum)}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+def inc(name: str, amount: float = 1, **labels: str):
+    if not _ENABLED:
+        return
+    _record(name, _Counter, amount, labels)
+
+
+def observe(name: str, value: float, **labels: str):
+    if not _ENABLED:
+        return
+    _record(name, _Histogram, value, labels)
+
+
+def gauge(name: str, value: float, **labels: str):
+    if not _ENABLED:
+        return
+    _record(name, _Gauge, value, labels)
+
+
+def timer(name: str, **labels: str) -> contextlib.AbstractContextManager:
+    # Disabled metrics share one no-op context, so a timed block costs a global lookup and a call
+    if not _ENABLED:
+        return _NO_OP
+    return _timed(name, labels)
+
+
+def render() -> str:
+    with _LOCK:
+        by_name: dict[str, list[tuple[str, _Counter | _Histogram]]] = {}
+        for (name, labels), metric in sorted(_METRICS.items()):
+            by_name.setdefault(name, []).append((",".join(f'{k}="{v}"' for k, v in labels), metric))
+        lines = []
+        for name, series in by_name.items():
+            if name in _DESCRIPTIONS:
+                lines.append(f"# HELP {name} {_DESCRIPTIONS[name]}")
+            lines.append(f"# TYPE {name} {series[0][1].type}")
+            for labels, metric in series:
+                lines.extend(metric.render(name, labels))
+    return "\n".join(lines) + "\n"
+
+
+def start(port: int, snapshot_path: Path, snapshot_seconds: float):
+    global _ENABLED, _SERVER, _SNAPSHOT_THREAD
+    if _ENABLED:
+        return
+    _ENABLED = True
+    _STOPPED.clear()
+    if port:
+        _SERVER = _create_server(port)
+        threading.Thread(target=_SERVER.serve_forever, name="metrics", daemon=True).start()
+        log.info(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+    _SNAPSHOT_THREAD = threading.Thread(
+        target=_write_snapshots, args=(snapshot_path, snapshot_seconds), name="metrics-snapshot", daemon=True
+    )
+    _SNAPSHOT_THREAD.start()
+
+
+def stop():
+    global _ENABLED, _SERVER
+    if not _ENABLED:
+        return
+    _STOPPED.set()
+    if _SNAPSHOT_THREAD is not None:
+        _SNAPSHOT_THREAD.join()
+    if _SERVER is not None:
+        _SERVER.shutdown()
+        _SERVER.server_close()
+        _SERVER = None
+    _ENABLED = False
+
+
+def _format(value: float) -> str:
+    # Every digit, ":g" keeps 6 and a counter past a million would stall or go backwards in Prometheus
+    return repr(float(value))
+
+
+def _record(name: str, kind: type, value: float, labels: dict[str, str]):
+    key = (name, tuple(sorted(labels.items())))
+    with _LOCK:
+        metric = _METRICS.get(key)
+        if metric is None:
+            metric = _METRICS[key] = kind()
+        metric.update(value)
+
+
+@contextlib.contextmanager
+def _timed(name: str, labels: dict[str, str]) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, _Histogram, time.perf_counter() - started, labels)
+
+
+def _create_server(port: int) -> "http.server.ThreadingHTTPServer":
+    # Only loaded when metrics are enabled, http.server pulls in a good part of the email package
+    import http.server
+
+    class _Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the service log otherwise
+
+    return http.server.ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+
+
+def _write_snapshots(path: Path, interval: float):
+    while True:
+        stopped = _STOPPED.wait(interval)
+        try:
+            storage.write_atomically(path, render().encode("utf-8"))
+        except OSError as e:
+            log.warn(f"Failed to write the metrics snapshot: {e}")
+        if stopped:
+            return
+
+
+_ENABLED = False
+_METRICS: dict[tuple[str, tuple], _Counter | _Histogram] = {}
+_LOCK = threading.Lock()
+_NO_OP = contextlib.nullcontext()
+_STOPPED = threading.Event()
+_SERVER: "http.server.ThreadingHTTPServer | None" = None
+_SNAPSHOT_THREAD: threading.Thread | None = None
@@ -0,0 +1,133 @@
+import datetime
+from datetime import timedelta
+
+import datastore
+import forelogger as log
+import location
+import prefetch
+import weather
+from datastore import PollingMode
+
+_FORECAST_REFRESH_INTERVAL = timedelta(hours=3)
+_FORECAST_MAX_AGE = 2 * _FORECAST_REFRESH_INTERVAL  # One failed refresh is fine, the forecast doesn't change much
+
+
+class Schedule:
+    def __init__(self, cur_loc: location.Location, day: datetime.date):
+        self.location = cur_loc
+        self.day = day
+        self._checks = 0
+        # Checks answered by the weather cache cost nothing, so the calls are counted where the fetches happen
+        self.__weather_calls_at_start = weather.api_calls(cur_loc)
+        self._first_check: datetime.datetime | None = None
+        self.__reported = False
+
+    def next_check(self, last_check: datetime.datetime, is_dark: bool) -> datetime.datetime:
+        self._count_check(last_check)
+        return last_check + _check_interval()
+
+    def report(self, last_check: datetime.datetime):
+        if self.__reported or self._first_check is None:
+            return
+        self.__reported = True
+        log.info(self._summary(last_check, weather.api_calls(self.location) - self.__weather_calls_at_start))
+
+    def _summary(self, last_check: datetime.datetime, api_calls: int) -> str:
+        return f"Made {self._checks} weather checks and {api_calls} weather API calls today"
+
+    def _count_check(self, check_time: datetime.datetime):
+        self._checks += 1
+        if self._first_check is None:
+            self._first_check = check_time
+
+
+class AdaptiveSchedule(Schedule):
+    def __init__(self, cur_loc: location.Location, day: datetime.date):
+        super().__init__(cur_loc, day)
+        self.__forecast_requested_at: datetime.datetime | None = None
+
+    def next_check(self, last_check: datetime.datetime, is_dark: bool) -> datetime.datetime:
+        self._count_check(last_check)
+        dense = last_check + _check_interval()
+        forecast = self.__current_forecast(last_check)
+        if not forecast:
+            return dense
+
+        window = timedelta(minutes=datastore.get_weather_transition_window_minutes())
+        transitions = _transitions(forecast)
+        if any(abs(transition - last_check) <= window for transition in transitions):
+            return dense
+
+        if _predicted_at(forecast, last_check) != is_dark:
+            log.info("The weather doesn't match the forecast, checking it at the regular interval")
+            return dense
+
+        sparse = last_check + timedelta(minutes=datastore.get_weather_max_check_interval_minutes())
+        upcoming = [transition for transition in transitions if transition > last_check]
+        if not upcoming:
+            return sparse
+        log.info(f"The weather is expected to change around {upcoming[0]}")
+        return max(dense, min(sparse, upcoming[0] - window))
+
+    def _summary(self, last_check: datetime.datetime, api_calls: int) -> str:
+        fixed_calls = _fixed_interval_calls(self._first_check, last_check, timedelta(seconds=weather.cache_ttl()))
+        return (
+            f"{super()._summary(last_check, api_calls)}, fixed-interval polling would have made {fixed_calls}. "
+            f"Saved {fixed_calls - api_calls} API calls"
+        )
+
+    def __current_forecast(self, now: datetime.datetime) -> list[tuple[datetime.datetime, bool]] | None:
+        # The download runs in the background, until it's done the weather is checked at the regular interval
+        if self.__forecast_requested_at is None or now - self.__forecast_requested_at >= _FORECAST_REFRESH_INTERVAL:
+            self.__forecast_requested_at = now
+            prefetch.forecast(self.location)
+        return weather.cached_forecast(self.location, _FORECAST_MAX_AGE)
+
+
+def for_day(cur_loc: location.Location, day: datetime.date) -> Schedule:
+    global _SCHEDULE
+    if (
+        _SCHEDULE is None
+        or _SCHEDULE.day != day
+        or (_SCHEDULE.location.lat, _SCHEDULE.location.lng) != (cur_loc.lat, cur_loc.lng)
+    ):
+        match datastore.get_weather_polling_mode():
+            case PollingMode.FIXED:
+                _SCHEDULE = Schedule(cur_loc, day)
+            case PollingMode.ADAPTIVE:
+                _SCHEDULE = AdaptiveSchedule(cur_loc, day)
+    return _SCHEDULE
+
+
+def _check_interval() -> timedelta:
+    return timedelta(minutes=datastore.get_weather_check_interval_minutes())
+
+
+def _fixed_interval_calls(first_check: datetime.datetime, last_check: datetime.datetime, cache_ttl: timedelta) -> int:
+    # Checks every interval ask a provider whenever the cached observation has outlived its TTL
+    calls = 0
+    fetched_at = None
+    check = first_check
+    while check < last_check:
+        if fetched_at is None or check - fetched_at >= cache_ttl:
+            calls += 1
+            fetched_at = check
+        check += _check_interval()
+    return calls
+
+
+def _predicted_at(forecast: list[tuple[datetime.datetime, bool]], moment: datetime.datetime) -> bool:
+    _, is_dark = min(forecast, key=lambda entry: abs(entry[0] - moment))
+    return is_dark
+
+
+def _transitions(forecast: list[tuple[datetime.datetime, bool]]) -> list[datetime.datetime]:
+    # The verdict flips somewhere between two forecast points, the midpoint is our best guess
+    return [
+        previous_time + (time - previous_time) / 2
+        for (previous_time, previous), (time, predicted) in zip(forecast, forecast[1:])
+        if predicted != previous
+    ]
+
+
+_SCHEDULE: Schedule | None = None
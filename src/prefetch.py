@@ -0,0 +1,68 @@
+import datetime
+import threading
+from concurrent import futures
+from typing import Callable
+
+import datastore
+import forelogger as log
+import location
+import weather
+
+
+def daytime(start: datetime.date, days: int):
+    _submit("daytime", _fetch_daytime, start, days)
+
+
+def refresh_location():
+    _submit("location", location.refresh)
+
+
+def warm_weather(cur_loc: location.Location):
+    _submit("weather", weather.observe, cur_loc)
+
+
+def forecast(cur_loc: location.Location):
+    _submit("forecast", weather.forecast, cur_loc)
+
+
+def use_executor(executor: futures.Executor):
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        _EXECUTOR = executor
+
+
+def cancel():
+    global _EXECUTOR
+    _CANCELLED.set()
+    with _EXECUTOR_LOCK:
+        executor, _EXECUTOR = _EXECUTOR, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fetch_daytime(start: datetime.date, days: int):
+    for offset in range(days):
+        if _CANCELLED.is_set():
+            return
+        datastore.get_daytime(start + datetime.timedelta(days=offset))
+
+
+def _submit(name: str, task: Callable, *args):
+    with _EXECUTOR_LOCK:
+        if _CANCELLED.is_set():
+            return
+        global _EXECUTOR
+        if _EXECUTOR is None:
+            _EXECUTOR = futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        future = _EXECUTOR.submit(task, *args)
+    future.add_done_callback(lambda done: _log_failure(name, done))
+
+
+def _log_failure(name: str, future: futures.Future):
+    if not future.cancelled() and future.exception() is not None:
+        log.warn(f"Failed to prefetch {name} data: {future.exception()}")
+
+
+_EXECUTOR: futures.Executor | None = None
+_EXECUTOR_LOCK = threading.Lock()
+_CANCELLED = threading.Event()
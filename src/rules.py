@@ -0,0 +1,115 @@
+import array
+import threading
+from typing import Iterable, Sequence
+
+import datastore
+import forelogger as log
+
+# Condition codes are either single codes or inclusive [from, to] ranges
+_REQUIRED_KEYS = ("dark_codes", "cloud_threshold")
+_DEFAULT_RULES = {
+    "openweathermap": {
+        "dark_codes": [
+            [200, 232],  # Thunderstorm
+            [502, 531],  # From heavy intensity to ragged shower rain
+            [600, 622],  # Snow
+            [711, 781],  # From smoke to tornado (lol)
+        ],
+        "cloud_threshold": 70,
+    },
+    "weatherapi": {
+        "dark_codes": [
+            1135,  # Fog
+            1147,  # Freezing fog
+        ],
+        "cloud_threshold": 70,
+    },
+}
+
+
+class RuleSet:
+    def __init__(self, provider: str, dark_codes: Iterable[int], cloud_threshold: float):
+        self.provider = provider
+        self.cloud_threshold = cloud_threshold
+        codes = set(dark_codes)
+        # One byte per condition code, so a verdict is an index instead of a chain of range checks
+        self.__dark_codes = array.array("B", bytes(max(codes, default=0) + 1))
+        for code in codes:
+            self.__dark_codes[code] = 1
+
+    def is_dark(self, condition_code: int, cloud_pct: float) -> bool:
+        return cloud_pct >= self.cloud_threshold or self.__code_is_dark(condition_code)
+
+    def evaluate(self, condition_codes: Sequence[int], cloud_pcts: Sequence[float]) -> list[bool]:
+        return self.sweep(condition_codes, cloud_pcts, [self.cloud_threshold])[self.cloud_threshold]
+
+    def sweep(
+        self, condition_codes: Sequence[int], cloud_pcts: Sequence[float], cloud_thresholds: Iterable[float]
+    ) -> dict[float, list[bool]]:
+        # The condition codes are looked up once for the whole series, every threshold only adds a comparison pass
+        table = self.__dark_codes
+        size = len(table)
+        dark_codes = [code < size and table[code] == 1 for code in condition_codes]
+        return {
+            threshold: [dark or cloud >= threshold for dark, cloud in zip(dark_codes, cloud_pcts)]
+            for threshold in cloud_thresholds
+        }
+
+    def __code_is_dark(self, condition_code: int) -> bool:
+        return condition_code < len(self.__dark_codes) and self.__dark_codes[condition_code] == 1
+
+
+def compile_rules(config: dict) -> dict[str, RuleSet]:
+    return {
+        provider: RuleSet(provider, _expand_codes(rules["dark_codes"]), float(rules["cloud_threshold"]))
+        for provider, rules in config.items()
+    }
+
+
+def for_provider(provider: str) -> RuleSet:
+    global _RULES
+    if _RULES is None:
+        with _RULES_LOCK:
+            if _RULES is None:
+                _RULES = compile_rules(_merged_config())
+                log.info(f"Compiled darkness rules for {", ".join(_RULES)}")
+    rule_set = _RULES.get(provider)
+    if rule_set is None:
+        raise Exception(f"No darkness rules for {provider}")
+    return rule_set
+
+
+def validate():
+    for provider, rules in _merged_config().items():
+        missing = [key for key in _REQUIRED_KEYS if key not in rules]
+        if missing:
+            raise Exception(f"Darkness rules for {provider} are missing {", ".join(missing)}")
+
+
+def reload():
+    global _RULES
+    with _RULES_LOCK:
+        _RULES = None
+
+
+def _merged_config() -> dict:
+    # Overrides are per key, so a file that only moves the cloud threshold keeps the default condition codes
+    overrides = datastore.get_rules_config()
+    return {
+        provider: {**_DEFAULT_RULES.get(provider, {}), **overrides.get(provider, {})}
+        for provider in _DEFAULT_RULES | overrides
+    }
+
+
+def _expand_codes(codes: list) -> list[int]:
+    expanded = []
+    for code in codes:
+        if isinstance(code, list):
+            expanded.extend(range(code[0], code[1] + 1))
+        else:
+            expanded.append(code)
+    return expanded
+
+
+_RULES: dict[str, RuleSet] | None = None
+_RULES_LOCK = threading.Lock()
@@ -0,0 +1,83 @@
+import datetime
+import heapq
+import itertools
+from datetime import timedelta
+from typing import Callable
+
+import daytime
+import forelogger as log
+import metrics
+from events import Event, EventListener
+
+
+class _Timer:
+    def __init__(self, name: str, due_at: datetime.datetime, action: Callable[[], None]):
+        self.name = name
+        self.due_at = due_at
+        self.action = action
+        self.deadline = daytime.monotonic() + max(0.0, (due_at - daytime.now()).total_seconds())
+
+
+class Scheduler:
+    # Keeps every pending job on one heap of monotonic deadlines, so the forecaster sleeps once for
+    # whichever job comes first instead of sequencing the waits by hand
+
+    def __init__(self, event_listener: EventListener):
+        self.wakeups = 0
+        self.__listener = event_listener
+        self.__heap: list[tuple[float, int, _Timer]] = []
+        self.__timers: dict[str, _Timer] = {}
+        self.__sequence = itertools.count()
+
+    def at(self, name: str, due_at: datetime.datetime, action: Callable[[], None]):
+        timer = _Timer(name, due_at, action)
+        self.__timers[name] = timer  # Replaces the previous timer with that name, its heap entry is skipped later
+        heapq.heappush(self.__heap, (timer.deadline, next(self.__sequence), timer))
+
+    def after(self, name: str, delay: timedelta, action: Callable[[], None]):
+        self.at(name, daytime.now() + delay, action)
+
+    def cancel(self, name: str):
+        self.__timers.pop(name, None)
+
+    def clear(self):
+        self.__timers.clear()
+        self.__heap.clear()
+
+    def reschedule(self, name: str, due_at: datetime.datetime):
+        timer = self.__timers.get(name)
+        if timer is not None:
+            self.at(name, due_at, timer.action)
+
+    def reanchor(self):
+        # Depending on the platform, the monotonic clock may stand still while the system is suspended,
+        # so the deadlines are recomputed from the wall-clock times the jobs were scheduled for
+        timers = list(self.__timers.values())
+        self.clear()
+        for timer in timers:
+            self.at(timer.name, timer.due_at, timer.action)
+
+    def run(self) -> Event | None:
+        # Runs the jobs as they become due. Returns the first incoming event, or None once no jobs are left
+        while True:
+            while self.__heap and self.__timers.get(self.__heap[0][2].name) is not self.__heap[0][2]:
+                heapq.heappop(self.__heap)
+            if not self.__heap:
+                return None
+
+            deadline, _, timer = self.__heap[0]
+            timeout = deadline - daytime.monotonic()
+            if timeout > 0:
+                log.info(f"Sleeping until {timer.due_at} for the {timer.name} job")
+                wake_event = self.__listener.sleep_for(timedelta(seconds=timeout))
+                self.wakeups += 1
+                metrics.inc("scheduler_wakeups_total", reason="timer" if wake_event is None else "event")
+                if wake_event is not None:
+                    return wake_event
+                continue
+
+            metrics.observe("scheduler_wakeup_lateness_seconds", -timeout, job=timer.name)
+            heapq.heappop(self.__heap)
+            del self.__timers[timer.name]
+            log.debug("Running the %s job", timer.name)
+            timer.action()
@@ -1,8 +1,9 @@
-import queue
+import os
 import re
 import sys
 import threading
 import typing
+from pathlib import Path
 
 import servicemanager
 import win32con
@@ -17,7 +18,7 @@ from win32con import DBT_DEVICEARRIVAL, DBT_DEVICEREMOVECOMPLETE, PBT_APMRESUMES
 import forecaster as forecaster
 import forelogger as log
 import keyboard
-from events import EventListener, IncomingEvent
+from events import EventListener, EventPipeline, IncomingEvent
 
 GUID_DEVINTERFACE_USB_DEVICE = "{A5DCBF10-6530-11D2-901F-00C04FB951ED}"
 
@@ -29,9 +30,18 @@ class KeyboardForecastService(win32serviceutil.ServiceFramework):
     _svc_description_ = "Controls the backlight based on the time of day and the current weather forecast"
 
     def __init__(self, args):
+        # Set first, so a failed initialization is reported as such instead of as a missing attribute later
+        self.hWaitStop = None
+        self.__events: EventPipeline | None = None
         try:
+            if "LOG_FILE" in os.environ:
+                log.init(log.SinkType.FILE, file_path=Path(os.environ["LOG_FILE"]))
+            else:
+                log.init(log.SinkType.EVENT_LOG)  # Still needed, it's what applies LOG_LEVEL
             self.__init_service(args)
+            forecaster.init()
             forecaster.validate()
+            self.__events = forecaster.create_event_pipeline()
         except Exception as e:
             log.error(f"Exception during initialization! {e}")
             if self.hWaitStop is not None:
@@ -44,7 +54,6 @@ class KeyboardForecastService(win32serviceutil.ServiceFramework):
         self.win_event_handle = win32gui.RegisterDeviceNotification(
             self.ssh, event_filter, win32con.DEVICE_NOTIFY_SERVICE_HANDLE
         )
-        self.__queue = queue.PriorityQueue()
 
     def GetAcceptedControls(self):
         control_events = win32serviceutil.ServiceFramework.GetAcceptedControls(self)
@@ -56,6 +65,8 @@ class KeyboardForecastService(win32serviceutil.ServiceFramework):
         return control_events
 
     def SvcOtherEx(self, control, event_type, data):
+        if self.__events is None:
+            return
         if control == win32service.SERVICE_CONTROL_DEVICEEVENT:
             self.__handle_device_event(event_type, data)
         elif control == win32service.SERVICE_CONTROL_POWEREVENT:
@@ -69,35 +80,43 @@ class KeyboardForecastService(win32serviceutil.ServiceFramework):
             if device_id_match is not None and self.__is_keyboard(device_id_match.group(1)):
                 if event_type == DBT_DEVICEARRIVAL:
                     log.info("Keyboard connected, sending event")
-                    self.__queue.put(IncomingEvent.KEYBOARD_CONNECTED)
+                    self.__events.put(IncomingEvent.KEYBOARD_CONNECTED)
                 elif event_type == DBT_DEVICEREMOVECOMPLETE:
                     log.info("Keyboard disconnected, expecting forecaster to go to sleep")
+                    keyboard.invalidate(device_id_match.group(1))
                 else:
                     log.info(f"Unknown keyboard event type: {event_type}")
 
     def __is_keyboard(self, device_id: str) -> bool:
-        return keyboard.VENDOR_ID in device_id and keyboard.PRODUCT_ID in device_id
+        return keyboard.is_registered(device_id)
 
     def __handle_power_event(self, event_type):
         if event_type == PBT_APMRESUMESUSPEND:
             log.info("Resumed from sleep, sending event")
-            self.__queue.put(IncomingEvent.SYSTEM_RESUME)
+            self.__events.put(IncomingEvent.SYSTEM_RESUME)
 
     def SvcDoRun(self):
+        if self.__events is None:
+            log.error("The service failed to initialize, not starting the forecaster")
+            log.shutdown()
+            return
         servicemanager.LogMsg(EVENTLOG_INFORMATION_TYPE, PYS_SERVICE_STARTED, (self._svc_name_, ""))
         log.info("Starting forecaster")
-        forecaster_thread = threading.Thread(target=forecaster.run, args=(EventListener(self.__queue),))
+        forecaster_thread = threading.Thread(target=forecaster.run, args=(EventListener(self.__events),))
         forecaster_thread.start()
 
         win32event.WaitForSingleObject(self.hWaitStop, win32event.INFINITE)
         log.info("Stopping forecaster")
-        self.__queue.put(IncomingEvent.TERMINATION)
+        self.__events.put(IncomingEvent.TERMINATION)
         forecaster_thread.join()
+        log.info(str(self.__events))
+        log.shutdown()
         servicemanager.LogMsg(EVENTLOG_INFORMATION_TYPE, PYS_SERVICE_STOPPED, (self._svc_name_, ""))
 
     def SvcStop(self):
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
-        win32event.SetEvent(self.hWaitStop)
+        if self.hWaitStop is not None:
+            win32event.SetEvent(self.hWaitStop)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,435 @@
+import bisect
+import collections
+import csv
+import datetime
+import heapq
+import itertools
+import json
+import os
+import queue
+import random
+import tempfile
+import time
+from concurrent import futures
+from pathlib import Path
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+import daytime
+import forecaster
+import forelogger as log
+import history
+import httpclient
+import keyboard
+import prefetch
+import solar
+import weather
+from events import EventListener, EventPipeline, IncomingEvent
+
+# Condition codes per provider and the cloud cover range of every synthetic weather state
+_SYNTHETIC_STATES = {
+    "clear": ({"openweathermap": 800, "weatherapi": 1000}, (0, 30), 4.0),
+    "cloudy": ({"openweathermap": 803, "weatherapi": 1006}, (40, 85), 3.0),
+    "overcast": ({"openweathermap": 804, "weatherapi": 1009}, (85, 100), 2.0),
+    "rain": ({"openweathermap": 502, "weatherapi": 1195}, (75, 100), 1.5),
+    "storm": ({"openweathermap": 211, "weatherapi": 1276}, (80, 100), 0.3),
+    "fog": ({"openweathermap": 741, "weatherapi": 1135}, (20, 60), 0.4),
+}
+_SYNTHETIC_STEP = datetime.timedelta(minutes=30)
+_SYNTHETIC_PERSISTENCE = 0.85  # Chance the weather stays the same for another step
+_FORECAST_STEP = datetime.timedelta(hours=3)
+_FORECAST_ENTRIES = 40  # Five days, like the real forecast API
+_OVERSLEEP_SECONDS = 1e-6
+_RANDOM_EVENTS = (IncomingEvent.SYSTEM_RESUME, IncomingEvent.KEYBOARD_CONNECTED)
+
+
+class VirtualClock(daytime.Clock):
+    # Jumps straight to the next deadline instead of sleeping. Injected actions run once the time reaches them,
+    # which is how scripted events and the end of the simulation get into the event pipeline
+
+    def __init__(self, start: datetime.datetime):
+        self.woke_at = time.perf_counter()
+        self.busy: list[float] = []  # Wall time from every wakeup to the next sleep
+        self.__now = start
+        self.__monotonic = 0.0
+        self.__actions: list[tuple[datetime.datetime, int, Callable[[], None]]] = []
+        self.__sequence = itertools.count()
+
+    def now(self) -> datetime.datetime:
+        return self.__now
+
+    def monotonic(self) -> float:
+        return self.__monotonic
+
+    def call_at(self, when: datetime.datetime, action: Callable[[], None]):
+        heapq.heappush(self.__actions, (when, next(self.__sequence), action))
+
+    def wait(self, source: queue.Queue, timeout: float | None):
+        self.busy.append(time.perf_counter() - self.woke_at)
+        deadline = None if timeout is None else self.__monotonic + timeout
+        while True:
+            try:
+                record = source.get_nowait()
+                self.woke_at = time.perf_counter()
+                return record
+            except queue.Empty:
+                pass
+            if self.__actions and (
+                deadline is None or (self.__actions[0][0] - self.__now).total_seconds() <= deadline - self.__monotonic
+            ):
+                when, _, action = heapq.heappop(self.__actions)
+                self.__advance(max(0.0, (when - self.__now).total_seconds()))
+                action()
+                continue
+            if deadline is None:
+                raise Exception("The simulation has nothing left to wait for")
+            # Like a real sleep, it wakes up a hair after the deadline. Landing exactly on it, a rounding error
+            # could leave the scheduler a fraction of a microsecond short forever
+            self.__advance(deadline - self.__monotonic + _OVERSLEEP_SECONDS)
+            self.woke_at = time.perf_counter()
+            raise queue.Empty
+
+    def __advance(self, seconds: float):
+        self.__monotonic += seconds
+        self.__now += datetime.timedelta(seconds=seconds)
+
+
+class InlineExecutor(futures.Executor):
+    # Runs background work right away on the caller's thread. On real threads it would finish at whatever virtual
+    # time the clock has jumped to by then, and no two runs would be alike
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> futures.Future:
+        future = futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+class WeatherSample:
+    def __init__(self, condition_codes: dict[str, int], cloud_pct: int):
+        self.cloud_pct = cloud_pct
+        self.__condition_codes = condition_codes
+
+    def condition_code(self, provider: str) -> int:
+        # Recorded samples only have the code of the provider they came from, it stands in for the others
+        return self.__condition_codes.get(provider, next(iter(self.__condition_codes.values())))
+
+
+class WeatherTrace:
+    # Every sample holds until the next one, samples before the first one repeat it
+
+    def __init__(self, samples: list[tuple[datetime.datetime, WeatherSample]]):
+        if not samples:
+            raise Exception("The weather trace is empty")
+        samples.sort(key=lambda sample: sample[0])
+        self.__times = [when for when, _ in samples]
+        self.__samples = [sample for _, sample in samples]
+
+    def at(self, when: datetime.datetime) -> WeatherSample:
+        return self.__samples[max(0, bisect.bisect_right(self.__times, when) - 1)]
+
+    def __len__(self):
+        return len(self.__samples)
+
+    @staticmethod
+    def synthetic(start: datetime.datetime, days: int, seed: int) -> "WeatherTrace":
+        rng = random.Random(seed)
+        names = list(_SYNTHETIC_STATES)
+        weights = [weight for _, _, weight in _SYNTHETIC_STATES.values()]
+        state = rng.choices(names, weights)[0]
+        samples = []
+        when = start
+        while when < start + datetime.timedelta(days=days):
+            if rng.random() > _SYNTHETIC_PERSISTENCE:
+                state = rng.choices(names, weights)[0]
+            codes, (cloud_min, cloud_max), _ = _SYNTHETIC_STATES[state]
+            samples.append((when, WeatherSample(codes, rng.randint(cloud_min, cloud_max))))
+            when += _SYNTHETIC_STEP
+        return WeatherTrace(samples)
+
+    @staticmethod
+    def from_csv(path: Path) -> "WeatherTrace":
+        # Takes the format history.py exports
+        samples = []
+        with path.open(newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                when = datetime.datetime.fromisoformat(row["timestamp"])
+                if when.tzinfo is None:
+                    when = when.replace(tzinfo=datetime.timezone.utc)
+                codes = {row["provider"]: int(row["condition_code"])}
+                samples.append((when, WeatherSample(codes, int(row["cloud_pct"]))))
+        return WeatherTrace(samples)
+
+
+class DaytimeTrace:
+    # Recorded days win, the rest comes from the solar calculator
+
+    def __init__(self, lat: float, lng: float, recorded: dict[datetime.date, dict[str, str]] | None = None):
+        self.__solar = solar.SolarEvents(lat, lng)
+        self.__recorded = recorded or {}
+
+    def on(self, date: datetime.date) -> dict[str, str]:
+        recorded = self.__recorded.get(date)
+        if recorded is not None:
+            return recorded
+        calculated = self.__solar.daytime(date)
+        return {
+            "sunrise": calculated["sunrise"],
+            "sunset": calculated["sunset"],
+            "civil_twilight_begin": calculated["civil_twilight_morning_begin"],
+            "civil_twilight_end": calculated["civil_twilight_evening_end"],
+        }
+
+    @staticmethod
+    def from_csv(lat: float, lng: float, path: Path) -> "DaytimeTrace":
+        # Columns: date, sunrise, sunset, civil_twilight_begin, civil_twilight_end, the way sunrise-sunset.org names them
+        with path.open(newline="", encoding="utf-8") as f:
+            recorded = {datetime.date.fromisoformat(row.pop("date")): row for row in csv.DictReader(f)}
+        return DaytimeTrace(lat, lng, recorded)
+
+
+class StubResponse:
+    def __init__(self, status_code: int, payload: dict | str):
+        self.status_code = status_code
+        self.text = payload if isinstance(payload, str) else json.dumps(payload)
+        self.__payload = payload
+
+    def json(self) -> dict | str:
+        return self.__payload
+
+
+class StubSession:
+    # Answers every API the forecaster calls from the traces, at the clock's time of the request
+
+    def __init__(self, clock: daytime.Clock, weather: WeatherTrace, daytimes: DaytimeTrace, place: dict):
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.__clock = clock
+        self.__weather = weather
+        self.__daytimes = daytimes
+        self.__place = place
+        self.__routes: dict[tuple[str, str], Callable[[dict[str, str]], StubResponse]] = {
+            ("api.ipify.org", "/"): lambda query: StubResponse(200, self.__place["ip"]),
+            ("api.ip2location.io", "/"): self.__location,
+            ("api.sunrise-sunset.org", "/json"): self.__daytime,
+            ("api.openweathermap.org", "/data/2.5/weather"): self.__openweathermap,
+            ("api.openweathermap.org", "/data/2.5/forecast"): self.__openweathermap_forecast,
+            ("api.weatherapi.com", "/v1/current.json"): self.__weatherapi,
+        }
+
+    def request(self, method: str, url: str, **kwargs) -> StubResponse:
+        parts = urlsplit(url)
+        self.calls[parts.hostname] += 1
+        route = self.__routes.get((parts.hostname, parts.path or "/"))
+        if route is None:
+            return StubResponse(404, {"message": f"{parts.hostname}{parts.path} is not simulated"})
+        return route({name: values[0] for name, values in parse_qs(parts.query).items()})
+
+    def close(self):
+        pass
+
+    def __location(self, query: dict[str, str]) -> StubResponse:
+        return StubResponse(
+            200,
+            {
+                "country_name": self.__place["country"],
+                "city_name": self.__place["city"],
+                "latitude": self.__place["lat"],
+                "longitude": self.__place["lng"],
+                "ip": self.__place["ip"],
+            },
+        )
+
+    def __daytime(self, query: dict[str, str]) -> StubResponse:
+        year, month, day = (int(part) for part in query["date"].split("-"))
+        return StubResponse(200, {"results": self.__daytimes.on(datetime.date(year, month, day)), "status": "OK"})
+
+    def __openweathermap(self, query: dict[str, str]) -> StubResponse:
+        sample = self.__weather.at(self.__clock.now())
+        return StubResponse(
+            200, {"weather": [{"id": sample.condition_code("openweathermap")}], "clouds": {"all": sample.cloud_pct}}
+        )
+
+    def __openweathermap_forecast(self, query: dict[str, str]) -> StubResponse:
+        # A perfect forecast: the trace itself, sampled the way the real API does
+        entries = []
+        for i in range(_FORECAST_ENTRIES):
+            when = self.__clock.now() + i * _FORECAST_STEP
+            sample = self.__weather.at(when)
+            entries.append(
+                {
+                    "dt": int(when.timestamp()),
+                    "weather": [{"id": sample.condition_code("openweathermap")}],
+                    "clouds": {"all": sample.cloud_pct},
+                }
+            )
+        return StubResponse(200, {"list": entries})
+
+    def __weatherapi(self, query: dict[str, str]) -> StubResponse:
+        sample = self.__weather.at(self.__clock.now())
+        return StubResponse(
+            200, {"current": {"cloud": sample.cloud_pct, "condition": {"code": sample.condition_code("weatherapi")}}}
+        )
+
+
+class CountingTransport(keyboard.Transport):
+    def __init__(self, clock: VirtualClock, config: keyboard.DeviceConfig):
+        self.turned_on = 0
+        self.turned_off = 0
+        self.by_day: collections.Counter[datetime.date] = collections.Counter()
+        self.latencies: list[float] = []  # Wall time from the wakeup to the send
+        self.__clock = clock
+        self.__config = config
+
+    def open(self):
+        pass
+
+    def send(self, payload: bytes):
+        self.latencies.append(time.perf_counter() - self.__clock.woke_at)
+        self.by_day[self.__clock.now().date()] += 1
+        if payload == self.__config.on_payload:
+            self.turned_on += 1
+        else:
+            self.turned_off += 1
+
+    def close(self):
+        pass
+
+
+class SimulationReport:
+    def __init__(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        wall_seconds: float,
+        clock: VirtualClock,
+        session: StubSession,
+        transport: CountingTransport,
+        pipeline: EventPipeline,
+        checks: list[history.HistoryRecord],
+    ):
+        self.start = start
+        self.end = end
+        self.wall_seconds = wall_seconds
+        self.toggles = transport.turned_on + transport.turned_off
+        self.turned_on = transport.turned_on
+        self.turned_off = transport.turned_off
+        self.max_daily_toggles = max(transport.by_day.values(), default=0)
+        self.api_calls = dict(session.calls)
+        self.weather_checks = len(checks)
+        self.dark_checks = sum(record.is_dark for record in checks)
+        self.wakeup_latencies = sorted(clock.busy)
+        self.send_latencies = sorted(transport.latencies)
+        self.pipeline = str(pipeline)
+
+    def __str__(self):
+        days = (self.end - self.start) / datetime.timedelta(days=1)
+        speedup = (self.end - self.start).total_seconds() / max(self.wall_seconds, 1e-9)
+        lines = [
+            f"Simulated {days:g} days from {self.start} to {self.end} in {self.wall_seconds:.2f} s ({speedup:,.0f}x)",
+            f"Backlight: {self.toggles} toggles ({self.turned_on} on, {self.turned_off} off), "
+            f"at most {self.max_daily_toggles} on a single day",
+            f"Weather checks: {self.weather_checks}, {self.dark_checks} of them dark",
+            f"API calls: {sum(self.api_calls.values())}",
+        ]
+        lines += [f"  {host}: {calls}" for host, calls in sorted(self.api_calls.items())]
+        lines += [
+            f"Decision latency, wakeup to sleep: {_latency_summary(self.wakeup_latencies)}",
+            f"Decision latency, wakeup to backlight: {_latency_summary(self.send_latencies)}",
+            self.pipeline,
+        ]
+        return "\n".join(lines)
+
+
+def simulate(
+    start: datetime.datetime,
+    days: int,
+    weather_trace: WeatherTrace,
+    daytime_trace: DaytimeTrace,
+    place: dict,
+    events_per_day: float = 0,
+    seed: int = 0,
+) -> SimulationReport:
+    # Drives the real control loop, only the clock, the HTTP session, the keyboard and the background threads are
+    # replaced.
+    # Expects forecaster.init() to have been called with a data folder of its own
+    end = start + datetime.timedelta(days=days)
+    clock = VirtualClock(start)
+    session = StubSession(clock, weather_trace, daytime_trace, place)
+    config = keyboard.DeviceConfig("simulated", 0, 0)
+    transport = CountingTransport(clock, config)
+    daytime.use_clock(clock)
+    httpclient.use_session(session)
+    keyboard.use_transport(transport, config)
+    executor = InlineExecutor()
+    weather.use_executor(executor)
+    prefetch.use_executor(executor)
+
+    pipeline = forecaster.create_event_pipeline()
+    rng = random.Random(seed)
+    for _ in range(round(days * events_per_day)):
+        event_type = rng.choice(_RANDOM_EVENTS)
+        clock.call_at(start + (end - start) * rng.random(), lambda event_type=event_type: pipeline.put(event_type))
+    clock.call_at(end, lambda: pipeline.put(IncomingEvent.TERMINATION))
+
+    log.info(f"Simulating {days} days from {start}")
+    started = time.perf_counter()
+    try:
+        forecaster.run(EventListener(pipeline))
+    except SystemExit:
+        pass  # The forecaster exits on the termination event
+    wall_seconds = time.perf_counter() - started
+    return SimulationReport(start, end, wall_seconds, clock, session, transport, pipeline, history.query(start, end))
+
+
+def _latency_summary(latencies: list[float]) -> str:
+    if not latencies:
+        return "no samples"
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (
+        f"{len(latencies)} samples, p50 {p50 * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replays days of forecaster behavior against a virtual clock")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date.today())
+    parser.add_argument("--lat", type=float, default=52.37)
+    parser.add_argument("--lng", type=float, default=4.89)
+    parser.add_argument("--weather-trace", type=Path, help="CSV exported by history.py, synthetic weather otherwise")
+    parser.add_argument(
+        "--daytime-trace", type=Path, help="CSV of sunrise-sunset.org results, the solar position otherwise"
+    )
+    parser.add_argument("--events-per-day", type=float, default=0, help="random resumes and keyboard reconnects")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Configured by the environment like the service, but the data folder is always a scratch one
+    data_dir = Path(tempfile.mkdtemp(prefix="keyboard-forecast-simulation-"))
+    os.environ["KEYBOARD_FORECAST_DATA_DIR"] = str(data_dir)
+    if "WEATHER_API_KEY" not in os.environ and "WEATHERAPI_API_KEY" not in os.environ:
+        os.environ["WEATHER_API_KEY"] = "simulation"
+    log.init(log.SinkType.FILE, file_path=data_dir / "simulation.log")
+    forecaster.init()
+
+    start_at = datetime.datetime.combine(args.start, datetime.time(), datetime.timezone.utc)
+    weather_trace = (
+        WeatherTrace.from_csv(args.weather_trace)
+        if args.weather_trace is not None
+        else WeatherTrace.synthetic(start_at, args.days, args.seed)
+    )
+    daytime_trace = (
+        DaytimeTrace.from_csv(args.lat, args.lng, args.daytime_trace)
+        if args.daytime_trace is not None
+        else DaytimeTrace(args.lat, args.lng)
+    )
+    place = {"country": "Simulated", "city": "Simulated", "lat": args.lat, "lng": args.lng, "ip": "192.0.2.1"}
+    report = simulate(start_at, args.days, weather_trace, daytime_trace, place, args.events_per_day, args.seed)
+    log.shutdown()
+    print(report)
+    print(f"Log and history are in {data_dir}")
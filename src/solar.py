@@ -0,0 +1,114 @@
+import datetime
+import math
+from typing import Iterable
+
+# Zenith angles used by the NOAA solar calculator
+_SUNRISE_ZENITH = 90.833  # Includes atmospheric refraction and the solar disc radius
+_CIVIL_TWILIGHT_ZENITH = 96.0
+
+# sunrise-sunset.org reports this timestamp when the event doesn't happen (polar day or night)
+_NO_EVENT = datetime.datetime(1970, 1, 1, 0, 0, 1, tzinfo=datetime.timezone.utc)
+
+_EPOCH_DATE = datetime.date(1970, 1, 1)
+_J2000 = 2451545.0
+_UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+
+class SolarEvents:
+    def __init__(self, lat: float, lng: float):
+        self.__lng = lng
+        self.__sin_lat = math.sin(math.radians(lat))
+        self.__cos_lat = math.cos(math.radians(lat))
+
+    def daytime(self, date: datetime.date) -> dict[str, str]:
+        return self.daytimes([date])[0]
+
+    def daytimes(self, dates: Iterable[datetime.date]) -> list[dict[str, str]]:
+        return [_to_daytime_dict(events) for events in self.epochs(dates)]
+
+    def epochs(self, dates: Iterable[datetime.date]) -> list[tuple[int, int, int, int]]:
+        # (sunrise, sunset, civil twilight begin, civil twilight end) in epoch seconds for every date
+        cos_sunrise_zenith = math.cos(math.radians(_SUNRISE_ZENITH))
+        cos_twilight_zenith = math.cos(math.radians(_CIVIL_TWILIGHT_ZENITH))
+        result = []
+        for date in dates:
+            day_start = (date - _EPOCH_DATE).days * 86400
+            # Solar parameters are evaluated at the approximate local noon
+            julian_day = _UNIX_EPOCH_JULIAN_DAY + (date - _EPOCH_DATE).days + 0.5 - self.__lng / 360
+            declination, equation_of_time = _sun_position(julian_day)
+            solar_noon = day_start + (720 - 4 * self.__lng - equation_of_time) * 60
+
+            sin_decl = math.sin(declination)
+            cos_decl = math.cos(declination)
+            sunrise, sunset = self.__events_around(solar_noon, cos_sunrise_zenith, sin_decl, cos_decl)
+            dawn, dusk = self.__events_around(solar_noon, cos_twilight_zenith, sin_decl, cos_decl)
+            result.append((sunrise, sunset, dawn, dusk))
+        return result
+
+    def __events_around(self, solar_noon: float, cos_zenith: float, sin_decl: float, cos_decl: float):
+        cos_hour_angle = (cos_zenith - self.__sin_lat * sin_decl) / (self.__cos_lat * cos_decl)
+        if not -1 <= cos_hour_angle <= 1:
+            no_event = int(_NO_EVENT.timestamp())
+            return no_event, no_event
+        half_day = math.degrees(math.acos(cos_hour_angle)) * 4 * 60
+        return round(solar_noon - half_day), round(solar_noon + half_day)
+
+
+def daytime(date: datetime.date, lat: float, lng: float) -> dict[str, str]:
+    return SolarEvents(lat, lng).daytime(date)
+
+
+def daytimes_for_year(year: int, lat: float, lng: float) -> list[dict[str, str]]:
+    return SolarEvents(lat, lng).daytimes(year_dates(year))
+
+
+def year_dates(year: int) -> list[datetime.date]:
+    first_day = datetime.date(year, 1, 1)
+    days_in_year = (datetime.date(year + 1, 1, 1) - first_day).days
+    return [first_day + datetime.timedelta(days=i) for i in range(days_in_year)]
+
+
+def _sun_position(julian_day: float) -> tuple[float, float]:
+    # Returns the solar declination in radians and the equation of time in minutes
+    jc = (julian_day - _J2000) / 36525
+
+    mean_long = math.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    mean_anomaly = math.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    eccentricity = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    center = math.radians(
+        math.sin(mean_anomaly) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+        + math.sin(2 * mean_anomaly) * (0.019993 - 0.000101 * jc)
+        + math.sin(3 * mean_anomaly) * 0.000289
+    )
+    omega = math.radians(125.04 - 1934.136 * jc)
+    apparent_long = mean_long + center - math.radians(0.00569 + 0.00478 * math.sin(omega))
+
+    seconds = 21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))
+    mean_obliquity = 23 + (26 + seconds / 60) / 60
+    obliquity = math.radians(mean_obliquity + 0.00256 * math.cos(omega))
+
+    declination = math.asin(math.sin(obliquity) * math.sin(apparent_long))
+
+    y = math.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * math.degrees(
+        y * math.sin(2 * mean_long)
+        - 2 * eccentricity * math.sin(mean_anomaly)
+        + 4 * eccentricity * y * math.sin(mean_anomaly) * math.cos(2 * mean_long)
+        - 0.5 * y * y * math.sin(4 * mean_long)
+        - 1.25 * eccentricity * eccentricity * math.sin(2 * mean_anomaly)
+    )
+    return declination, equation_of_time
+
+
+def _to_daytime_dict(events: tuple[int, int, int, int]) -> dict[str, str]:
+    sunrise, sunset, dawn, dusk = (_format_epoch(e) for e in events)
+    return {
+        "sunrise": sunrise,
+        "sunset": sunset,
+        "civil_twilight_morning_begin": dawn,
+        "civil_twilight_evening_end": dusk,
+    }
+
+
+def _format_epoch(epoch: int) -> str:
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat(timespec="seconds")
@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+
+class Storage:
+    def __init__(self, root: Path):
+        self.__root = root
+
+    @property
+    def root(self) -> Path:
+        return self.__root
+
+    def path(self, *parts: str | Path) -> Path:
+        return self.__root.joinpath(*parts)
+
+    def read_json(self, relative_path: str | Path):
+        with self.path(relative_path).open() as f:
+            return json.load(f)
+
+    def write_json(self, relative_path: str | Path, value):
+        path = self.path(relative_path)
+        os.makedirs(path.parent, exist_ok=True)
+        write_atomically(path, json.dumps(value, indent=4).encode())
+
+    def subdirs(self) -> list[Path]:
+        return [path for path in self.__root.iterdir() if path.is_dir()]
+
+    def remove_dir(self, relative_path: str | Path):
+        shutil.rmtree(self.path(relative_path), ignore_errors=True)
+
+
+def write_atomically(path: Path, content: bytes):
+    # Readers see either the old file or the new one, never a partially written one
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,67 +1,286 @@
-import requests
+import collections
+import copy
+import datetime
+import threading
+import time
+from concurrent import futures
+from typing import Callable
 
+import breaker
+import cache
 import datastore
+import daytime
 import forelogger as log
+import httpclient
 import location
+import metrics
+import rules
+
+
+class Observation:
+    def __init__(self, provider: str, is_dark: bool, condition_code: int, cloud_pct: int):
+        self.provider = provider
+        self.is_dark = is_dark
+        self.condition_code = condition_code
+        self.cloud_pct = cloud_pct
+        self.latency = 0.0  # Seconds the provider took to answer
+        self.cached = False  # Handed out again by the cache rather than fetched for this caller
+
+    def from_cache(self) -> "Observation":
+        observation = copy.copy(self)
+        observation.cached = True
+        return observation
+
+
+class Provider:
+    def __init__(
+        self,
+        name: str,
+        check: Callable[[location.Location, str], Observation],
+        api_key: Callable[[], str],
+        update_interval: float,
+    ):
+        self.name = name
+        self.update_interval = update_interval  # How often the provider refreshes its data, in seconds
+        self.stats = httpclient.LatencyStats()
+        self.breaker = breaker.get(f"weather:{name}")
+        self.__check = check
+        self.__api_key = api_key
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.__api_key())
+
+    def check(self, cur_loc: location.Location) -> Observation:
+        return self.breaker.call(self.__ask, cur_loc)
+
+    def __ask(self, cur_loc: location.Location) -> Observation:
+        _count_call(cur_loc)
+        started = time.perf_counter()
+        ok = False
+        try:
+            observation = self.__check(cur_loc, self.__api_key())
+            observation.latency = time.perf_counter() - started
+            ok = True
+            return observation
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats.record(elapsed, ok)
+            metrics.observe("weather_check_seconds", elapsed, provider=self.name, ok=str(ok).lower())
+
+    def expected_latency(self) -> float:
+        # Latency of getting a successful answer, assuming a failed call has to be repeated. Until there are enough
+        # samples every provider is assumed to take the hedge budget, so the configured order decides
+        if self.stats.samples < _MIN_SAMPLES_FOR_BUDGET:
+            return datastore.get_weather_hedge_budget_seconds()
+        return self.stats.percentile(90) / (1 - min(self.stats.error_rate, 0.9))
+
+    def hedge_budget(self) -> float:
+        if self.stats.samples < _MIN_SAMPLES_FOR_BUDGET:
+            return datastore.get_weather_hedge_budget_seconds()
+        return self.stats.percentile(90)
 
 
 def is_dark(cur_loc: location.Location) -> bool:
-    return _check_openweathermap(cur_loc, datastore.get_weather_api_key())
+    return observe(cur_loc).is_dark
+
+
+def observe(cur_loc: location.Location, wait: bool = True) -> Observation | None:
+    # Without waiting, an observation too old to hand out is fetched in the background and None is returned
+    providers = providers_by_preference()
+    if not providers:
+        raise Exception("No weather provider is configured")
+
+    # There's no point in asking a provider again before it has updated its data. The key is the place only, so
+    # re-ranking the providers doesn't throw the cache away, and the observation itself names whoever answered
+    primary = providers[0]
+    stale_ttl = primary.update_interval + datastore.get_weather_stale_seconds()
+    key = _key(cur_loc)
+    fetched = None
+
+    def fetch() -> Observation:
+        nonlocal fetched
+        fetched = _query(cur_loc, providers)
+        return fetched
+
+    try:
+        observation = _CACHE.get(key, primary.update_interval, stale_ttl, fetch, wait)
+    except breaker.CircuitOpenException:
+        # Every provider is being left alone for now, the last answer for this place beats none
+        last = _last_observation(key)
+        if last is None:
+            raise
+        return last
+    if observation is None:
+        if primary.breaker.allows_calls():
+            return None
+        # The background fetch won't bring anything either while every provider is being left alone
+        last = _last_observation(key)
+        if last is None:
+            raise breaker.CircuitOpenException(primary.breaker.name, primary.breaker.retry_in())
+        return last
+    # Hits, stale hits and answers shared with a concurrent caller all come from someone else's fetch
+    return observation if observation is fetched else observation.from_cache()
+
+
+def api_calls(cur_loc: location.Location) -> int:
+    # Provider calls made for the place so far, cache hits don't count but hedged, background and forecast fetches do
+    return _API_CALLS[_key(cur_loc)]
+
+
+def cache_ttl() -> float:
+    # How long an observation answers checks before the preferred provider is asked again, in seconds
+    providers = providers_by_preference()
+    return providers[0].update_interval if providers else 0.0
+
+
+def cache_stats() -> str:
+    return str(_CACHE)
+
+
+def register(provider: Provider):
+    _PROVIDERS[provider.name] = provider
+
+
+def use_executor(executor: futures.Executor):
+    # An executor that runs the fetches right away has no workers to run out of, so it can serve both pools
+    global _REFRESH_EXECUTOR, _HEDGE_EXECUTOR, _CACHE
+    _REFRESH_EXECUTOR = _HEDGE_EXECUTOR = executor
+    _CACHE = cache.ResultCache("weather", executor)
+
+
+def providers_by_preference() -> list[Provider]:
+    configured = [
+        _PROVIDERS[name]
+        for name in datastore.get_weather_providers()
+        if name in _PROVIDERS and _PROVIDERS[name].enabled
+    ]
+    # The configured order breaks ties, so it decides until there are stats to compare. Providers whose circuit is
+    # open go last, they're only asked once everything else is open too
+    return sorted(configured, key=lambda provider: (not provider.breaker.allows_calls(), provider.expected_latency()))
 
 
-def _check_weatherapi(cur_loc: location.Location, api_key: str) -> bool:
-    resp = requests.get(
+def forecast(cur_loc: location.Location) -> list[tuple[datetime.datetime, bool]]:
+    api_key = datastore.get_weather_api_key()
+    _count_call(cur_loc)
+    resp = httpclient.get(
+        f"https://api.openweathermap.org/data/2.5/forecast?units=metric&lat={cur_loc.lat}&lon={cur_loc.lng}&appid={api_key}"
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Failed to get weather forecast. Error is {resp.status_code} - '{resp.text}'")
+
+    entries = resp.json()["list"]
+    verdicts = rules.for_provider("openweathermap").evaluate(
+        [entry["weather"][0]["id"] for entry in entries], [entry["clouds"]["all"] for entry in entries]
+    )
+    series = [
+        (datetime.datetime.fromtimestamp(entry["dt"], datetime.timezone.utc), is_dark)
+        for entry, is_dark in zip(entries, verdicts)
+    ]
+    log.debug("Darkness forecast: %s", series)
+    _FORECASTS[_key(cur_loc)] = (daytime.now(), series)
+    return series
+
+
+def cached_forecast(
+    cur_loc: location.Location, max_age: datetime.timedelta
+) -> list[tuple[datetime.datetime, bool]] | None:
+    # Never waits on the network, the forecast is downloaded by whoever calls forecast()
+    fetched_at, series = _FORECASTS.get(_key(cur_loc), (None, None))
+    if fetched_at is None or daytime.now() - fetched_at > max_age:
+        return None
+    return series
+
+
+def _last_observation(key: tuple[float, float]) -> Observation | None:
+    last = _CACHE.peek(key)
+    if last is None:
+        return None
+    log.warn(f"No weather provider is available, going by the last {last.provider} observation")
+    return last.from_cache()
+
+
+def _count_call(cur_loc: location.Location):
+    with _API_CALLS_LOCK:
+        _API_CALLS[_key(cur_loc)] += 1
+
+
+def _key(cur_loc: location.Location) -> tuple[float, float]:
+    return round(cur_loc.lat, _CACHE_PRECISION), round(cur_loc.lng, _CACHE_PRECISION)
+
+
+def _query(cur_loc: location.Location, providers: list[Provider]) -> Observation:
+    if datastore.is_weather_hedging_enabled() and len(providers) > 1:
+        return _observe_hedged(cur_loc, providers[0], providers[1])
+    return providers[0].check(cur_loc)
+
+
+def _observe_hedged(cur_loc: location.Location, primary: Provider, secondary: Provider) -> Observation:
+    budget = primary.hedge_budget()
+    pending = {_HEDGE_EXECUTOR.submit(primary.check, cur_loc): primary}
+    done, _ = futures.wait(pending, timeout=budget)
+    if not done:
+        log.info(f"{primary.name} didn't answer in {budget:.2f}s, asking {secondary.name} as well")
+        pending[_HEDGE_EXECUTOR.submit(secondary.check, cur_loc)] = secondary
+    elif next(iter(done)).exception() is not None:
+        pending[_HEDGE_EXECUTOR.submit(secondary.check, cur_loc)] = secondary
+
+    error = None
+    for future in futures.as_completed(pending):
+        if future.exception() is not None:
+            error = future.exception()
+            log.warn(f"{pending[future].name} failed to answer: {error}")
+            continue
+        for other in pending:
+            other.cancel()  # Only stops calls that haven't started yet, running ones are ignored
+        log.info(f"{pending[future].name} answered first")
+        return future.result()
+    raise error
+
+
+def _check_weatherapi(cur_loc: location.Location, api_key: str) -> Observation:
+    resp = httpclient.get(
         f"https://api.weatherapi.com/v1/current.json?key={api_key}&q={cur_loc.lat},{cur_loc.lng}&aqi=no"
     )
     if resp.status_code != 200:
         raise Exception(f"Failed to get weather data. Error is {resp.status_code} - '{resp.text}'")
 
     weather = resp.json()["current"]
-    log.info(f"Weather forecast: {weather}")
+    log.debug("Weather forecast: %s", weather)
 
-    conditions = (
-        1135,  # Fog
-        1147,  # Freezing fog
-    )
     cloud_pct = weather["cloud"]
     condition_code = weather["condition"]["code"]
-    return cloud_pct >= 70 or condition_code in conditions
+    is_dark = rules.for_provider("weatherapi").is_dark(condition_code, cloud_pct)
+    return Observation("weatherapi", is_dark, condition_code, cloud_pct)
 
 
-def _check_openweathermap(cur_loc: location.Location, api_key: str) -> bool:
-    resp = requests.get(
+def _check_openweathermap(cur_loc: location.Location, api_key: str) -> Observation:
+    resp = httpclient.get(
         f"https://api.openweathermap.org/data/2.5/weather?units=metric&lat={cur_loc.lat}&lon={cur_loc.lng}&appid={api_key}"
     )
     if resp.status_code != 200:
         raise Exception(f"Failed to get weather data. Error is {resp.status_code} - '{resp.text}'")
 
     forecast = resp.json()
-    log.info(f"Weather forecast: {forecast}")
-
+    log.debug("Weather forecast: %s", forecast)
     condition_code = forecast["weather"][0]["id"]
-    if (
-        _openweathermap_foggy(condition_code)
-        or _openweathermap_snowy(condition_code)
-        or _openweathermap_rainy(condition_code)
-        or _openweathermap_thunderstorm(condition_code)
-    ):
-        return True
-
     cloud_pct = forecast["clouds"]["all"]
-    return cloud_pct >= 70
-
-
-def _openweathermap_foggy(condition_id: int) -> bool:
-    return 711 <= condition_id <= 781  # From smoke to tornado (lol)
-
-
-def _openweathermap_snowy(condition_id: int) -> bool:
-    return 600 <= condition_id <= 622
+    is_dark = rules.for_provider("openweathermap").is_dark(condition_code, cloud_pct)
+    return Observation("openweathermap", is_dark, condition_code, cloud_pct)
 
 
-def _openweathermap_rainy(condition_id: int) -> bool:
-    return 502 <= condition_id <= 531  # From heavy intensity to ragged shower rain
+_MIN_SAMPLES_FOR_BUDGET = 5
+_CACHE_PRECISION = 2  # About a kilometer
 
+# Stale refreshes wait on hedged fetches, so the two can't share a pool: refreshes filling every worker would wait
+# forever on fetches that never get one
+_REFRESH_EXECUTOR: futures.Executor = futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="weather-refresh")
+_HEDGE_EXECUTOR: futures.Executor = futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="weather")
+_PROVIDERS: dict[str, Provider] = {}
+_FORECASTS: dict[tuple[float, float], tuple[datetime.datetime, list[tuple[datetime.datetime, bool]]]] = {}
+_API_CALLS: collections.Counter[tuple[float, float]] = collections.Counter()
+_API_CALLS_LOCK = threading.Lock()
+_CACHE = cache.ResultCache("weather", _REFRESH_EXECUTOR)
 
-def _openweathermap_thunderstorm(condition_id: int) -> bool:
-    return 200 <= condition_id <= 232
+register(Provider("openweathermap", _check_openweathermap, datastore.get_weather_api_key, update_interval=600))
+register(Provider("weatherapi", _check_weatherapi, datastore.get_weatherapi_api_key, update_interval=900))
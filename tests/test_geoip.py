@@ -0,0 +1,192 @@
+import csv
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import datastore  # noqa: E402
+import forelogger as log  # noqa: E402
+import geoip  # noqa: E402
+import httpclient  # noqa: E402
+
+_PLACE = {"country_name": "Netherlands", "city_name": "Amsterdam", "latitude": 52.374, "longitude": 4.8897}
+_HEADER = ["ip_from", "ip_to", "country_code", "country_name", "region_name", "city_name", "latitude", "longitude"]
+
+
+class GeoIpDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.__root = tempfile.TemporaryDirectory()
+        self.root = Path(self.__root.name)
+        self.databases: list[geoip.GeoIpDatabase] = []
+
+    def tearDown(self):
+        for database in self.databases:
+            database.close()
+        self.__root.cleanup()
+
+    def build(self, rows: list[list[str]]) -> geoip.GeoIpDatabase:
+        csv_path = self.root / "ranges.csv"
+        with csv_path.open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(_HEADER)
+            writer.writerows(rows)
+        self.count = geoip.build(csv_path, self.root / "geoip.bin")
+        database = geoip.GeoIpDatabase(self.root / "geoip.bin")
+        self.databases.append(database)
+        return database
+
+    def test_lookup_finds_the_place(self):
+        # Unsorted on purpose, with integer and dotted quad addresses
+        database = self.build(
+            [
+                ["3232235520", "3232301055", "NL", "Netherlands", "North Holland", "Amsterdam", "52.374", "4.8897"],
+                ["10.0.0.0", "10.255.255.255", "DE", "Germany", "Berlin", "Berlin", "52.5244", "13.4105"],
+            ]
+        )
+        self.assertEqual(self.count, 2)
+        self.assertEqual(len(database), 2)
+        self.assertEqual(
+            database.lookup("192.168.1.1"),
+            {"country": "Netherlands", "city": "Amsterdam", "lat": 52.374, "lng": 4.8897, "ip": "192.168.1.1"},
+        )
+        self.assertEqual(database.lookup("10.1.2.3")["city"], "Berlin")
+
+    def test_range_boundaries(self):
+        database = self.build(
+            [
+                ["10.0.0.0", "10.0.0.255", "XX", "Testland", "Region", "First", "1", "2"],
+                ["10.0.1.0", "10.0.1.255", "XX", "Testland", "Region", "Second", "3", "4"],
+                ["10.0.3.0", "10.0.3.255", "XX", "Testland", "Region", "Third", "5", "6"],
+            ]
+        )
+        cases = {
+            "9.255.255.255": None,
+            "10.0.0.0": "First",
+            "10.0.0.255": "First",
+            "10.0.1.0": "Second",
+            "10.0.1.255": "Second",
+            "10.0.2.0": None,  # The gap between two ranges
+            "10.0.3.255": "Third",
+            "10.0.4.0": None,
+        }
+        for ip, city in cases.items():
+            with self.subTest(ip=ip):
+                found = database.lookup(ip)
+                self.assertEqual(found["city"] if found else None, city)
+
+    def test_whole_address_space(self):
+        database = self.build([["0", str(2**32 - 1), "XX", "Testland", "Region", "Everywhere", "0", "0"]])
+        self.assertEqual(database.lookup("0.0.0.0")["city"], "Everywhere")
+        self.assertEqual(database.lookup("255.255.255.255")["city"], "Everywhere")
+
+    def test_ipv6_rows_are_skipped(self):
+        database = self.build(
+            [
+                ["281470681743360", "281474976710655", "-", "-", "-", "-", "0", "0"],  # IPv4-mapped IPv6 addresses
+                ["2001:db8::", "2001:db8::ffff", "XX", "Testland", "Region", "Six", "0", "0"],
+                ["10.0.0.0", "10.0.0.255", "XX", "Testland", "Region", "Four", "1", "2"],
+            ]
+        )
+        self.assertEqual(self.count, 1)
+        self.assertEqual(database.lookup("10.0.0.1")["city"], "Four")
+        self.assertIsNone(database.lookup("2001:db8::1"))  # Only IPv4 addresses are looked up
+
+    def test_malformed_rows_are_skipped(self):
+        self.build(
+            [
+                ["10.0.0.0", "10.0.0.255", "XX", "Testland"],
+                ["not an address", "10.0.0.255", "XX", "Testland", "Region", "Nowhere", "1", "2"],
+                ["10.0.1.0", "10.0.1.255", "XX", "Testland", "Region", "Somewhere", "1", "2"],
+            ]
+        )
+        self.assertEqual(self.count, 1)
+
+    def test_missing_database(self):
+        with self.assertRaises(FileNotFoundError):
+            geoip.GeoIpDatabase(self.root / "missing.bin")
+
+    def test_other_file_is_rejected(self):
+        path = self.root / "geoip.bin"
+        path.write_bytes(b"ip_from,ip_to,country_code\n" * 4)
+        with self.assertRaises(Exception):
+            geoip.GeoIpDatabase(path)
+
+
+class _Response:
+    def __init__(self, payload: dict | str):
+        self.status_code = 200
+        self.text = payload if isinstance(payload, str) else json.dumps(payload)
+        self.__payload = payload
+
+    def json(self) -> dict | str:
+        return self.__payload
+
+
+class _Session:
+    # Answers ipify with the address set by the test and ip2location with a fixed place
+    def __init__(self, ip: str):
+        self.ip = ip
+        self.hosts: list[str] = []
+
+    def request(self, method: str, url: str, **kwargs) -> _Response:
+        host = urlsplit(url).hostname
+        self.hosts.append(host)
+        if host == "api.ipify.org":
+            return _Response(self.ip)
+        return _Response(_PLACE | {"ip": self.ip})
+
+    def close(self):
+        pass
+
+
+class LocationRefreshTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        log.init(log.SinkType.STD_OUT, level="ERROR")
+
+    def setUp(self):
+        self.__root = tempfile.TemporaryDirectory()
+        self.root = Path(self.__root.name)
+        self.enterContext(
+            mock.patch.dict(os.environ, KEYBOARD_FORECAST_DATA_DIR=str(self.root), LOCATION_CACHE_TTL_SECONDS="0")
+        )
+        os.environ.pop("GEOIP_DATABASE", None)
+        self.session = _Session("192.0.2.1")
+        httpclient.use_session(self.session)
+
+    def tearDown(self):
+        httpclient.close()
+        self.__root.cleanup()
+
+    def test_public_ip_is_not_checked_without_a_database(self):
+        datastore.init()
+        self.assertEqual(datastore.get_location()["city"], "Amsterdam")
+        self.session.ip = "198.51.100.1"
+        self.assertEqual(datastore.refresh_location()["city"], "Amsterdam")
+        self.assertEqual(self.session.hosts, ["api.ip2location.io"])
+
+    def test_new_public_ip_is_looked_up_in_the_database(self):
+        csv_path = self.root / "ranges.csv"
+        with csv_path.open("w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(
+                [
+                    ["192.0.2.0", "192.0.2.255", "NL", "Netherlands", "North Holland", "Amsterdam", "52.374", "4.8897"],
+                    ["198.51.100.0", "198.51.100.255", "DE", "Germany", "Berlin", "Berlin", "52.5244", "13.4105"],
+                ]
+            )
+        geoip.build(csv_path, self.root / "geoip.bin")
+        datastore.init()
+        self.assertEqual(datastore.get_location()["city"], "Amsterdam")
+        self.session.ip = "198.51.100.1"
+        self.assertEqual(datastore.refresh_location()["city"], "Berlin")
+        self.assertNotIn("api.ip2location.io", self.session.hosts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import http.server
+import os
+import sys
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import requests  # noqa: E402
+
+import forelogger as log  # noqa: E402
+import httpclient  # noqa: E402
+
+_RETRIES = 2
+_READ_TIMEOUT_SECONDS = 0.2
+
+
+class _StubServer:
+    # Answers each path with its queue of statuses, the last one repeats. "slow" paths sleep past the read timeout
+
+    def __init__(self):
+        self.statuses: dict[str, list[int]] = {}
+        self.hits: dict[str, int] = {}
+        self.__lock = threading.Lock()
+        self.__server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+
+    def url(self, path: str) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def next_status(self, path: str) -> int:
+        with self.__lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            statuses = self.statuses.get(path, [200])
+            return statuses.pop(0) if len(statuses) > 1 else statuses[0]
+
+    def __handler(self) -> type:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status = server.next_status(self.path)
+                if self.path.startswith("/slow"):
+                    time.sleep(_READ_TIMEOUT_SECONDS * 3)
+                body = b"ok"
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass  # The client gave up on a slow answer
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class HttpClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        log.init(log.SinkType.STD_OUT, level="ERROR")
+        os.environ.update(
+            HTTP_RETRIES=str(_RETRIES),
+            HTTP_RETRY_BACKOFF_SECONDS="0",
+            HTTP_CONNECT_TIMEOUT_SECONDS="1",
+            HTTP_READ_TIMEOUT_SECONDS=str(_READ_TIMEOUT_SECONDS),
+        )
+        httpclient.close()  # The next request creates a session with the settings above
+        cls.server = _StubServer()
+
+    @classmethod
+    def tearDownClass(cls):
+        httpclient.close()
+        cls.server.stop()
+
+    def test_success_is_not_retried(self):
+        resp = httpclient.get(self.server.url("/ok"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.hits["/ok"], 1)
+
+    def test_server_errors_are_retried(self):
+        self.server.statuses["/flaky"] = [503, 500, 200]
+        resp = httpclient.get(self.server.url("/flaky"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.server.hits["/flaky"], 3)
+
+    def test_rate_limit_is_retried_until_the_retries_run_out(self):
+        self.server.statuses["/limited"] = [429]
+        resp = httpclient.get(self.server.url("/limited"))
+        self.assertEqual(resp.status_code, 429)  # The last answer is returned for the caller to report
+        self.assertEqual(self.server.hits["/limited"], 1 + _RETRIES)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses["/missing"] = [404]
+        resp = httpclient.get(self.server.url("/missing"))
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(self.server.hits["/missing"], 1)
+
+    def test_post_is_not_retried(self):
+        self.server.statuses["/post"] = [503]
+        resp = httpclient.post(self.server.url("/post"))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(self.server.hits["/post"], 1)
+
+    def test_read_timeout_raises(self):
+        started = time.perf_counter()
+        with self.assertRaises(requests.exceptions.RequestException):
+            httpclient.get(self.server.url("/slow"))
+        self.assertEqual(self.server.hits["/slow"], 1 + _RETRIES)  # Read timeouts of a GET are retried as well
+        self.assertLess(time.perf_counter() - started, (1 + _RETRIES) * _READ_TIMEOUT_SECONDS * 3)
+
+    def test_latency_is_recorded(self):
+        stats = httpclient.latency_stats("127.0.0.1")
+        requests_before, errors_before = stats.requests, stats.errors
+        self.server.statuses["/recorded"] = [200]
+        self.server.statuses["/rejected"] = [404]
+        httpclient.get(self.server.url("/recorded"))
+        httpclient.get(self.server.url("/rejected"))
+        with self.assertRaises(requests.exceptions.RequestException):
+            httpclient.get(self.server.url("/slow-recorded"))
+        self.assertEqual(stats.requests, requests_before + 3)
+        self.assertEqual(stats.errors, errors_before + 2)
+        self.assertGreaterEqual(stats.percentile(100), _READ_TIMEOUT_SECONDS)
+
+
+class LatencyStatsTest(unittest.TestCase):
+    def test_percentiles_and_error_rate_cover_the_window(self):
+        stats = httpclient.LatencyStats(window=4)
+        for seconds, ok in [(9.0, False), (0.1, True), (0.2, True), (0.3, True), (0.4, False)]:
+            stats.record(seconds, ok)
+        self.assertEqual(stats.requests, 5)
+        self.assertEqual(stats.errors, 2)
+        self.assertEqual(stats.samples, 4)
+        self.assertEqual(stats.error_rate, 0.25)  # The first error has left the window
+        self.assertEqual(stats.percentile(50), 0.3)
+        self.assertEqual(stats.percentile(100), 0.4)
+
+    def test_empty_stats(self):
+        stats = httpclient.LatencyStats()
+        self.assertIsNone(stats.percentile(50))
+        self.assertEqual(stats.error_rate, 0.0)
+        self.assertEqual(str(stats), "no requests")
+
+
+if __name__ == "__main__":
+    unittest.main()
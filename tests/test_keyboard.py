@@ -0,0 +1,143 @@
+import errno
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import forelogger as log  # noqa: E402
+import keyboard  # noqa: E402
+
+_VENDOR_ID = 0x3434
+_PRODUCT_ID = 0x0361
+_USAGE_PAGE = 0xFF60
+_USAGE = 0x61
+_REPORT_LENGTH = 32
+
+# Descriptor fragments: a boot keyboard interface, and the raw HID one with the vendor usage page and usage
+_KEYBOARD_DESCRIPTOR = bytes([0x05, 0x01, 0x09, 0x06, 0xA1, 0x01, 0xC0])
+_RAW_HID_DESCRIPTOR = bytes([0x06, _USAGE_PAGE & 0xFF, _USAGE_PAGE >> 8, 0x09, _USAGE, 0xA1, 0x01, 0xC0])
+
+
+class _FifoReader:
+    # Stands in for the kernel taking reports off a hidraw node: reads the FIFO until its writer closes it, or until
+    # the limit when the keyboard is to be unplugged
+
+    def __init__(self, path: Path, limit: int | None = None):
+        self.path = path
+        self.data = b""
+        self.__limit = limit
+        self.__thread = threading.Thread(target=self.__read, daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> bytes:
+        # A reader whose node was never opened is still waiting for a writer, so one comes and goes
+        while self.__thread.is_alive():
+            try:
+                os.close(os.open(self.path, os.O_WRONLY | os.O_NONBLOCK))
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                time.sleep(0.01)  # The reader hasn't opened its end yet, or is just done
+        self.__thread.join(timeout=5)
+        return self.data
+
+    def __read(self):
+        with open(self.path, "rb", buffering=0) as fifo:
+            data = bytearray()
+            while (self.__limit is None or len(data) < self.__limit) and (chunk := fifo.read(4096)):
+                data += chunk
+            self.data = bytes(data)
+
+
+class HidrawTransportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        log.init(log.SinkType.STD_OUT, level="ERROR")
+
+    def setUp(self):
+        self.__root = tempfile.TemporaryDirectory()
+        root = Path(self.__root.name)
+        self.sysfs = root / "sys" / "class" / "hidraw"
+        self.dev = root / "dev"
+        self.dev.mkdir()
+        self.readers: dict[str, _FifoReader] = {}
+
+    def tearDown(self):
+        for reader in self.readers.values():
+            reader.stop()
+        self.__root.cleanup()
+
+    def add_node(self, name: str, hid_id: str, descriptor: bytes, read_limit: int | None = None):
+        device = self.sysfs / name / "device"
+        device.mkdir(parents=True)
+        (device / "uevent").write_text(f"DRIVER=hid-generic\nHID_ID={hid_id}\nHID_NAME=Test Keyboard\n")
+        (device / "report_descriptor").write_bytes(descriptor)
+        os.mkfifo(self.dev / name)
+        self.readers[name] = _FifoReader(self.dev / name, read_limit)
+
+    def transport(self) -> keyboard.HidrawTransport:
+        return keyboard.HidrawTransport(
+            _VENDOR_ID, _PRODUCT_ID, _USAGE_PAGE, _USAGE, _REPORT_LENGTH, sysfs_root=self.sysfs, dev_root=self.dev
+        )
+
+    def test_writes_reports_to_the_raw_hid_interface(self):
+        hid_id = f"0003:{_VENDOR_ID:08X}:{_PRODUCT_ID:08X}"
+        self.add_node("hidraw0", "0003:0000046D:0000C52B", _RAW_HID_DESCRIPTOR)  # Someone else's device
+        self.add_node("hidraw1", hid_id, _KEYBOARD_DESCRIPTOR)
+        self.add_node("hidraw2", hid_id, _RAW_HID_DESCRIPTOR)
+
+        transport = self.transport()
+        transport.open()
+        try:
+            transport.send(bytes.fromhex("310102"))
+            transport.send(bytes.fromhex("30"))
+        finally:
+            transport.close()
+
+        for name in ("hidraw0", "hidraw1"):
+            self.assertEqual(self.readers[name].stop(), b"")
+        written = self.readers["hidraw2"].stop()
+        report_size = 1 + _REPORT_LENGTH  # Report number 0 goes first
+        self.assertEqual(len(written), 2 * report_size)
+        on, off = written[:report_size], written[report_size:]
+        self.assertEqual(on, bytes([0x00, 0x31, 0x01, 0x02]) + bytes(report_size - 4))
+        self.assertEqual(off, bytes([0x00, 0x30]) + bytes(report_size - 2))  # Nothing left over from the ON payload
+
+    def test_unplugged_keyboard_fails_the_send(self):
+        report_size = 1 + _REPORT_LENGTH
+        self.add_node("hidraw0", f"0003:{_VENDOR_ID:08X}:{_PRODUCT_ID:08X}", _RAW_HID_DESCRIPTOR, report_size)
+        transport = self.transport()
+        transport.open()
+        try:
+            transport.send(bytes.fromhex("31"))
+            self.assertEqual(len(self.readers["hidraw0"].stop()), report_size)  # The node is gone after one report
+            with self.assertRaises(OSError):
+                transport.send(bytes.fromhex("30"))
+        finally:
+            transport.close()
+
+    def test_missing_keyboard_is_disconnected(self):
+        self.add_node("hidraw0", "0003:0000046D:0000C52B", _RAW_HID_DESCRIPTOR)
+        with self.assertRaises(keyboard.DisconnectedException):
+            self.transport().open()
+        self.assertEqual(self.readers["hidraw0"].stop(), b"")
+
+    def test_missing_sysfs_is_disconnected(self):
+        with self.assertRaises(keyboard.DisconnectedException):
+            self.transport().open()
+
+    def test_keyboard_without_raw_hid_interface_is_rejected(self):
+        self.add_node("hidraw0", f"0003:{_VENDOR_ID:08X}:{_PRODUCT_ID:08X}", _KEYBOARD_DESCRIPTOR)
+        with self.assertRaises(Exception) as raised:
+            self.transport().open()
+        self.assertNotIsInstance(raised.exception, keyboard.DisconnectedException)
+
+
+if __name__ == "__main__":
+    unittest.main()